@@ -1,303 +1,207 @@
-import pandas as pd
 import requests
-import time
 import os
 from dotenv import load_dotenv
 import json
+from .circuit_breakers import ServiceFailed, get_breaker
+from .service_limits import get_limiter, map_ordered
 
 load_dotenv()
 ab_base_url = os.getenv('AB_BASE_URL')
-headers = json.loads(os.getenv('AB_HEADERS'))
-rate_delay = float(os.getenv('AB_RATE_DELAY'))
-
-
-def get_feature_data(row: pd.Series) -> pd.Series:
-    row_data = {
-        'track_mbid': None,
-        'key': None,
-        'key_scale': None,
-        'key_confidence': None,
-        'danceability': None,
-        'bpm': None,
-        'instrumental': None,
-        'instrumental_confidence': None,
-        'gender': None,
-        'gender_confidence': None,
-        'danceable': None,
-        'danceable_confidence': None,
-        'tonal': None,
-        'tonal_confidence': None,
-        'timbre': None,
-        'timbre_confidence': None,
-        'electronic': None,
-        'electronic_confidence': None,
-        'party': None,
-        'party_confidence': None,
-        'aggressive': None,
-        'aggressive_confidence': None,
-        'acoustic': None,
-        'acoustic_confidence': None,
-        'happy': None,
-        'happy_confidence': None,
-        'sad': None,
-        'sad_confidence': None,
-        'relaxed': None,
-        'relaxed_confidence': None,
-        'gztan_model': None,
-        'gztan_genre_confidence': None,
-        'electronic_classification': None,
-        'electronic_genre_confidence': None,
-        'dortmund': None,
-        'dortmund_genre_confidence': None,
-        'rosamerica': None,
-        'rosamerica_confidence': None
-    }
-    low_level_data = get_low_level_data(row)
-    time.sleep(rate_delay)
-    row_data.update(low_level_data)
-
-    mbid = low_level_data.get('track_mbid', None)
-    if mbid is not None:
-        high_level_data = get_high_level_data(mbid)
-        time.sleep(rate_delay)
-        row_data.update(high_level_data)
-        print(f'MBID {mbid}: Fetched row_data.')
-    else:
-        print(f'MBID {mbid}: Could not fetch row_data.')
-
-    return pd.Series(row_data)
-
+headers = json.loads(os.getenv('AB_HEADERS', '{}'))
+request_timeout = float(os.getenv('AB_TIMEOUT', 10))
+
+# Max number of recordings per bulk request the AcousticBrainz API accepts
+BULK_SIZE = 25
+
+LOW_LEVEL_COLS = ['track_mbid', 'key', 'key_scale', 'key_confidence', 'danceability', 'bpm']
+
+# (feature, AcousticBrainz high-level classifier, classifier value the feature is 1 for), in row schema order
+HIGH_LEVEL_BINARY_FEATURES = [
+    ('instrumental', 'voice_instrumental', 'instrumental'),
+    ('gender', 'gender', 'male'),  # 1 = Male, 0 = Female
+    ('danceable', 'danceability', 'danceable'),
+    ('tonal', 'tonal_atonal', 'tonal'),
+    ('timbre', 'timbre', 'bright'),
+    # Moods
+    ('electronic', 'mood_electronic', 'electronic'),
+    ('party', 'mood_party', 'party'),
+    ('aggressive', 'mood_aggressive', 'aggressive'),
+    ('acoustic', 'mood_acoustic', 'acoustic'),
+    ('happy', 'mood_happy', 'happy'),
+    ('sad', 'mood_sad', 'sad'),
+    ('relaxed', 'mood_relaxed', 'relaxed'),
+]
+
+# (genre feature, its confidence column, AcousticBrainz high-level classifier), in row schema order
+HIGH_LEVEL_GENRE_FEATURES = [
+    ('gztan_model', 'gztan_genre_confidence', 'genre_tzanetakis'),
+    ('electronic_classification', 'electronic_genre_confidence', 'genre_electronic'),
+    ('dortmund', 'dortmund_genre_confidence', 'genre_dortmund'),
+    ('rosamerica', 'rosamerica_confidence', 'genre_rosamerica'),
+]
+
+HIGH_LEVEL_COLS = ([col for feature, _, _ in HIGH_LEVEL_BINARY_FEATURES for col in (feature, f'{feature}_confidence')] +
+                   [col for genre, confidence, _ in HIGH_LEVEL_GENRE_FEATURES for col in (genre, confidence)])
+
+# Every column of a track's feature data row
+FEATURE_DATA_COLS = LOW_LEVEL_COLS + HIGH_LEVEL_COLS
+
+
+def get_ab(url, params=None):
+    """
+    Sends a GET request to the AcousticBrainz API within its shared rate limit, and backs every worker off as the
+    response asks (Retry-After on a 429/503, or an exhausted X-RateLimit-Remaining).
+
+    :param url: AcousticBrainz API URL
+    :param params: Optional query parameters
+    :return: requests.Response
+    :raises ServiceUnavailable: If the AcousticBrainz circuit is open
+    :raises ServiceFailed: If the request failed, timed out, or got a 5xx or 429 response
+    """
+
+    breaker = get_breaker('acousticbrainz')
+    breaker.check()
+    limiter = get_limiter('acousticbrainz')
+    try:
+        with limiter.slot():
+            response = requests.get(url, params=params, headers=headers, timeout=request_timeout)
+    except requests.RequestException as e:
+        breaker.record_failure()
+        raise ServiceFailed('acousticbrainz', e) from e
 
-# Tries to fetch low-level AcousticBrainz API data for a given row
-def get_low_level_data(row: pd.Series):
-    track_id = row['track_mbid']
+    limiter.observe(response.status_code, response.headers)
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if response.status_code >= 500 or response.status_code == 429:
+        raise ServiceFailed('acousticbrainz', f'HTTP {response.status_code}')
+    return response
+
+
+def get_feature_records(track_mbids):
+    """
+    Fetches the AcousticBrainz data of every track with bulk requests of up to BULK_SIZE recordings each (sent
+    concurrently): one round of low-level requests, then one round of high-level requests for the recordings that had
+    low-level data.
+
+    :param track_mbids: List of recording MBIDs
+    :return: Dict of recording MBID -> its feature data row (a dict of the FEATURE_DATA_COLS, all None with
+        track_mbid included if it has no low-level data), for every distinct MBID in order
+    """
+
+    track_mbids = list(dict.fromkeys(track_mbids))
+    low_level_docs = get_bulk_data('low-level', track_mbids)
+    low_level_data = {mbid: parse_low_level_data(mbid, low_level_docs.get(mbid)) for mbid in track_mbids}
+
+    found_mbids = [mbid for mbid, data in low_level_data.items() if data['track_mbid'] is not None]
+    high_level_docs = get_bulk_data('high-level', found_mbids)
+
+    records = {}
+    for track_mbid in track_mbids:
+        row_data = dict.fromkeys(FEATURE_DATA_COLS)
+        row_data.update(low_level_data[track_mbid])
+        if row_data['track_mbid'] is not None:
+            row_data.update(parse_high_level_data(high_level_docs.get(track_mbid)))
+        records[track_mbid] = row_data
+
+    print(f'Fetched AcousticBrainz data of {len(found_mbids)} of {len(track_mbids)} tracks')
+    return records
+
+
+def get_bulk_data(level, track_mbids):
+    """
+    Fetches AcousticBrainz documents of many recordings, BULK_SIZE per request.
+
+    :param level: 'low-level' or 'high-level'
+    :param track_mbids: List of recording MBIDs
+    :return: Dict of recording MBID -> its (first) document, for the recordings AcousticBrainz has data for
+    """
+
+    chunks = [track_mbids[i:i + BULK_SIZE] for i in range(0, len(track_mbids), BULK_SIZE)]
+    docs = {}
+    for chunk_docs in map_ordered(lambda chunk: get_bulk_chunk(level, chunk), chunks):
+        docs.update(chunk_docs)
+    return docs
+
+
+def get_bulk_chunk(level, track_mbids):
+    """
+    :param level: 'low-level' or 'high-level'
+    :param track_mbids: List of up to BULK_SIZE recording MBIDs
+    :return: Dict of recording MBID -> its (first) document, for the recordings AcousticBrainz has data for
+    :raises ServiceUnavailable: If AcousticBrainz is unavailable or the request failed (see get_ab()), rather than
+        answering that it has no data
+    """
 
     r = {}
-    ab_low_level_url = f'{ab_base_url}/api/v1/{track_id}/low-level'
+    ab_bulk_url = f'{ab_base_url}/api/v1/{level}'
 
     try:
-        response = requests.get(ab_low_level_url, headers=headers)
-        response.raise_for_status()  # Raise an HTTPError for bad responses
+        response = get_ab(ab_bulk_url, params={'recording_ids': ';'.join(track_mbids)})
+        response.raise_for_status()  # Raise an HTTPError for other bad responses, e.g. a 400 for malformed MBIDs
         r = response.json()
 
     except requests.HTTPError as http_err:
-        print(f"Low-level request failed for MBID: {track_id}. Error: {http_err}")
+        print(f"Bulk {level} request failed for {len(track_mbids)} MBIDs. Error: {http_err}")
 
-        # Too many API calls
-        status_code = response.status_code
-        if status_code in [503, 429]:
-            # Add an extra delay
-            time.sleep(rate_delay)
+    # The response maps each recording found to its submissions by offset ("0" is the first), next to an
+    # 'mbid_mapping' of any redirected MBIDs
+    docs = {}
+    for track_mbid in track_mbids:
+        submissions = r.get(track_mbid) or r.get(track_mbid.lower()) or {}
+        if submissions.get('0'):
+            docs[track_mbid] = submissions['0']
+    return docs
 
-    # Handle non-HTTP errors
-    except requests.RequestException as e:
-        print(f"Request failed for MBID: {track_id}. Error: {e}. Error not for retrying.")
+
+def parse_low_level_data(track_mbid, r):
+    """
+    :param track_mbid: Recording MBID
+    :param r: The recording's low-level AcousticBrainz document (None or empty if there is none)
+    :return: Dict of the LOW_LEVEL_COLS, all None (track_mbid included) if there is no low-level data
+    """
 
     # A response with low-level data was found
     if r:
         try:
-            key = r['tonal']['key_key']
-            key_scale = r['tonal']['key_scale']
-            key_confidence = r['tonal']['key_strength']
-            danceability = r['rhythm']['danceability']
-            bpm = int(round(r['rhythm']['bpm']))
-        except KeyError as e:
             return {
-                'track_mbid': None,
-                'key': None,
-                'key_scale': None,
-                'key_confidence': None,
-                'danceability': None,
-                'bpm': None
+                'track_mbid': track_mbid,
+                'key': r['tonal']['key_key'],
+                'key_scale': r['tonal']['key_scale'],
+                'key_confidence': r['tonal']['key_strength'],
+                'danceability': r['rhythm']['danceability'],
+                'bpm': int(round(r['rhythm']['bpm']))
             }
-        return {
-            'track_mbid': track_id,
-            'key': key,
-            'key_scale': key_scale,
-            'key_confidence': key_confidence,
-            'danceability': danceability,
-            'bpm': bpm
-        }
+        except (KeyError, TypeError, ValueError):  # Missing fields, or a null or NaN bpm
+            pass
 
     # No response with low-level data was found from that song's MBIDs. This means that AcousticBrainz does not have audio feature data for this song.
-    else:
-        return {
-            'track_mbid': None,
-            'key': None,
-            'key_scale': None,
-            'key_confidence': None,
-            'danceability': None,
-            'bpm': None
-        }
+    return dict.fromkeys(LOW_LEVEL_COLS)
 
 
-# Tries to fetch high-level AcousticBrainz API data for a given mbid (which had low-level data)
-def get_high_level_data(track_mbid):
-    ab_high_level_url = f'{ab_base_url}/api/v1/{track_mbid}/high-level'
-
-    r = {}
-    try:
-        response = requests.get(ab_high_level_url, headers=headers)
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        r = response.json()
-    except requests.HTTPError as http_err:
-        print(f"Low-level request failed for MBID: {track_mbid}. Error: {http_err}")
-
-        # Too many API calls
-        status_code = response.status_code
-        if status_code in [503, 429]:
-            # Add an extra delay
-            time.sleep(rate_delay)
-
-    # Handle non-HTTP errors
-    except requests.RequestException as e:
-        print(f"Request failed for MBID: {track_mbid}. Error: {e}. Error not for retrying.")
-
-    # A response with high-level data was found
-    if r:
-        r = r['highlevel']
-        if r['voice_instrumental']['value'] == 'instrumental':
-            instrumental = 1
-        else:
-            instrumental = 0
-        instrumental_confidence = r['voice_instrumental']['probability']
-        if r['gender']['value'] == 'male':
-            gender = 1  # Male
-        else:
-            gender = 0  # Female
-        gender_confidence = r['gender']['probability']
-        if r['danceability']['value'] == 'danceable':
-            danceable = 1
-        else:
-            danceable = 0
-        danceable_confidence = r['danceability']['probability']
-        if r['tonal_atonal']['value'] == 'tonal':
-            tonal = 1
-        else:
-            tonal = 0
-        tonal_confidence = r['tonal_atonal']['probability']
-        if r['timbre']['value'] == 'bright':
-            timbre = 1
-        else:
-            timbre = 0
-        timbre_confidence = r['timbre']['probability']
-
-        # Moods
-        if r['mood_electronic']['value'] == 'electronic':
-            electronic = 1
-        else:
-            electronic = 0
-        electronic_confidence = r['mood_electronic']['probability']
-        if r['mood_party']['value'] == 'party':
-            party = 1
-        else:
-            party = 0
-        party_confidence = r['mood_party']['probability']
-        if r['mood_aggressive']['value'] == 'aggressive':
-            aggressive = 1
-        else:
-            aggressive = 0
-        aggressive_confidence = r['mood_aggressive']['probability']
-        if r['mood_acoustic']['value'] == 'acoustic':
-            acoustic = 1
-        else:
-            acoustic = 0
-        acoustic_confidence = r['mood_acoustic']['probability']
-        if r['mood_happy']['value'] == 'happy':
-            happy = 1
-        else:
-            happy = 0
-        happy_confidence = r['mood_happy']['probability']
-        if r['mood_sad']['value'] == 'sad':
-            sad = 1
-        else:
-            sad = 0
-        sad_confidence = r['mood_sad']['probability']
-        if r['mood_relaxed']['value'] == 'relaxed':
-            relaxed = 1
-        else:
-            relaxed = 0
-        relaxed_confidence = r['mood_relaxed']['probability']
-
-        # Genre Clustering
-        gztan_model = r['genre_tzanetakis']['value']
-        gztan_genre_confidence = r['genre_tzanetakis']['probability']
-        electronic_classification = r['genre_electronic']['value']
-        electronic_genre_confidence = r['genre_electronic']['probability']
-        dortmund = r['genre_dortmund']['value']
-        dortmund_genre_confidence = r['genre_dortmund']['probability']
-        rosamerica = r['genre_rosamerica']['value']
-        rosamerica_confidence = r['genre_rosamerica']['probability']
-
-        return {
-            'instrumental': instrumental,
-            'instrumental_confidence': instrumental_confidence,
-            'gender': gender,
-            'gender_confidence': gender_confidence,
-            'danceable': danceable,
-            'danceable_confidence': danceable_confidence,
-            'tonal': tonal,
-            'tonal_confidence': tonal_confidence,
-            'timbre': timbre,
-            'timbre_confidence': timbre_confidence,
-            'electronic': electronic,
-            'electronic_confidence': electronic_confidence,
-            'party': party,
-            'party_confidence': party_confidence,
-            'aggressive': aggressive,
-            'aggressive_confidence': aggressive_confidence,
-            'acoustic': acoustic,
-            'acoustic_confidence': acoustic_confidence,
-            'happy': happy,
-            'happy_confidence': happy_confidence,
-            'sad': sad,
-            'sad_confidence': sad_confidence,
-            'relaxed': relaxed,
-            'relaxed_confidence': relaxed_confidence,
-            'gztan_model': gztan_model,
-            'gztan_genre_confidence': gztan_genre_confidence,
-            'electronic_classification': electronic_classification,
-            'electronic_genre_confidence': electronic_genre_confidence,
-            'dortmund': dortmund,
-            'dortmund_genre_confidence': dortmund_genre_confidence,
-            'rosamerica': rosamerica,
-            'rosamerica_confidence': rosamerica_confidence
-        }
+def parse_high_level_data(r):
+    """
+    :param r: A recording's high-level AcousticBrainz document (None or empty if there is none)
+    :return: Dict of the HIGH_LEVEL_COLS: each binary classification as 1/0 with the classifier's probability, and each
+        genre classification with its probability (all None if there is no high-level data)
+    """
 
     # No response with high-level data was found from that song's MBIDs. This means that AcousticBrainz does not have
     # audio feature data for this track.
-    else:
-        return {
-            'instrumental': None,
-            'instrumental_confidence': None,
-            'gender': None,
-            'gender_confidence': None,
-            'danceable': None,
-            'danceable_confidence': None,
-            'tonal': None,
-            'tonal_confidence': None,
-            'timbre': None,
-            'timbre_confidence': None,
-            'electronic': None,
-            'electronic_confidence': None,
-            'party': None,
-            'party_confidence': None,
-            'aggressive': None,
-            'aggressive_confidence': None,
-            'acoustic': None,
-            'acoustic_confidence': None,
-            'happy': None,
-            'happy_confidence': None,
-            'sad': None,
-            'sad_confidence': None,
-            'relaxed': None,
-            'relaxed_confidence': None,
-            'gztan_model': None,
-            'gztan_genre_confidence': None,
-            'electronic_classification': None,
-            'electronic_genre_confidence': None,
-            'dortmund': None,
-            'dortmund_genre_confidence': None,
-            'rosamerica': None,
-            'rosamerica_confidence': None
-        }
+    if not r:
+        return dict.fromkeys(HIGH_LEVEL_COLS)
+
+    # A response with high-level data was found
+    r = r['highlevel']
+    data = {}
+    for feature, classifier, positive_value in HIGH_LEVEL_BINARY_FEATURES:
+        data[feature] = 1 if r[classifier]['value'] == positive_value else 0
+        data[f'{feature}_confidence'] = r[classifier]['probability']
+
+    # Genre Clustering
+    for genre, confidence, classifier in HIGH_LEVEL_GENRE_FEATURES:
+        data[genre] = r[classifier]['value']
+        data[confidence] = r[classifier]['probability']
+
+    return data
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Default (consecutive failures that open the circuit, seconds it stays open before a trial call), overridable per
+# service with <SERVICE>_BREAKER_FAILURES and <SERVICE>_BREAKER_RESET
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class ServiceUnavailable(Exception):
+    """
+    Raised instead of calling an external service whose circuit is open.
+    """
+
+    def __init__(self, service):
+        super().__init__(f'{service} is unavailable (circuit open), skipping it')
+        self.service = service
+
+
+class ServiceFailed(ServiceUnavailable):
+    """
+    Raised when a call to an external service fails (a connection error, a timeout, a 5xx, or a 429 after backing off),
+    so callers skip the service as they do when its circuit is open, rather than taking the failure for missing data.
+    """
+
+    def __init__(self, service, cause):
+        Exception.__init__(self, f'{service} request failed ({cause}), skipping it')
+        self.service = service
+        self.cause = cause
+
+
+class CircuitBreaker:
+    """
+    Fails calls to one external service fast while it is unhealthy. The circuit opens after failure_threshold
+    consecutive failures (connection errors, timeouts, or 5xx responses), rejects every call for reset_timeout seconds,
+    then lets a single trial call through, which closes it again or reopens it. Each worker keeps its own state.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        """
+        :param name: Service name
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds the circuit stays open before a trial call
+        """
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Call before every call to the service.
+
+        :raises ServiceUnavailable: If the circuit is open, or half open with a trial call already in flight
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                if now - self.opened_at < self.reset_timeout:
+                    raise ServiceUnavailable(self.name)
+                self.state = 'half_open'
+                self.trial_started = None
+
+            if self.state == 'half_open':
+                # A trial call that never reported back (e.g. killed at a request's deadline) is given up on
+                if self.trial_started is not None and now - self.trial_started < self.reset_timeout:
+                    raise ServiceUnavailable(self.name)
+                self.trial_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print(f'Closing the {self.name} circuit')
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                print(f'Opening the {self.name} circuit for {self.reset_timeout:.0f} s after {self.failures} failures')
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.trial_started = None
+
+
+def get_breaker(service):
+    """
+    :param service: Service name, e.g. 'spotify', 'musicbrainz', or 'acousticbrainz'
+    :return: The worker's CircuitBreaker for the service
+    """
+
+    with _breakers_lock:
+        if service not in _breakers:
+            prefix = service.upper()
+            _breakers[service] = CircuitBreaker(
+                service,
+                int(os.getenv(f'{prefix}_BREAKER_FAILURES', DEFAULT_FAILURE_THRESHOLD)),
+                float(os.getenv(f'{prefix}_BREAKER_RESET', DEFAULT_RESET_TIMEOUT)),
+            )
+        return _breakers[service]
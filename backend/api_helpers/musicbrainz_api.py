@@ -1,20 +1,76 @@
-import musicbrainzngs
 import os
 from dotenv import load_dotenv
+from .circuit_breakers import ServiceFailed, ServiceUnavailable, get_breaker
+from .service_limits import get_limiter
 
 load_dotenv()
 
-# Initialize MusicBrainz
-musicbrainzngs.set_useragent(os.getenv('MB_APP'), os.getenv('MB_VER'), os.getenv('MB_CONTACT'))
+_musicbrainzngs = None
+
+
+def get_musicbrainzngs():
+    """
+    Imports and initializes MusicBrainz on first use, so importing this module stays cheap.
+
+    :return: The musicbrainzngs module
+    """
+
+    global _musicbrainzngs
+    if _musicbrainzngs is None:
+        import musicbrainzngs
+
+        musicbrainzngs.set_useragent(os.getenv('MB_APP'), os.getenv('MB_VER'), os.getenv('MB_CONTACT'))
+        # Requests are rate limited by the shared 'musicbrainz' token bucket instead of per process
+        musicbrainzngs.set_rate_limit(False)
+        _musicbrainzngs = musicbrainzngs
+    return _musicbrainzngs
+
+
+def call_musicbrainz(method, *args, **kwargs):
+    """
+    Calls a musicbrainzngs function within MusicBrainz's shared rate limit and circuit breaker, backing every worker off
+    if the request was rate limited (a 429/503).
+
+    :param method: Name of the musicbrainzngs function
+    :return: The function's result
+    :raises ServiceUnavailable: If the MusicBrainz circuit is open
+    :raises ServiceFailed: If the request failed, timed out, or got a 5xx or 429 response
+    :raises musicbrainzngs.WebServiceError: For other error responses, e.g. a 404
+    """
+
+    musicbrainzngs = get_musicbrainzngs()
+    breaker = get_breaker('musicbrainz')
+    breaker.check()
+    limiter = get_limiter('musicbrainz')
+    try:
+        with limiter.slot():
+            result = getattr(musicbrainzngs, method)(*args, **kwargs)
+    except musicbrainzngs.WebServiceError as e:
+        # Network errors have no status code
+        cause = getattr(e, 'cause', None)
+        status_code = getattr(cause, 'code', None)
+        limiter.observe(status_code, getattr(cause, 'headers', None))
+        if status_code is None or status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if status_code is None or status_code >= 500 or status_code == 429:
+            raise ServiceFailed('musicbrainz', e) from e
+        raise
+
+    breaker.record_success()
+    return result
 
 
 def get_track_id(artist_mbid, track_name):
     """
     Search for a track in MusicBrainz by artist MBID and track name.
     Returns the MusicBrainz Recording ID if found, else None.
+    Raises ServiceUnavailable if MusicBrainz is unavailable or the request failed (see call_musicbrainz()).
     """
+    musicbrainzngs = get_musicbrainzngs()
     try:
-        result = musicbrainzngs.search_recordings(artist=artist_mbid, recording=track_name, limit=1)
+        result = call_musicbrainz('search_recordings', artist=artist_mbid, recording=track_name, limit=1)
         recordings = result.get('recording-list', [])
         if recordings:
             recording = recordings[0]
@@ -26,3 +82,25 @@ def get_track_id(artist_mbid, track_name):
     except musicbrainzngs.WebServiceError as e:
         print(f"MusicBrainz error while searching for '{track_name}': {e}")
         return None
+
+
+def get_spotify_url(artist_mbid):
+    """
+    Looks up the artist's Spotify link among their MusicBrainz URL relationships.
+    Returns the Spotify artist URL if found, else None.
+    """
+    musicbrainzngs = get_musicbrainzngs()
+    try:
+        result = call_musicbrainz('get_artist_by_id', artist_mbid, includes=['url-rels'])
+    except musicbrainzngs.WebServiceError as e:
+        print(f"MusicBrainz error while looking up the links of artist '{artist_mbid}': {e}")
+        return None
+    except ServiceUnavailable as e:
+        # The name search on Spotify can still resolve the artist
+        print(e)
+        return None
+
+    for relation in result['artist'].get('url-relation-list', []):
+        if 'open.spotify.com/artist/' in relation.get('target', ''):
+            return relation['target']
+    return None
@@ -0,0 +1,458 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Default (max concurrent calls per worker, requests per second, burst capacity) per external service, overridable
+# with <SERVICE>_CONCURRENCY, <SERVICE>_RATE, and <SERVICE>_BURST. The rate and burst are shared by all workers.
+# <SERVICE>_BACKGROUND_RESERVE sets the tokens background calls leave in the bucket (see ServiceLimiter).
+# MusicBrainz allows about one request per second, and AcousticBrainz 10 requests per 10 seconds.
+DEFAULT_LIMITS = {
+    'spotify': (4, 10.0, 10),
+    'musicbrainz': (1, 1.0, 1),
+    'acousticbrainz': (4, 1.0, 10),
+}
+
+# Seconds to back off after a 429/503 without a Retry-After header
+DEFAULT_BACKOFF = 1.0
+
+# Key marking a gevent spawn tree whose calls are background work (see background_calls())
+BACKGROUND_KEY = 'service_limits_background'
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_bucket_store = None
+_bucket_store_lock = threading.Lock()
+
+
+class LocalBucketStore:
+    """
+    Token buckets of this process only.
+    """
+
+    def __init__(self):
+        self._buckets = {}  # service -> state
+        self._lock = threading.Lock()
+
+    def take(self, service, rate, burst, reserve=0):
+        with self._lock:
+            state = self._buckets.setdefault(service, new_bucket_state(burst))
+            wait = take_token(state, rate, burst, time.time(), reserve)
+        return wait
+
+    def block(self, service, seconds):
+        with self._lock:
+            state = self._buckets.setdefault(service, new_bucket_state(0))
+            state['blocked_until'] = max(state['blocked_until'], time.time() + seconds)
+
+
+class FileBucketStore:
+    """
+    Token buckets shared by all worker processes on one host, one JSON file per service in RATE_LIMIT_DIR, updated
+    under an exclusive file lock.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _state(self, service, burst):
+        with open(os.path.join(self.directory, f'{service}.json'), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                data = f.read()
+                state = json.loads(data) if data else new_bucket_state(burst)
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def take(self, service, rate, burst, reserve=0):
+        with self._state(service, burst) as state:
+            wait = take_token(state, rate, burst, time.time(), reserve)
+        return wait
+
+    def block(self, service, seconds):
+        with self._state(service, 0) as state:
+            state['blocked_until'] = max(state['blocked_until'], time.time() + seconds)
+
+
+class RedisBucketStore:
+    """
+    Token buckets shared by every worker on every host, one Redis hash per service updated atomically by Lua scripts
+    (using the Redis server's clock).
+    """
+
+    TAKE_SCRIPT = """
+        local now_parts = redis.call('TIME')
+        local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+        local rate, burst, reserve = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'blocked_until')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        local blocked_until = tonumber(state[3]) or 0
+        tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+        local wait = 0
+        if blocked_until > now then
+            wait = blocked_until - now
+        elseif tokens >= 1 + reserve then
+            tokens = tokens - 1
+        else
+            wait = (1 + reserve - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now, 'blocked_until', blocked_until)
+        redis.call('EXPIRE', KEYS[1], 3600)
+        return tostring(wait)
+    """
+
+    BLOCK_SCRIPT = """
+        local now_parts = redis.call('TIME')
+        local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+        local blocked_until = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+        redis.call('HSET', KEYS[1], 'blocked_until', math.max(blocked_until, now + tonumber(ARGV[1])))
+        redis.call('EXPIRE', KEYS[1], 3600)
+        return 1
+    """
+
+    def __init__(self):
+        import redis
+
+        client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        self._take = client.register_script(self.TAKE_SCRIPT)
+        self._block = client.register_script(self.BLOCK_SCRIPT)
+
+    def take(self, service, rate, burst, reserve=0):
+        return float(self._take(keys=[f'rate_limit:{service}'], args=[rate, burst, reserve]))
+
+    def block(self, service, seconds):
+        self._block(keys=[f'rate_limit:{service}'], args=[seconds])
+
+
+def new_bucket_state(burst):
+    """
+    :param burst: Bucket capacity
+    :return: State of a full token bucket
+    """
+
+    return {'tokens': burst, 'updated': time.time(), 'blocked_until': 0.0}
+
+
+def take_token(state, rate, burst, now, reserve=0):
+    """
+    Refills a token bucket for the time passed and takes a token from it if one is available (and the service isn't
+    blocked), updating the state in place.
+
+    :param state: Dict with the bucket's 'tokens', 'updated' time, and 'blocked_until' time
+    :param rate: Tokens added per second
+    :param burst: Bucket capacity
+    :param now: Current time
+    :param reserve: Number of tokens to leave in the bucket (for calls of higher priority)
+    :return: 0 if a token was taken, else the seconds to wait before trying again
+    """
+
+    state['tokens'] = min(burst, state['tokens'] + max(now - state['updated'], 0) * rate)
+    state['updated'] = now
+    if state['blocked_until'] > now:
+        return state['blocked_until'] - now
+    if state['tokens'] >= 1 + reserve:
+        state['tokens'] -= 1
+        return 0
+    return (1 + reserve - state['tokens']) / rate
+
+
+def get_bucket_store():
+    """
+    :return: The token bucket store set by RATE_LIMIT_BACKEND: 'file' (the default; shared by the workers on one host,
+        in RATE_LIMIT_DIR), 'redis' (shared by every host, at REDIS_URL), or 'local' (this process only)
+    """
+
+    global _bucket_store
+    with _bucket_store_lock:
+        if _bucket_store is None:
+            backend = os.getenv('RATE_LIMIT_BACKEND', 'file')
+            if backend == 'redis':
+                _bucket_store = RedisBucketStore()
+            elif backend == 'local':
+                _bucket_store = LocalBucketStore()
+            else:
+                _bucket_store = FileBucketStore(
+                    os.getenv('RATE_LIMIT_DIR', os.path.join(tempfile.gettempdir(), 'kxsc_rate_limits')))
+        return _bucket_store
+
+
+def get_retry_after(headers):
+    """
+    :param headers: Response headers
+    :return: Seconds the Retry-After header (in seconds or as an HTTP date) asks to wait, or None if there is none
+    """
+
+    retry_after = headers.get('Retry-After') if headers else None
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+@contextmanager
+def background_calls():
+    """
+    Marks the calls made by the current greenlet, and the greenlets it spawns, as background work (e.g. the popular
+    artist prefetch), which yields to the calls serving requests (see ServiceLimiter.slot()). Outside a gevent
+    greenlet (e.g. in a script's main thread), the calls keep the normal priority.
+    """
+
+    import gevent
+
+    tree_locals = getattr(gevent.getcurrent(), 'spawn_tree_locals', None)
+    if tree_locals is None:
+        yield
+        return
+
+    previous = tree_locals.get(BACKGROUND_KEY, False)
+    tree_locals[BACKGROUND_KEY] = True
+    try:
+        yield
+    finally:
+        tree_locals[BACKGROUND_KEY] = previous
+
+
+def is_background_call():
+    """
+    :return: Whether the current greenlet's calls are background work (see background_calls())
+    """
+
+    import gevent
+
+    return getattr(gevent.getcurrent(), 'spawn_tree_locals', {}).get(BACKGROUND_KEY, False)
+
+
+class ServiceLimiter:
+    """
+    Rate limits the calls to one external service with a token bucket shared by all workers and greenlets (see
+    get_bucket_store), which refills at rate tokens per second up to burst tokens, and caps this worker's concurrent
+    calls. Background calls (see background_calls()) have a lower priority: they wait while this worker has other calls
+    to the service waiting or running, and leave background_reserve tokens in the bucket for the other workers' calls.
+    Uses threading primitives, which gevent's monkey patching makes cooperative.
+    """
+
+    def __init__(self, name, concurrency, rate, burst, background_reserve=0):
+        """
+        :param name: Service name
+        :param concurrency: Max number of concurrent calls from this worker
+        :param rate: Requests per second, across all workers
+        :param burst: Max number of requests that can be made at once after being idle
+        :param background_reserve: Number of tokens background calls leave in the bucket
+        """
+
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.background_reserve = background_reserve
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._foreground_calls = 0  # Calls of normal priority waiting for or holding a slot
+        self._foreground_lock = threading.Lock()
+        self._no_foreground_calls = threading.Event()
+        self._no_foreground_calls.set()
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits for a free slot and a token from the service's bucket, then holds the slot while the call runs.
+        """
+
+        if is_background_call():
+            with self._background_slot():
+                yield
+            return
+
+        with self._foreground_lock:
+            self._foreground_calls += 1
+            self._no_foreground_calls.clear()
+        try:
+            with self._semaphore:
+                self._take_token(0)
+                yield
+        finally:
+            with self._foreground_lock:
+                self._foreground_calls -= 1
+                if not self._foreground_calls:
+                    self._no_foreground_calls.set()
+
+    @contextmanager
+    def _background_slot(self):
+        """
+        Like slot(), but only takes a free slot while no call of normal priority is waiting for one.
+        """
+
+        while True:
+            self._no_foreground_calls.wait()
+            self._semaphore.acquire()
+            if not self._foreground_calls:
+                break
+            self._semaphore.release()  # A call of normal priority came first
+
+        try:
+            self._take_token(self.background_reserve)
+            yield
+        finally:
+            self._semaphore.release()
+
+    def _take_token(self, reserve):
+        store = get_bucket_store()
+        while True:
+            wait = store.take(self.name, self.rate, self.burst, reserve)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """
+        Stops every worker from calling the service for the given number of seconds.
+
+        :param seconds: Seconds to block the service for
+        """
+
+        print(f'Backing off {self.name} for {seconds:.1f} s')
+        get_bucket_store().block(self.name, seconds)
+
+    def observe(self, status_code, headers):
+        """
+        Backs off as a response asks: for its Retry-After on a 429/503 (DEFAULT_BACKOFF without one), or until the rate
+        limit window resets when an X-RateLimit-Remaining header says no requests are left.
+
+        :param status_code: Response status code
+        :param headers: Response headers
+        """
+
+        if status_code in (429, 503):
+            retry_after = get_retry_after(headers)
+            self.block(DEFAULT_BACKOFF if retry_after is None else retry_after)
+        elif headers and headers.get('X-RateLimit-Remaining') == '0' and headers.get('X-RateLimit-Reset-In'):
+            try:
+                self.block(float(headers['X-RateLimit-Reset-In']))
+            except ValueError:
+                pass
+
+
+def get_limiter(service):
+    """
+    :param service: Service name, e.g. 'spotify', 'musicbrainz', or 'acousticbrainz'
+    :return: The worker's ServiceLimiter for the service
+    """
+
+    with _limiters_lock:
+        if service not in _limiters:
+            concurrency, rate, burst = DEFAULT_LIMITS.get(service, (1, 1.0, 1))
+            prefix = service.upper()
+            burst = float(os.getenv(f'{prefix}_BURST', burst))
+            _limiters[service] = ServiceLimiter(
+                service,
+                int(os.getenv(f'{prefix}_CONCURRENCY', concurrency)),
+                float(os.getenv(f'{prefix}_RATE', rate)),
+                burst,
+                # Background calls leave half the burst (at most all but one token) to the calls serving requests
+                float(os.getenv(f'{prefix}_BACKGROUND_RESERVE', min(burst // 2, max(burst - 1, 0)))),
+            )
+        return _limiters[service]
+
+
+def map_ordered(func, items, pool_size=None, timeout=None):
+    """
+    Calls func on every item concurrently on a bounded gevent pool, keeping the results in the items' order. Per-service
+    limits are applied by the calls themselves (see get_limiter), so the pool only bounds this call's greenlets. If this
+    call is killed, or a call raises, the calls still running are killed.
+
+    :param func: Function of one item
+    :param items: Iterable of items
+    :param pool_size: Max number of concurrent calls, defaults to ENRICH_POOL_SIZE (8)
+    :param timeout: Optional seconds to wait for the calls; calls that haven't finished by then are killed
+    :return: List of func(item) for every item, in order (None for the calls killed at the timeout)
+    """
+
+    from gevent.pool import Pool
+
+    items = list(items)
+    if timeout is not None:
+        results = [None] * len(items)
+        for i, result in map_completed(func, items, pool_size=pool_size, timeout=timeout):
+            results[i] = result
+        return results
+
+    if len(items) <= 1:
+        return [func(item) for item in items]
+
+    pool_size = pool_size or int(os.getenv('ENRICH_POOL_SIZE', 8))
+    pool = Pool(min(pool_size, len(items)))
+    try:
+        return list(pool.imap(func, items))
+    finally:
+        pool.kill(block=False)
+
+
+def map_completed(func, items, pool_size=None, timeout=None):
+    """
+    Like map_ordered(), but yields the results as the calls finish. If the consumer stops early, or a call raises, the
+    calls still running are killed.
+
+    :param func: Function of one item
+    :param items: Iterable of items
+    :param pool_size: Max number of concurrent calls, defaults to ENRICH_POOL_SIZE (8)
+    :param timeout: Optional seconds to wait for the calls; calls that haven't finished by then are killed
+    :return: Generator of (index of the item, func(item)), in order of completion, then (index, None) for every call
+        killed at the timeout
+    """
+
+    import gevent
+    from gevent.pool import Pool
+    from gevent.queue import Queue, Empty
+
+    items = list(items)
+    if not items:
+        return
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    pool_size = pool_size or int(os.getenv('ENRICH_POOL_SIZE', 8))
+    pool = Pool(min(pool_size, len(items)))
+    finished = Queue()
+    greenlets = [gevent.Greenlet(func, item) for item in items]
+    for greenlet in greenlets:
+        greenlet.link(finished.put)
+
+    # Start the calls from a separate greenlet, since starting one blocks while the pool is full
+    starter = gevent.spawn(lambda: [pool.start(greenlet) for greenlet in greenlets])
+    indices = {greenlet: i for i, greenlet in enumerate(greenlets)}
+    try:
+        while indices:
+            try:
+                greenlet = finished.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except Empty:
+                break
+            i = indices.pop(greenlet)
+            if not greenlet.successful():
+                raise greenlet.exception
+            yield i, greenlet.value
+
+        for i in sorted(indices.values()):
+            yield i, None
+    finally:
+        starter.kill(block=False)
+        pool.kill(block=False)
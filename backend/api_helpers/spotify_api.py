@@ -1,15 +1,106 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 import os
+import re
 from dotenv import load_dotenv
+from .circuit_breakers import ServiceFailed, get_breaker
+from .service_limits import get_limiter
+from .ttl_cache import TTLCache
 
 load_dotenv()
 client_id = os.getenv('SPOTIFY_CLIENT_ID')
 client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
 
-# Initialize Spotipy with Client Credentials Manager
-auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-sp = spotipy.Spotify(auth_manager=auth_manager)
+SPOTIFY_ARTIST_URL_PATTERN = re.compile(r'open\.spotify\.com/artist/([0-9A-Za-z]+)')
+
+_client = None
+
+# Spotify artist ID -> top tracks
+_top_tracks_cache = TTLCache(int(os.getenv('SPOTIFY_TOP_TRACKS_CACHE_SIZE', 10000)),
+                             float(os.getenv('SPOTIFY_TOP_TRACKS_TTL', 86400)))
+
+
+def get_client():
+    """
+    Initializes Spotipy with a Client Credentials Manager on first use, so importing this module stays cheap.
+
+    :return: spotipy.Spotify client
+    """
+
+    global _client
+    if _client is None:
+        import spotipy
+        from spotipy.oauth2 import SpotifyClientCredentials
+
+        auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret,
+                                                cache_handler=get_token_cache_handler())
+        _client = spotipy.Spotify(auth_manager=auth_manager)
+    return _client
+
+
+def get_token_cache_handler():
+    """
+    Shares the client credentials token across all workers, so only one of them fetches a new token when it expires:
+    in Redis (REDIS_URL) if SPOTIFY_TOKEN_CACHE is 'redis', so every host shares it, else in a file
+    (SPOTIFY_TOKEN_CACHE_PATH, default .cache) shared by the workers on one host.
+
+    :return: spotipy CacheHandler
+    """
+
+    from spotipy.cache_handler import CacheFileHandler, RedisCacheHandler
+
+    if os.getenv('SPOTIFY_TOKEN_CACHE', 'file') == 'redis':
+        import redis
+
+        return RedisCacheHandler(redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0')),
+                                 key='spotify_client_credentials_token')
+    return CacheFileHandler(cache_path=os.getenv('SPOTIFY_TOKEN_CACHE_PATH', '.cache'))
+
+
+def call_spotify(method, *args, **kwargs):
+    """
+    Calls a Spotipy client method within Spotify's shared rate limit and circuit breaker, backing every worker off if
+    Spotify still rate limits the call after Spotipy's own retries.
+
+    :param method: Name of the Spotipy client method
+    :return: The method's result
+    :raises ServiceUnavailable: If the Spotify circuit is open
+    :raises ServiceFailed: If the request failed, timed out, or got a 5xx or 429 response
+    :raises SpotifyException: For other error responses, e.g. a 404
+    """
+
+    import requests
+    from spotipy.exceptions import SpotifyException
+
+    breaker = get_breaker('spotify')
+    breaker.check()
+    limiter = get_limiter('spotify')
+    try:
+        with limiter.slot():
+            result = getattr(get_client(), method)(*args, **kwargs)
+    except SpotifyException as e:
+        limiter.observe(e.http_status, e.headers)
+        if e.http_status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if e.http_status >= 500 or e.http_status == 429:
+            raise ServiceFailed('spotify', e) from e
+        raise
+    except requests.RequestException as e:
+        breaker.record_failure()
+        raise ServiceFailed('spotify', e) from e
+
+    breaker.record_success()
+    return result
+
+
+def get_artist_id_from_url(url):
+    """
+    :param url: Spotify artist URL, e.g. from an artist's links on MusicBrainz
+    :return: The Spotify Artist ID in the URL, or None if it isn't a Spotify artist URL
+    """
+
+    match = SPOTIFY_ARTIST_URL_PATTERN.search(url or '')
+    return match.group(1) if match else None
 
 
 def get_artist_id(artist_name):
@@ -20,7 +111,7 @@ def get_artist_id(artist_name):
     :return:
     """
 
-    results = sp.search(q=artist_name, type='artist', limit=1)
+    results = call_spotify('search', q=artist_name, type='artist', limit=1)
     items = results['artists']['items']
     if not items:
         raise Exception(f"No artist found on Spotify with name '{artist_name}'.")
@@ -31,17 +122,21 @@ def get_artist_id(artist_name):
 
 def get_top_tracks(artist_id, country='US', limit=3):
     """
-    Retrieve the top tracks for a given Spotify Artist ID.
+    Retrieve the top tracks for a given Spotify Artist ID, cached per artist for SPOTIFY_TOP_TRACKS_TTL seconds.
     """
-    results = sp.artist_top_tracks(artist_id, country=country)
-    tracks = results['tracks'][:limit]
-    top_tracks = []
-    for track in tracks:
-        track_info = {
-            'name': track['name'],
-            'spotify_track_id': track['id'],
-            'spotify_popularity': track['popularity']
-        }
-        top_tracks.append(track_info)
+    # Only the fields used are cached, for every top track, so any limit can be served from the cache
+    cache_key = (artist_id, country)
+    top_tracks = _top_tracks_cache.get(cache_key)
+    if top_tracks is None:
+        results = call_spotify('artist_top_tracks', artist_id, country=country)
+        top_tracks = []
+        for track in results['tracks']:
+            track_info = {
+                'name': track['name'],
+                'spotify_track_id': track['id'],
+                'spotify_popularity': track['popularity']
+            }
+            top_tracks.append(track_info)
+        _top_tracks_cache.set(cache_key, top_tracks)
 
-    return top_tracks
+    return top_tracks[:limit]
@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    In-process cache with a per-entry time to live and least recently used eviction beyond max_size entries.
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        :param max_size: Max number of entries
+        :param ttl: Default seconds an entry stays valid
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: Cache key
+        :return: The cached value, or None if it is missing or expired
+        """
+
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Seconds the entry stays valid, defaults to the cache's ttl
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
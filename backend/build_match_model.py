@@ -0,0 +1,11 @@
+import os
+
+# The artifact is (re)built by this script, so don't require a loadable one when importing the app
+os.environ['MATCH_MODEL_WARMUP'] = '0'
+# Nor start the app's background tasks (drift checker, prefetcher) in this offline build
+os.environ['BACKGROUND_TASKS_AT_IMPORT'] = '0'
+
+from match_app.artifact import main
+
+if __name__ == '__main__':
+    main()
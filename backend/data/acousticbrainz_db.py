@@ -1,69 +1,137 @@
+import os
 import pandas as pd
 from match_app.database_connection import get_db
-from pymongo.errors import DuplicateKeyError
 from api_helpers import acousticbrainz_api
+from api_helpers.acousticbrainz_api import FEATURE_DATA_COLS
+from api_helpers.circuit_breakers import ServiceUnavailable
+from . import acousticbrainz_store
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Reads of the searched tracks collection fetch only the feature fields
+FEATURE_PROJECTION = {'_id': 0, **{col: 1 for col in FEATURE_DATA_COLS}}
 
-def get_connection():
-    client = get_db()
-    db = client['users']
-    collection = db['searched_ab_tracks']
-    return client, collection
+# Max number of upserts per bulk write
+WRITE_BATCH_SIZE = 500
 
+# Whether the missing local store was already reported (in 'local+api' mode)
+_reported_missing_store = False
+
+
+def get_collection():
+    return get_db()['users']['searched_ab_tracks']
+
+
+def get_ab_backend():
+    """
+    :return: Where tracks' AcousticBrainz data comes from, set by AB_BACKEND: 'api' (the default; the searched tracks
+        collection, then the AcousticBrainz API), 'local' (only the local store imported from the AcousticBrainz data
+        dumps, see data.acousticbrainz_store), or 'local+api' (the local store, then 'api' for the tracks not in it)
+    """
+
+    backend = os.getenv('AB_BACKEND', 'api')
+    return backend if backend in ('api', 'local', 'local+api') else 'api'
+
+
+def modify_ab_db(mb_df, skipped=None):
+    """
+    :param mb_df: DataFrame of tracks with a 'track_mbid' column
+    :param skipped: Optional set to add 'acousticbrainz' to if the unseen tracks couldn't be fetched (circuit open or
+        request failed)
+    :return: DataFrame of the AcousticBrainz data of the tracks found (one row per distinct track), stored and newly
+        fetched
+    """
+
+    records = get_ab_records(list(dict.fromkeys(mb_df['track_mbid'])), skipped)
+    return pd.DataFrame(records, columns=FEATURE_DATA_COLS)
+
+
+def get_ab_records(track_mbids, skipped=None):
+    """
+    :param track_mbids: List of distinct recording MBIDs
+    :param skipped: Optional set to add 'acousticbrainz' to if the unseen tracks couldn't be fetched (circuit open or
+        request failed)
+    :return: List of the feature data rows (dicts of the FEATURE_DATA_COLS) of the tracks found, from the backend set by
+        AB_BACKEND. Only the 'local' backend raises FileNotFoundError without a local store; 'local+api' then uses
+        the 'api' backend for every track.
+    """
+
+    global _reported_missing_store
+    backend = get_ab_backend()
+    if backend == 'api':
+        return fetch_ab_records(track_mbids, skipped)
 
-def modify_ab_db(mb_df):
-    client, collection = get_connection()
     try:
-        unique_track_ids = mb_df['track_mbid'].unique()
+        local_records = acousticbrainz_store.lookup_feature_records(track_mbids)
+    except FileNotFoundError as e:
+        if backend == 'local':
+            raise
+        if not _reported_missing_store:
+            print(f'{e}; using the AcousticBrainz API for every track')
+            _reported_missing_store = True
+        return fetch_ab_records(track_mbids, skipped)
+    found_mbids = {record['track_mbid'] for record in local_records}
+    missing_mbids = [track_mbid for track_mbid in track_mbids if track_mbid not in found_mbids]
+    if backend == 'local' or not missing_mbids:
+        return local_records
 
-        # Get existing data
-        existing_ab_docs = list(collection.find(
-            {'track_mbid': {'$in': unique_track_ids.tolist()}}
-        ))
-        existing_ab_df = pd.DataFrame(existing_ab_docs) if existing_ab_docs else pd.DataFrame()
-        try:
-            existing_track_ids = existing_ab_df['track_mbid'].to_list()
-            print(f"Found {len(existing_track_ids)} tracks: {existing_track_ids}")
-        except KeyError:
-            existing_track_ids = []
+    return local_records + fetch_ab_records(missing_mbids, skipped)
 
-        unseen_tracks_df = mb_df[~mb_df['track_mbid'].isin(existing_track_ids)]
 
-        # Get new track data from AcousticBrainz API
-        new_ab_df = unseen_tracks_df.apply(acousticbrainz_api.get_feature_data, axis=1)
+def fetch_ab_records(track_mbids, skipped=None):
+    """
+    :param track_mbids: List of distinct recording MBIDs
+    :param skipped: Optional set to add 'acousticbrainz' to if the unseen tracks couldn't be fetched (circuit open or
+        request failed)
+    :return: List of the feature data rows of the tracks found, from the searched tracks collection and newly fetched
+        from the AcousticBrainz API (and stored)
+    """
+
+    collection = get_collection()
+    # Get existing data, only the feature fields
+    existing_records = list(collection.find({'track_mbid': {'$in': track_mbids}}, FEATURE_PROJECTION))
+    existing_track_ids = {record['track_mbid'] for record in existing_records}
+    print(f"Found {len(existing_track_ids)} tracks: {list(existing_track_ids)}")
+
+    unseen_track_ids = [track_mbid for track_mbid in track_mbids if track_mbid not in existing_track_ids]
+    if not unseen_track_ids:
+        return existing_records
+
+    # Get new track data from AcousticBrainz API, concurrently. The stored data is still used if AcousticBrainz is
+    # unavailable.
+    try:
+        new_records = [record for record in acousticbrainz_api.get_feature_records(unseen_track_ids).values()
+                       if record['track_mbid'] is not None]
+    except ServiceUnavailable as e:
+        print(e)
+        new_records = []
+        if skipped is not None:
+            skipped.add(e.service)
 
-        if not new_ab_df.empty:
-            write_new_data(collection, new_ab_df)
+    write_new_data(collection, new_records)
 
-        # Combine existing and new data
-        dfs_to_concat = [df for df in [existing_ab_df, new_ab_df] if not df.empty]
+    return existing_records + new_records
 
-        if not dfs_to_concat:
-            return new_ab_df  # Return the all-NA new_ab_df (which is ok because it has the correct features)
-        else:
-            entire_ab_df = pd.concat(dfs_to_concat, ignore_index=True)
-            return entire_ab_df
-    finally:
-        client.close()
 
+def write_new_data(collection, records):
+    """
+    Stores the complete feature data rows (those without missing values) with unordered bulk upserts, WRITE_BATCH_SIZE
+    per round trip.
 
-def write_new_data(collection, df_to_write):
-    if df_to_write.empty:
-        return
+    :param collection: The searched tracks collection
+    :param records: List of feature data rows
+    """
 
-    # Drop NA values and convert to records
-    df_clean = df_to_write.dropna()
-    records = df_clean.to_dict('records')
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
 
-    for record in records:
+    complete_records = [record for record in records if all(value is not None for value in record.values())]
+    for i in range(0, len(complete_records), WRITE_BATCH_SIZE):
+        batch = complete_records[i:i + WRITE_BATCH_SIZE]
         try:
-            collection.update_one(
-                {'track_mbid': record['track_mbid']},
-                {'$set': record},
-                upsert=True
-            )
-        except DuplicateKeyError:
-            print(f"Duplicate key found for track_mbid: {record['track_mbid']}")
+            collection.bulk_write([UpdateOne({'track_mbid': record['track_mbid']}, {'$set': record}, upsert=True)
+                                   for record in batch], ordered=False)
+        except BulkWriteError as e:
+            # e.g. duplicate keys from concurrent upserts of the same track, which leave it stored
+            print(f"Bulk write of {len(batch)} tracks had {len(e.details.get('writeErrors', []))} errors")
@@ -0,0 +1,197 @@
+import json
+import os
+import re
+import sqlite3
+import tarfile
+import threading
+import uuid
+from api_helpers.acousticbrainz_api import (FEATURE_DATA_COLS, HIGH_LEVEL_COLS, LOW_LEVEL_COLS, parse_high_level_data,
+                                            parse_low_level_data)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local copy of the AcousticBrainz data the app uses, imported from the public AcousticBrainz data dumps: one SQLite
+# table per level with exactly the fields acousticbrainz_api parses, keyed by the recording MBID (as 16 bytes)
+LOW_LEVEL_STORE_COLS = LOW_LEVEL_COLS[1:]  # Without 'track_mbid'
+HIGH_LEVEL_STORE_COLS = HIGH_LEVEL_COLS
+
+# Dump member names end in '<recording MBID>-<submission offset>.json'
+DUMP_MEMBER_PATTERN = re.compile(
+    r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})-(\d+)\.json$')
+
+# Max number of MBIDs per lookup query (SQLite's default max number of query parameters is 999)
+LOOKUP_CHUNK_SIZE = 500
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store_path():
+    """
+    :return: Path of the local AcousticBrainz store, set by AB_STORE_PATH (default data/acousticbrainz.sqlite)
+    """
+
+    return os.getenv('AB_STORE_PATH', os.path.join(os.path.dirname(__file__), 'acousticbrainz.sqlite'))
+
+
+def create_store(path):
+    """
+    Opens the store at the path for writing, creating its tables if needed.
+
+    :param path: Path of the SQLite file
+    :return: sqlite3.Connection
+    """
+
+    connection = sqlite3.connect(path)
+    # The store is rebuilt from the dumps if an import fails, so trade durability for import speed
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute(
+        f'CREATE TABLE IF NOT EXISTS low_level (mbid BLOB PRIMARY KEY, {", ".join(LOW_LEVEL_STORE_COLS)}) WITHOUT ROWID')
+    connection.execute(
+        f'CREATE TABLE IF NOT EXISTS high_level (mbid BLOB PRIMARY KEY, {", ".join(HIGH_LEVEL_STORE_COLS)}) WITHOUT ROWID')
+    return connection
+
+
+def iter_dump_documents(path):
+    """
+    Streams the documents of an AcousticBrainz dump archive (.tar.zst, or any tar archive tarfile can read), one member
+    at a time, so the archive is never held in memory. Only the first submission (offset 0) of each recording is kept,
+    as the API returns.
+
+    :param path: Path of the dump archive
+    :return: Generator of (recording MBID, document)
+    """
+
+    with open(path, 'rb') as f:
+        if path.endswith('.zst'):
+            import zstandard
+
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+            archive = tarfile.open(fileobj=stream, mode='r|')
+        else:
+            archive = tarfile.open(fileobj=f, mode='r|*')
+
+        with archive:
+            for member in archive:
+                match = DUMP_MEMBER_PATTERN.search(member.name)
+                if not member.isfile() or match is None or match.group(2) != '0':
+                    continue
+                yield match.group(1), json.load(archive.extractfile(member))
+
+
+def parse_dump_document(mbid, document):
+    """
+    :param mbid: Recording MBID
+    :param document: Low-level or high-level AcousticBrainz document
+    :return: ('low_level' or 'high_level', row of the level's store columns), or None if the document lacks any field
+    """
+
+    if 'highlevel' in document:
+        try:
+            data = parse_high_level_data(document)
+        except (KeyError, TypeError):
+            return None
+        return 'high_level', [data[col] for col in HIGH_LEVEL_STORE_COLS]
+
+    data = parse_low_level_data(mbid, document)
+    if data['track_mbid'] is None:
+        return None
+    return 'low_level', [data[col] for col in LOW_LEVEL_STORE_COLS]
+
+
+def import_dumps(paths, store_path, batch_size=10000):
+    """
+    Imports AcousticBrainz dump archives (low-level and/or high-level) into the store, replacing any rows of the same
+    recordings.
+
+    :param paths: Paths of the dump archives
+    :param store_path: Path of the SQLite store
+    :param batch_size: Rows written per transaction
+    :return: Dict of the number of rows written per table
+    """
+
+    inserts = {
+        'low_level': f'INSERT OR REPLACE INTO low_level VALUES ({", ".join("?" * (len(LOW_LEVEL_STORE_COLS) + 1))})',
+        'high_level': f'INSERT OR REPLACE INTO high_level VALUES ({", ".join("?" * (len(HIGH_LEVEL_STORE_COLS) + 1))})',
+    }
+    counts = {'low_level': 0, 'high_level': 0}
+    batches = {'low_level': [], 'high_level': []}
+
+    def flush(table):
+        with connection:
+            connection.executemany(inserts[table], batches[table])
+        counts[table] += len(batches[table])
+        batches[table].clear()
+
+    connection = create_store(store_path)
+    try:
+        for path in paths:
+            print(f'Importing {path}')
+            for mbid, document in iter_dump_documents(path):
+                parsed = parse_dump_document(mbid, document)
+                if parsed is None:
+                    continue
+                table, row = parsed
+                batches[table].append([uuid.UUID(mbid).bytes] + row)
+                if len(batches[table]) >= batch_size:
+                    flush(table)
+            print(f'Imported {path}: {counts["low_level"] + len(batches["low_level"])} low-level and '
+                  f'{counts["high_level"] + len(batches["high_level"])} high-level rows so far')
+
+        for table in batches:
+            flush(table)
+    finally:
+        connection.close()
+
+    return counts
+
+
+def get_store():
+    """
+    :return: A read-only connection to the local AcousticBrainz store (opened once per process), or None if there is no
+        store at get_store_path()
+    """
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            path = get_store_path()
+            if not os.path.exists(path):
+                return None
+            _store = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        return _store
+
+
+def lookup_feature_records(track_mbids):
+    """
+    Looks tracks up in the local AcousticBrainz store.
+
+    :param track_mbids: List of recording MBIDs
+    :return: List of feature data rows (dicts of the FEATURE_DATA_COLS) of the tracks with low-level data in the store
+        (the high-level columns are None for those without high-level data, as from the API), in no particular order
+    """
+
+    store = get_store()
+    if store is None:
+        raise FileNotFoundError(f'No AcousticBrainz store at {get_store_path()}; import the dumps first')
+
+    mbid_bytes = {}
+    for track_mbid in dict.fromkeys(track_mbids):
+        try:
+            mbid_bytes[uuid.UUID(track_mbid).bytes] = track_mbid
+        except (ValueError, TypeError, AttributeError):
+            continue
+
+    columns = [f'l.{col}' for col in LOW_LEVEL_STORE_COLS] + [f'h.{col}' for col in HIGH_LEVEL_STORE_COLS]
+    keys = list(mbid_bytes)
+    rows = []
+    with _store_lock:
+        for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[i:i + LOOKUP_CHUNK_SIZE]
+            rows.extend(store.execute(
+                f'SELECT l.mbid, {", ".join(columns)} FROM low_level l LEFT JOIN high_level h ON h.mbid = l.mbid '
+                f'WHERE l.mbid IN ({", ".join("?" * len(chunk))})', chunk).fetchall())
+
+    return [dict(zip(FEATURE_DATA_COLS, (mbid_bytes[row[0]], *row[1:]))) for row in rows]
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import re
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from api_helpers.acousticbrainz_api import BULK_SIZE, HIGH_LEVEL_BINARY_FEATURES, HIGH_LEVEL_GENRE_FEATURES
+
+# Serves the AcousticBrainz API endpoints the app uses (bulk low-level and high-level lookups) from the
+# tracks CSV, so enrichment can be run and timed locally: AB_BASE_URL=http://127.0.0.1:8080 AB_HEADERS='{}'
+
+MBID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def build_documents(csv_path):
+    """
+    :param csv_path: Path to the tracks CSV
+    :return: (low_level, high_level) dicts of recording MBID -> AcousticBrainz document, for every MBID in 'song_ids'
+    """
+
+    low_level, high_level = {}, {}
+    for _, track in pd.read_csv(csv_path).iterrows():
+        low_level_doc = {
+            'tonal': {'key_key': track['key'], 'key_scale': track['key_scale'], 'key_strength': track['key_confidence']},
+            'rhythm': {'danceability': track['danceability'], 'bpm': track['bpm']},
+        }
+        classifiers = {classifier: {'value': positive if track[feature] == 1 else f'not_{positive}',
+                                    'probability': track[f'{feature}_confidence']}
+                       for feature, classifier, positive in HIGH_LEVEL_BINARY_FEATURES}
+        classifiers.update({classifier: {'value': track[genre], 'probability': track[confidence]}
+                            for genre, confidence, classifier in HIGH_LEVEL_GENRE_FEATURES})
+        high_level_doc = {'highlevel': classifiers}
+
+        for mbid in MBID_PATTERN.findall(str(track['song_ids'])):
+            low_level.setdefault(mbid, low_level_doc)
+            high_level.setdefault(mbid, high_level_doc)
+    return low_level, high_level
+
+
+class FakeAcousticBrainzHandler(BaseHTTPRequestHandler):
+    documents = {}  # 'low-level' / 'high-level' -> {mbid: document}
+    bulk_requests = []  # (level, recording_ids) of every bulk request served, in order
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')  # api/v1/<level>
+
+        if len(parts) == 3 and parts[2] in self.documents:
+            recording_ids = [mbid for mbid in parse_qs(url.query).get('recording_ids', [''])[0].split(';') if mbid]
+            if not recording_ids or len(recording_ids) > BULK_SIZE:
+                return self.send_json(400, {'message': f'Between 1 and {BULK_SIZE} recording_ids are required'})
+            self.bulk_requests.append((parts[2], recording_ids))
+            docs = self.documents[parts[2]]
+            body = {mbid: {'0': docs[mbid]} for mbid in recording_ids if mbid in docs}
+            body['mbid_mapping'] = {}
+            return self.send_json(200, body)
+
+        self.send_json(404, {'message': 'Not found'})
+
+    def log_message(self, format, *args):
+        pass  # Enrichment logs its own progress
+
+    def send_json(self, status, body):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake AcousticBrainz API from the tracks CSV.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--csv', default=os.path.join(os.getcwd(), 'data', 'sliced_ab_data.csv'))
+    args = parser.parse_args()
+
+    low_level, high_level = build_documents(args.csv)
+    FakeAcousticBrainzHandler.documents = {'low-level': low_level, 'high-level': high_level}
+    print(f'Serving {len(low_level)} recordings on http://127.0.0.1:{args.port}')
+    ThreadingHTTPServer(('127.0.0.1', args.port), FakeAcousticBrainzHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
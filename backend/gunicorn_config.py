@@ -1,3 +1,37 @@
+import gc
+import os
+from memory_report import get_memory_usage, format_memory_usage
+
 bind = "0.0.0.0:8000"
-workers = 4
-timeout = 120
\ No newline at end of file
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# Let the app see how many workers share the load (e.g. in-process match jobs only work with one)
+os.environ['GUNICORN_WORKERS'] = str(workers)
+timeout = 120
+
+# Import the app, and so build the match model and track tables, once in the master before forking. The workers then
+# share those pages copy-on-write instead of each loading their own copy. Set GUNICORN_PRELOAD=0 to load per worker.
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+
+# Background tasks (the drift checker and the popular artist prefetch) run in the workers only, started in
+# post_worker_init, never in the master
+os.environ['BACKGROUND_TASKS_AT_IMPORT'] = '0'
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far out of the garbage collector's reach, so collections in the workers don't
+        # write to (and so un-share) the preloaded objects' pages
+        gc.freeze()
+    server.log.info(f'Master memory after loading the app: {format_memory_usage(get_memory_usage(os.getpid()))}')
+
+
+def post_worker_init(worker):
+    from match_app import start_background_tasks
+    start_background_tasks()
+    worker.log.info(f'Worker {worker.pid} memory after init: {format_memory_usage(get_memory_usage(worker.pid))}')
+
+
+def worker_exit(server, worker):
+    # Close the worker's MongoDB connection pool cleanly instead of dropping its sockets
+    from match_app.database_connection import close_db
+    close_db()
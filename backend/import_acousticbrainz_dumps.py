@@ -0,0 +1,22 @@
+import argparse
+import time
+from data.acousticbrainz_store import get_store_path, import_dumps
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Import AcousticBrainz data dumps (low-level and high-level JSON, .tar.zst or any tar archive) '
+                    'into the local AcousticBrainz store used with AB_BACKEND=local.')
+    parser.add_argument('dumps', nargs='+', help='Paths of the dump archives')
+    parser.add_argument('--store', default=get_store_path(), help='Path of the SQLite store (default: AB_STORE_PATH)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Rows written per transaction')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = import_dumps(args.dumps, args.store, batch_size=args.batch_size)
+    print(f'Imported {counts["low_level"]} low-level and {counts["high_level"]} high-level rows into {args.store} in '
+          f'{time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
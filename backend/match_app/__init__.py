@@ -1,8 +1,11 @@
 from gevent import monkey
 monkey.patch_all()
 
-from flask import Flask
-from dotenv import load_dotenv
+from .startup import startup_phase, format_startup_report
+
+with startup_phase('flask'):
+    from flask import Flask
+    from dotenv import load_dotenv
 import os
 
 load_dotenv()
@@ -12,5 +15,49 @@ secret_key = os.getenv('FLASK_SECRET_KEY')
 app = Flask(__name__)
 app.secret_key = secret_key
 
+# Time the heavy parts of the stack separately, so a slow new import shows up in the startup report. Spotipy,
+# MusicBrainz, MongoDB, and Plotly are only imported by the code paths that use them.
+with startup_phase('numpy'):
+    import numpy
+with startup_phase('pandas'):
+    import pandas
+with startup_phase('scipy.sparse'):
+    import scipy.sparse
+
 # Import routes.py, which handles the core logic
-from . import routes
+with startup_phase('routes'):
+    from . import routes
+
+# Build the match model once when the worker starts, rather than on the first request. This refuses to start the app
+# if the match model artifact was built for a different version of the code.
+from .match_model import get_model, start_drift_checker
+if os.getenv('MATCH_MODEL_WARMUP', '1') != '0':
+    with startup_phase('match model'):
+        get_model()
+
+from .prefetch import start_prefetcher
+
+
+def start_background_tasks():
+    """
+    Starts the background threads of a process that serves requests: the check of the incrementally updated DJ profiles
+    against a full recompute, and the prefetch of the most popular artists' features while idle (PREFETCH_ENABLED=1).
+    """
+
+    if os.getenv('MATCH_MODEL_WARMUP', '1') != '0':
+        start_drift_checker()
+    start_prefetcher()
+
+
+# Gunicorn starts them in each worker instead (see gunicorn_config.py), so the master that preloads the app doesn't
+# run them
+if os.getenv('BACKGROUND_TASKS_AT_IMPORT', '1') != '0':
+    start_background_tasks()
+
+# Load the whole MBID -> Spotify artist ID mapping up front (shared by the workers when the app is preloaded)
+if os.getenv('SPOTIFY_ID_PRELOAD', '0') == '1':
+    from .spotify_ids import preload_spotify_ids
+    with startup_phase('spotify ids'):
+        print(f'Preloaded {preload_spotify_ids()} Spotify artist IDs')
+
+print(f'Startup: {format_startup_report()}')
@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from .features import MISC_FEATURE_COLS, BINARY_FEATURE_COLS, CONFIDENCE_FEATURE_COLS
+from .profiles import ProfileAccumulator
+from .tracks import load_tracks
+
+# Bump whenever the artifact's layout or the meaning of its arrays changes. The app refuses to load an artifact built
+# for another version, so it has to be rebuilt with `python build_match_model.py`.
+ARTIFACT_VERSION = 2
+
+MANIFEST_FILE = 'manifest.json'
+
+_staleness = {}  # (manifest stamp, tracks CSV stamp) -> whether the artifact is stale
+
+# Raw per-track feature columns stored in the typed track block, in order
+TRACK_FEATURE_COLS = MISC_FEATURE_COLS + BINARY_FEATURE_COLS + CONFIDENCE_FEATURE_COLS
+
+
+class ArtifactVersionError(RuntimeError):
+    """
+    Raised when a match model artifact was built for a different ARTIFACT_VERSION than the running code expects.
+    """
+
+
+class ArtifactIntegrityError(RuntimeError):
+    """
+    Raised when a match model artifact's files don't match its manifest (missing, truncated, or modified).
+    """
+
+
+def get_artifact_path():
+    """
+    :return: Path to the compiled match model artifact directory
+    """
+
+    return os.getenv('MATCH_ARTIFACT_PATH', os.path.join(os.getcwd(), 'data', 'match_model'))
+
+
+def build_artifact(csv_path, out_path, show_responses=None):
+    """
+    Compiles the tracks CSV into a versioned match model artifact: a directory of .npy arrays (the typed track feature
+    block, the DJ profile sums and counts, the DJ matrix, the scaler parameters, and the DJ x artist play counts), JSON
+    files with per-DJ recent songs and (optionally) show responses, and a manifest with the artifact version, each
+    file's size (checked on every load), and a content hash (checked by verify_artifact()). The directory is replaced in one rename, so a running app never sees a half-written artifact.
+
+    :param csv_path: Path to the tracks CSV
+    :param out_path: Artifact directory to write
+    :param show_responses: Optional list of show_responses documents to bundle
+    :return: The artifact's manifest
+    """
+
+    from .match_model import MatchModel
+
+    tracks_df = load_tracks(csv_path)
+    profiles = ProfileAccumulator.from_tracks(tracks_df)
+    model = MatchModel(profiles)
+
+    arrays, recent_songs = profiles.to_arrays()
+    artist_cols = tracks_df['artist_id'].astype(object).map(profiles.artist_columns)
+    arrays.update({
+        'track_features': tracks_df[TRACK_FEATURE_COLS].to_numpy(dtype=np.float64),
+        'track_dj_rows': tracks_df['DJ ID'].map(profiles.dj_rows).to_numpy(dtype=np.int32),
+        'track_artist_cols': artist_cols.fillna(-1).to_numpy(dtype=np.int32),  # -1 = no artist MBID
+        'dj_matrix': model.dj_matrix,
+        'scaler_mean': model.scaler_mean,
+        'scaler_scale': model.scaler_scale,
+    })
+    documents = {'recent_songs.json': recent_songs}
+    if show_responses is not None:
+        documents['show_responses.json'] = {str(doc['dj_id']): {key: value for key, value in doc.items() if key != '_id'}
+                                            for doc in show_responses if 'dj_id' in doc}
+
+    tmp_path = f'{out_path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+    for name, document in documents.items():
+        with open(os.path.join(tmp_path, name), 'wb') as f:
+            f.write(json.dumps(document, sort_keys=True, default=str).encode())
+
+    manifest = {
+        'version': ARTIFACT_VERSION,
+        'content_hash': get_content_hash(tmp_path, sorted(arrays), sorted(documents)),
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'source': os.path.basename(csv_path),
+        'source_hash': get_file_hash(csv_path),
+        'num_spins': profiles.num_spins,
+        'num_djs': len(profiles.dj_ids),
+        'arrays': sorted(arrays),
+        'documents': sorted(documents),
+        'file_sizes': {file_name: os.path.getsize(os.path.join(tmp_path, file_name))
+                       for file_name in get_file_names(sorted(arrays), sorted(documents))},
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the new artifact in
+    old_path = f'{out_path}.old-{os.getpid()}'
+    if os.path.exists(out_path):
+        os.rename(out_path, old_path)
+    os.rename(tmp_path, out_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    return manifest
+
+
+def get_file_names(arrays, documents):
+    """
+    :param arrays: Names of the artifact's arrays
+    :param documents: File names of the artifact's JSON documents
+    :return: List of the artifact's data file names, arrays first
+    """
+
+    return [f'{name}.npy' for name in arrays] + list(documents)
+
+
+def get_content_hash(path, arrays, documents):
+    """
+    :param path: Artifact directory
+    :param arrays: Sorted names of the artifact's arrays
+    :param documents: Sorted file names of the artifact's JSON documents
+    :return: Hex SHA-256 of the artifact's data files, each prefixed with its name
+    """
+
+    content_hash = hashlib.sha256()
+    for name, file_name in zip(list(arrays) + list(documents), get_file_names(arrays, documents)):
+        with open(os.path.join(path, file_name), 'rb') as f:
+            content_hash.update(name.encode() + f.read())
+    return content_hash.hexdigest()
+
+
+def check_file_sizes(path, manifest):
+    """
+    Checks that every data file the manifest lists exists with the size it was written with. This is cheap (no file is
+    read), so it is done on every load; verify_artifact() also checks the contents.
+
+    :param path: Artifact directory
+    :param manifest: The artifact's manifest
+    :raises ArtifactIntegrityError: If a file is missing or has another size
+    """
+
+    file_sizes = manifest['file_sizes']
+    for file_name in get_file_names(manifest['arrays'], manifest['documents']):
+        try:
+            size = os.path.getsize(os.path.join(path, file_name))
+        except OSError:
+            size = None
+        if size != file_sizes.get(file_name):
+            raise ArtifactIntegrityError(f'Match model artifact at {path} has {file_name} with size {size}, but its '
+                                         f'manifest expects {file_sizes.get(file_name)}. Rebuild it with '
+                                         f'`python build_match_model.py`.')
+
+
+def verify_artifact(path):
+    """
+    Fully checks an artifact's files against its manifest: their sizes and the content hash (every file is read).
+
+    :param path: Artifact directory
+    :return: The artifact's manifest
+    :raises ArtifactVersionError: If the artifact was built for a different ARTIFACT_VERSION
+    :raises ArtifactIntegrityError: If a file is missing or its contents changed
+    """
+
+    manifest = read_manifest(path)
+    check_file_sizes(path, manifest)
+    if get_content_hash(path, manifest['arrays'], manifest['documents']) != manifest.get('content_hash'):
+        raise ArtifactIntegrityError(f'Match model artifact at {path} does not match its content hash. Rebuild it with '
+                                     f'`python build_match_model.py`.')
+    return manifest
+
+
+def get_file_hash(path):
+    """
+    :param path: Path to a file
+    :return: Hex SHA-256 of the file's contents
+    """
+
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def is_artifact_stale(manifest_path, csv_path):
+    """
+    Checks whether the tracks CSV changed since the artifact was built from it, by comparing the CSV's content hash with
+    the one in the manifest. The result is kept until either file changes, so the CSV is only hashed when it does.
+
+    :param manifest_path: Path to the artifact's manifest
+    :param csv_path: Path to the tracks CSV
+    :return: Whether the artifact is stale (False if there is no CSV, or the manifest has no source hash to compare)
+    """
+
+    try:
+        manifest_stat = os.stat(manifest_path)
+        csv_stat = os.stat(csv_path)
+    except OSError:
+        return False
+
+    key = (manifest_stat.st_mtime_ns, manifest_stat.st_size, csv_stat.st_mtime_ns, csv_stat.st_size)
+    if key not in _staleness:
+        with open(manifest_path) as f:
+            source_hash = json.load(f).get('source_hash')
+        if source_hash is None:
+            print(f'Match model artifact at {os.path.dirname(manifest_path)} has no source hash, so it can\'t be '
+                  f'checked against {csv_path}. Rebuild it with `python build_match_model.py`.')
+        stale = source_hash is not None and source_hash != get_file_hash(csv_path)
+        if stale:
+            print(f'{csv_path} changed since the match model artifact at {os.path.dirname(manifest_path)} was built, '
+                  f'so the model is built from the CSV until the artifact is rebuilt with `python build_match_model.py`.')
+        _staleness[key] = stale
+    return _staleness[key]
+
+
+def read_manifest(path):
+    """
+    :param path: Artifact directory
+    :return: The artifact's manifest
+    :raises ArtifactVersionError: If the artifact was built for a different ARTIFACT_VERSION
+    """
+
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != ARTIFACT_VERSION:
+        raise ArtifactVersionError(f"Match model artifact at {path} has version {manifest.get('version')}, but this code "
+                                   f"expects version {ARTIFACT_VERSION}. Rebuild it with `python build_match_model.py`.")
+    return manifest
+
+
+def load_artifact(path):
+    """
+    Loads a match model artifact, memory-mapping its arrays so nothing is parsed or copied up front. The files are
+    checked against the sizes in the manifest, but not hashed (see verify_artifact()).
+
+    :param path: Artifact directory
+    :return: Dict with the 'manifest', the memory-mapped 'arrays', and the 'recent_songs' and 'show_responses' documents
+        (show_responses is None if it was not bundled)
+    :raises ArtifactVersionError: If the artifact was built for a different ARTIFACT_VERSION
+    :raises ArtifactIntegrityError: If a file is missing or truncated
+    """
+
+    manifest = read_manifest(path)
+    check_file_sizes(path, manifest)
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in manifest['arrays']}
+
+    documents = {}
+    for name in manifest['documents']:
+        with open(os.path.join(path, name)) as f:
+            documents[name] = json.load(f)
+
+    show_responses = documents.get('show_responses.json')
+    return {
+        'manifest': manifest,
+        'arrays': arrays,
+        'recent_songs': documents.get('recent_songs.json', {}),
+        'show_responses': {int(dj_id): doc for dj_id, doc in show_responses.items()} if show_responses else None,
+    }
+
+
+def load_artifact_profiles(artifact):
+    """
+    :param artifact: Loaded artifact from load_artifact()
+    :return: ProfileAccumulator restored from the artifact's precomputed sums and counts
+    """
+
+    arrays = artifact['arrays']
+    return ProfileAccumulator.from_arrays(arrays, artifact['recent_songs'], artifact['manifest']['num_spins'])
+
+
+def recompute_artifact_profiles(artifact):
+    """
+    Fully recomputes the DJ profiles from the artifact's typed track block, e.g. to check the precomputed ones.
+
+    :param artifact: Loaded artifact from load_artifact()
+    :return: ProfileAccumulator
+    """
+
+    arrays = artifact['arrays']
+    dj_rows = np.asarray(arrays['track_dj_rows'])
+    artist_cols = np.asarray(arrays['track_artist_cols'])
+    artist_ids = np.append(np.asarray(arrays['artist_ids'], dtype=object), np.nan)  # Index -1 = no artist MBID
+
+    tracks_df = pd.DataFrame(np.asarray(arrays['track_features']), columns=TRACK_FEATURE_COLS)
+    tracks_df['DJ ID'] = np.asarray(arrays['dj_ids'])[dj_rows]
+    tracks_df['DJ Name'] = np.asarray(arrays['dj_names'])[dj_rows]
+    tracks_df['artist_id'] = artist_ids[artist_cols]
+
+    profiles = ProfileAccumulator.from_tracks(tracks_df)
+    # The track block has no play times, so recent songs come from the artifact
+    profiles.recent_songs = {int(dj_id): songs for dj_id, songs in artifact['recent_songs'].items()}
+    return profiles
+
+
+def main():
+    from .match_model import get_data_path
+
+    parser = argparse.ArgumentParser(description='Compile the tracks CSV into a versioned match model artifact.')
+    parser.add_argument('--csv', default=get_data_path(), help='Tracks CSV to compile (defaults to MATCH_DATA_PATH)')
+    parser.add_argument('--out', default=get_artifact_path(), help='Artifact directory to write')
+    parser.add_argument('--with-show-responses', action='store_true',
+                        help='Bundle the djs.show_responses collection from MongoDB')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check the existing artifact at --out against its manifest instead of building one')
+    args = parser.parse_args()
+
+    if args.verify:
+        manifest = verify_artifact(args.out)
+        print(f"Match model artifact v{manifest['version']} at {args.out} is intact "
+              f"(content hash {manifest['content_hash']})")
+        return
+
+    show_responses = None
+    if args.with_show_responses:
+        from .database_connection import get_db
+        show_responses = list(get_db()['djs']['show_responses'].find({}, {'_id': 0}))
+
+    manifest = build_artifact(args.csv, args.out, show_responses)
+    print(f"Built match model artifact v{manifest['version']} at {args.out}: {manifest['num_djs']} DJs, "
+          f"{manifest['num_spins']} spins, content hash {manifest['content_hash']}")
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from api_helpers.ttl_cache import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cache entries are dicts of an artist's aggregated feature vector (FEATURE_COLS order, None if no track had
+# AcousticBrainz data), the number of tracks it averages, and those tracks' MBIDs:
+# {'features': [...] or None, 'num_tracks': int, 'track_mbids': [str, ...]}
+
+
+class MongoArtistCache:
+    """
+    Shared cache tier in the artists.artist_feature_cache MongoDB collection. Expired documents are ignored on read and
+    removed by a TTL index. The cache holds on to its collection (of the process's pooled client), so lookups don't
+    create clients.
+    """
+
+    def __init__(self):
+        self._indexed = False
+        self._collection = None
+        self._collection_pid = None
+
+    def get_collection(self):
+        """
+        :return: The artist_feature_cache collection, from a client of this process (a forked worker gets its own)
+        """
+
+        from .database_connection import get_db
+
+        if self._collection is None or self._collection_pid != os.getpid():
+            self._collection = get_db()['artists']['artist_feature_cache']
+            self._collection_pid = os.getpid()
+        return self._collection
+
+    def get(self, artist_mbid):
+        """
+        :return: (entry, seconds until it expires), or None on a miss
+        """
+
+        now = datetime.now(timezone.utc)
+        doc = self.get_collection().find_one({'_id': artist_mbid, 'expires_at': {'$gt': now}})
+        if not doc:
+            return None
+        expires_at = doc['expires_at']
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)  # Clients without tz_aware return naive UTC
+        entry = {key: doc[key] for key in ('features', 'num_tracks', 'track_mbids')}
+        return entry, (expires_at - now).total_seconds()
+
+    def set(self, artist_mbid, entry, ttl):
+        collection = self.get_collection()
+        if not self._indexed:
+            collection.create_index('expires_at', expireAfterSeconds=0)
+            self._indexed = True
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        collection.replace_one({'_id': artist_mbid}, {**entry, 'expires_at': expires_at}, upsert=True)
+
+
+class RedisArtistCache:
+    """
+    Shared cache tier in Redis (REDIS_URL), one JSON value with a TTL per artist.
+    """
+
+    def __init__(self):
+        import redis
+
+        self._client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+
+    def get(self, artist_mbid):
+        """
+        :return: (entry, seconds until it expires), or None on a miss
+        """
+
+        pipeline = self._client.pipeline()
+        pipeline.get(f'artist_features:{artist_mbid}')
+        pipeline.pttl(f'artist_features:{artist_mbid}')
+        value, ttl_ms = pipeline.execute()
+        if value is None or ttl_ms is None or ttl_ms < 0:
+            return None  # Missing, or expired between the two reads (every value is set with a TTL)
+        return json.loads(value), ttl_ms / 1000
+
+    def set(self, artist_mbid, entry, ttl):
+        self._client.setex(f'artist_features:{artist_mbid}', max(int(ttl), 1), json.dumps(entry))
+
+
+_local_cache = TTLCache(int(os.getenv('ARTIST_CACHE_SIZE', 10000)), float(os.getenv('ARTIST_CACHE_TTL', 7 * 86400)))
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_entry_ttl(entry):
+    """
+    :param entry: Cache entry
+    :return: Seconds the entry stays valid; artists without any AcousticBrainz data are retried sooner
+        (ARTIST_CACHE_EMPTY_TTL), since a lookup may have failed only temporarily
+    """
+
+    if entry['num_tracks']:
+        return float(os.getenv('ARTIST_CACHE_TTL', 7 * 86400))
+    return float(os.getenv('ARTIST_CACHE_EMPTY_TTL', 3600))
+
+
+def get_shared_cache():
+    """
+    :return: The shared cache tier set by ARTIST_CACHE_BACKEND ('mongo' or 'redis'), or None (the default) for the
+        in-process tier only
+    """
+
+    global _shared_cache
+    backend = os.getenv('ARTIST_CACHE_BACKEND', 'none')
+    if backend not in ('mongo', 'redis'):
+        return None
+
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = MongoArtistCache() if backend == 'mongo' else RedisArtistCache()
+        return _shared_cache
+
+
+def get_cached_artist(artist_mbid):
+    """
+    Looks an artist up in the in-process tier, then in the shared tier (copying a hit into the in-process tier until
+    it expires in the shared tier). A shared tier that can't be reached counts as a miss.
+
+    :param artist_mbid: Artist's MusicBrainz ID
+    :return: Cache entry, or None on a miss
+    """
+
+    entry = _local_cache.get(artist_mbid)
+    if entry is not None:
+        return entry
+
+    shared_cache = get_shared_cache()
+    if shared_cache is None:
+        return None
+    try:
+        hit = shared_cache.get(artist_mbid)
+    except Exception as e:
+        print(f'Artist cache lookup failed for {artist_mbid}: {e}')
+        return None
+    if hit is None:
+        return None
+    entry, remaining_ttl = hit
+    if remaining_ttl > 0:
+        _local_cache.set(artist_mbid, entry, remaining_ttl)
+    return entry
+
+
+def cache_artist(artist_mbid, entry):
+    """
+    Stores an artist's entry in the in-process tier and the shared tier.
+
+    :param artist_mbid: Artist's MusicBrainz ID
+    :param entry: Cache entry
+    """
+
+    ttl = get_entry_ttl(entry)
+    _local_cache.set(artist_mbid, entry, ttl)
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        try:
+            shared_cache.set(artist_mbid, entry, ttl)
+        except Exception as e:
+            print(f'Artist cache write failed for {artist_mbid}: {e}')
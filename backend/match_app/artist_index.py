@@ -0,0 +1,70 @@
+import numpy as np
+from scipy import sparse
+
+
+class ArtistIndex:
+    """
+    Sparse DJ x artist matrix of how often each DJ played each artist, used to score artist overlap for every DJ with
+    one sparse product instead of looping over DJs and artists.
+
+    Each DJ's row holds log1p(play count), divided by log1p of the DJ's most played artist's count, so a user artist
+    contributes at most 1 to a DJ's overlap score.
+    """
+
+    def __init__(self, play_counts, artist_ids):
+        """
+        :param play_counts: Sparse matrix of shape (num_djs, num_artists) of how often each DJ played each artist, rows
+            in the model's DJ order
+        :param artist_ids: Artist MBIDs in column order
+        """
+
+        self.play_counts = play_counts.tocsr()
+        self.artist_ids = list(artist_ids)
+        self.artist_columns = {artist_id: col for col, artist_id in enumerate(self.artist_ids)}
+
+        # Log scale to prevent extremely frequent plays from dominating
+        log_counts = self.play_counts.copy()
+        log_counts.data = np.log1p(log_counts.data)
+
+        # Normalize by the max possible (log) frequency of each DJ
+        max_log_counts = np.log1p(self.play_counts.max(axis=1).toarray().ravel())
+        self.normalizers = np.divide(1.0, max_log_counts, out=np.zeros_like(max_log_counts), where=max_log_counts > 0)
+        self.weights = sparse.diags(self.normalizers) @ log_counts  # shape: (num_djs, num_artists)
+
+    def overlap_scores(self, artist_mbids):
+        """
+        Calculates the frequency-weighted artist overlap between a user's artists and every DJ.
+
+        :param artist_mbids: MusicBrainz IDs of the user's artists
+        :return: Array of shape (num_djs, ) of overlap scores in [0, 1]
+        """
+
+        return self.overlap_scores_batch([artist_mbids])[0]
+
+    def overlap_scores_batch(self, artist_mbid_lists):
+        """
+        Calculates the frequency-weighted artist overlap between many users' artists and every DJ with one sparse
+        product.
+
+        :param artist_mbid_lists: List (one per user) of lists of the user's artists' MusicBrainz IDs
+        :return: Array of shape (num_users, num_djs) of overlap scores in [0, 1]
+        """
+
+        rows, cols = [], []
+        num_user_artists = np.zeros(len(artist_mbid_lists))
+        for row, artist_mbids in enumerate(artist_mbid_lists):
+            user_artist_ids = set(artist_mbids)
+            num_user_artists[row] = len(user_artist_ids)
+            # Artists no DJ has played have no column but still count towards the number of user artists
+            for artist_id in user_artist_ids:
+                if artist_id in self.artist_columns:
+                    rows.append(row)
+                    cols.append(self.artist_columns[artist_id])
+
+        user_matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                        shape=(len(artist_mbid_lists), self.weights.shape[1]))
+        overlap = (user_matrix @ self.weights.T).toarray()  # shape: (num_users, num_djs)
+
+        # Normalize by number of user artists (users without artists have no overlap)
+        return np.divide(overlap, num_user_artists[:, None], out=np.zeros_like(overlap),
+                         where=num_user_artists[:, None] > 0)
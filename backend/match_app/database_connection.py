@@ -1,10 +1,149 @@
-from pymongo import MongoClient
+import atexit
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# One MongoClient per process, created on first use. It holds a pool of connections that every thread and greenlet
+# shares, so requests no longer pay for connection setup, TLS, server discovery, and auth on each call. A client must
+# not be used across a fork (e.g. the preloaded gunicorn master's), so each forked worker creates its own.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_pool_stats = None
+_closes_at_exit = False
+
+
+def get_pool_listener():
+    """
+    :return: The process's connection pool listener, counting connections and checkouts (see get_pool_stats())
+    """
+
+    from pymongo import monitoring
+
+    class PoolStatsListener(monitoring.ConnectionPoolListener):
+        def __init__(self):
+            self.stats = {'open': 0, 'in_use': 0, 'max_in_use': 0, 'created': 0, 'closed': 0, 'checkouts': 0,
+                          'checkout_failures': 0, 'pool_clears': 0}
+            self._lock = threading.Lock()
+
+        def _count(self, *names, in_use=0, open=0):
+            with self._lock:
+                for name in names:
+                    self.stats[name] += 1
+                self.stats['in_use'] += in_use
+                self.stats['open'] += open
+                self.stats['max_in_use'] = max(self.stats['max_in_use'], self.stats['in_use'])
+
+        def connection_created(self, event):
+            self._count('created', open=1)
+
+        def connection_closed(self, event):
+            self._count('closed', open=-1)
+
+        def connection_checked_out(self, event):
+            self._count('checkouts', in_use=1)
+
+        def connection_checked_in(self, event):
+            self._count(in_use=-1)
+
+        def connection_check_out_failed(self, event):
+            # e.g. the pool stayed full for MONGO_WAIT_QUEUE_TIMEOUT_MS
+            self._count('checkout_failures')
+
+        def pool_cleared(self, event):
+            self._count('pool_clears')
+
+        def pool_created(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_check_out_started(self, event):
+            pass
+
+    return PoolStatsListener()
+
 
 def get_db():
-    client = MongoClient(os.getenv('MONGO_CONNECTION_URI'))
-    return client
+    """
+    Returns the process's MongoClient, creating it on first use. Don't close it; close_db() does at exit. The pool is set
+    by MONGO_MAX_POOL_SIZE (default 50 connections per worker, shared by its greenlets), MONGO_MIN_POOL_SIZE (2, kept
+    open), and MONGO_MAX_IDLE_TIME_MS (300000). The timeouts fail a call well within a request's latency budget instead
+    of hanging its greenlet: MONGO_CONNECT_TIMEOUT_MS (5000), MONGO_SERVER_SELECTION_TIMEOUT_MS (5000),
+    MONGO_SOCKET_TIMEOUT_MS (30000), and MONGO_WAIT_QUEUE_TIMEOUT_MS (5000, to wait for a free connection).
+
+    :return: pymongo.MongoClient
+    """
+
+    global _client, _client_pid, _pool_stats, _closes_at_exit
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            return _client
+
+        from pymongo import MongoClient  # Deferred so workers that never reach MongoDB start without it
+
+        _pool_stats = get_pool_listener()
+        _client = MongoClient(
+            os.getenv('MONGO_CONNECTION_URI'),
+            maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+            minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 2)),
+            maxIdleTimeMS=int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000)),
+            connectTimeoutMS=int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+            serverSelectionTimeoutMS=int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            socketTimeoutMS=int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+            waitQueueTimeoutMS=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+            event_listeners=[_pool_stats],
+        )
+        _client_pid = os.getpid()
+
+        if not _closes_at_exit:
+            atexit.register(close_db)
+            _closes_at_exit = True
+        return _client
+
+
+def get_pool_stats():
+    """
+    :return: Dict of the process's MongoDB connection pool usage: connections 'open' and 'in_use' now, the most ever in
+        use at once ('max_in_use'), and the totals of connections 'created' and 'closed', 'checkouts',
+        'checkout_failures', and 'pool_clears', with the 'pid' and 'max_pool_size'. Empty before the first get_db().
+    """
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            return {}
+        with _pool_stats._lock:
+            stats = dict(_pool_stats.stats)
+        return {'pid': _client_pid, 'max_pool_size': _client.max_pool_size, **stats}
+
+
+def close_db():
+    """
+    Closes the process's MongoClient, if it created one (e.g. when a worker exits). A later get_db() creates a new one.
+    """
+
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            return
+        print(f'Closing MongoDB client; pool stats: {dict(_pool_stats.stats)}')
+        _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _forget_client_after_fork():
+    # The child leaves the parent's client (and its sockets) alone, and the lock may have been held by another thread
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_client_after_fork)
@@ -0,0 +1,189 @@
+import argparse
+import os
+import time
+import numpy as np
+from .features import normalize_rows
+
+
+class ExactDJIndex:
+    """
+    Brute-force DJ index: every DJ is a candidate for every query, so rankings are exact.
+    """
+
+    name = 'exact'
+
+    def __init__(self, dj_unit_matrix):
+        """
+        :param dj_unit_matrix: Array of shape (num_djs, num_features) of row-normalized scaled DJ feature vectors
+        """
+
+        self.num_djs = dj_unit_matrix.shape[0]
+
+    def candidates(self, query_unit_matrix, top_n):
+        """
+        :param query_unit_matrix: Array of shape (num_queries, num_features) of row-normalized scaled user vectors
+        :param top_n: Number of DJs that will be picked from the candidates
+        :return: List (one per query) of arrays of candidate DJ indices, or None where every DJ must be scored
+        """
+
+        return [None] * len(query_unit_matrix)
+
+
+class LSHDJIndex:
+    """
+    Approximate DJ index using random-projection (sign) locality-sensitive hashing for cosine similarity. Each of
+    num_tables hash tables buckets the DJs by which side of num_bits random hyperplanes they fall on; a query's
+    candidates are the DJs sharing a bucket with it in any table (and, with probes=1, in any bucket one bit away).
+
+    More tables or probes raise recall at the cost of more candidates to score; more bits shrink the buckets, lowering
+    both latency and recall.
+    """
+
+    name = 'lsh'
+
+    def __init__(self, dj_unit_matrix, num_tables=8, num_bits=10, probes=1, seed=0):
+        """
+        :param dj_unit_matrix: Array of shape (num_djs, num_features) of row-normalized scaled DJ feature vectors
+        :param num_tables: Number of independent hash tables
+        :param num_bits: Number of hyperplanes (hash bits) per table
+        :param probes: 0 to only look in the query's own bucket, 1 to also look in every bucket one bit away
+        :param seed: Seed for the random hyperplanes, so every worker builds the same index
+        """
+
+        self.num_djs = dj_unit_matrix.shape[0]
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((num_tables, dj_unit_matrix.shape[1], num_bits))
+        self.powers = 1 << np.arange(num_bits, dtype=np.int64)
+        self.probe_masks = [0] + ([1 << bit for bit in range(num_bits)] if probes >= 1 else [])
+
+        # One dict per table mapping each bucket's hash code to the indices of the DJs in it
+        self.tables = []
+        for codes in self._hash(dj_unit_matrix):
+            order = np.argsort(codes, kind='stable')
+            bucket_codes, starts = np.unique(codes[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            self.tables.append({code: order[start:end] for code, start, end in zip(bucket_codes.tolist(), starts, ends)})
+
+    def _hash(self, vectors):
+        """
+        :param vectors: Array of shape (num_vectors, num_features)
+        :return: Array of shape (num_tables, num_vectors) of bucket hash codes
+        """
+
+        bits = np.einsum('nf,tfb->tnb', vectors, self.planes) > 0
+        return bits.astype(np.int64) @ self.powers
+
+    def candidates(self, query_unit_matrix, top_n):
+        """
+        :param query_unit_matrix: Array of shape (num_queries, num_features) of row-normalized scaled user vectors
+        :param top_n: Number of DJs that will be picked from the candidates
+        :return: List (one per query) of arrays of candidate DJ indices, or None where every DJ must be scored
+        """
+
+        query_codes = self._hash(query_unit_matrix).T  # shape: (num_queries, num_tables)
+
+        candidates = []
+        for codes in query_codes.tolist():
+            buckets = [table[code ^ mask]
+                       for table, code in zip(self.tables, codes)
+                       for mask in self.probe_masks
+                       if code ^ mask in table]
+            found = np.unique(np.concatenate(buckets)) if buckets else np.empty(0, dtype=int)
+
+            # Too few candidates to fill the top n, so fall back to scoring every DJ
+            candidates.append(found if len(found) >= top_n else None)
+
+        return candidates
+
+
+def build_dj_index(dj_unit_matrix):
+    """
+    Builds the DJ index backend selected by the DJ_INDEX environment variable ('exact' or 'lsh', default 'exact').
+    The LSH backend is tuned with DJ_INDEX_LSH_TABLES, DJ_INDEX_LSH_BITS, and DJ_INDEX_LSH_PROBES.
+
+    :param dj_unit_matrix: Array of shape (num_djs, num_features) of row-normalized scaled DJ feature vectors
+    :return: ExactDJIndex or LSHDJIndex
+    """
+
+    backend = os.getenv('DJ_INDEX', 'exact').lower()
+    if backend == 'exact':
+        return ExactDJIndex(dj_unit_matrix)
+    if backend == 'lsh':
+        return LSHDJIndex(dj_unit_matrix,
+                          num_tables=int(os.getenv('DJ_INDEX_LSH_TABLES', 8)),
+                          num_bits=int(os.getenv('DJ_INDEX_LSH_BITS', 10)),
+                          probes=int(os.getenv('DJ_INDEX_LSH_PROBES', 1)))
+    raise ValueError(f"Unknown DJ_INDEX backend '{backend}', expected 'exact' or 'lsh'")
+
+
+def sample_queries(model, num_queries, seed=0):
+    """
+    Builds evaluation queries: every mood centroid plus DJ profiles with noise added, i.e. users resembling real DJs.
+
+    :param model: MatchModel snapshot
+    :param num_queries: Number of noisy DJ profiles to add to the mood centroids
+    :param seed: Seed for picking DJs and noise
+    :return: Array of shape (num_moods + num_queries, num_features) of unscaled user feature vectors
+    """
+
+    rng = np.random.default_rng(seed)
+    dj_rows = model.dj_matrix[rng.integers(0, len(model.dj_matrix), num_queries)]
+    noise = rng.standard_normal(dj_rows.shape) * model.scaler_scale * 0.5
+
+    return np.vstack([np.stack(list(model.mood_centroids.values())), dj_rows + noise])
+
+
+def evaluate_recall(model, index, user_matrix, k=5):
+    """
+    Compares the index's top-k DJs with the exact top-k DJs for every query.
+
+    :param model: MatchModel snapshot
+    :param index: DJ index to evaluate, built on model.dj_unit_matrix
+    :param user_matrix: Array of shape (num_queries, num_features) of unscaled user feature vectors
+    :param k: Number of top DJs to compare
+    :return: Dict with recall@k, mean candidates scored per query, and mean latency (ms) of the exact and index paths
+    """
+
+    from .match import rank_profiles
+
+    no_artists = [[] for _ in range(len(user_matrix))]
+
+    start = time.perf_counter()
+    _, exact = rank_profiles(model, user_matrix, no_artists, k, dj_index=ExactDJIndex(model.dj_unit_matrix))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(user_matrix)
+
+    start = time.perf_counter()
+    _, approx = rank_profiles(model, user_matrix, no_artists, k, dj_index=index)
+    approx_ms = (time.perf_counter() - start) * 1000 / len(user_matrix)
+
+    hits = sum(len(set(e[0]) & set(a[0])) for e, a in zip(exact, approx))
+    candidates = index.candidates(normalize_rows(model.scale(user_matrix)), k)
+    num_scored = [model.dj_unit_matrix.shape[0] if c is None else len(c) for c in candidates]
+
+    return {
+        f'recall@{k}': hits / (k * len(user_matrix)),
+        'mean_candidates': float(np.mean(num_scored)),
+        'num_djs': model.dj_unit_matrix.shape[0],
+        'exact_ms': exact_ms,
+        'index_ms': approx_ms,
+    }
+
+
+if __name__ == '__main__':
+    # Reports recall@5 of an approximate DJ index against exact results, e.g.
+    # python -m match_app.dj_index --tables 8 --bits 10 --probes 1
+    parser = argparse.ArgumentParser(description='Report recall@k of the LSH DJ index against exact matching.')
+    parser.add_argument('--tables', type=int, default=8)
+    parser.add_argument('--bits', type=int, default=10)
+    parser.add_argument('--probes', type=int, default=1, choices=[0, 1])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    from .match_model import get_model
+
+    match_model = get_model()
+    lsh_index = LSHDJIndex(match_model.dj_unit_matrix, num_tables=args.tables, num_bits=args.bits, probes=args.probes)
+    report = evaluate_recall(match_model, lsh_index, sample_queries(match_model, args.queries), k=args.k)
+    for name, value in report.items():
+        print(f'{name}: {value}')
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+# Features that are used as-is
+MISC_FEATURE_COLS = ['danceability', 'bpm']
+
+# High-level AcousticBrainz classifications (1/0) and the classifier's confidence in each
+BINARY_FEATURE_COLS = ['instrumental',
+                       'gender',
+                       'danceable',
+                       'tonal',
+                       'timbre',
+                       'electronic',
+                       'party',
+                       'aggressive',
+                       'acoustic',
+                       'happy',
+                       'sad',
+                       'relaxed']
+
+CONFIDENCE_FEATURE_COLS = ['instrumental_confidence',
+                           'gender_confidence',
+                           'danceable_confidence',
+                           'tonal_confidence',
+                           'timbre_confidence',
+                           'electronic_confidence',
+                           'party_confidence',
+                           'aggressive_confidence',
+                           'acoustic_confidence',
+                           'happy_confidence',
+                           'sad_confidence',
+                           'relaxed_confidence']
+
+PROB_FEATURE_COLS = [f'{binary}_prob' for binary in BINARY_FEATURE_COLS]
+
+# Column order of every feature vector (DJ, user, and mood averages)
+FEATURE_COLS = MISC_FEATURE_COLS + PROB_FEATURE_COLS
+
+# Binary feature columns a user can pick as their mood
+MOOD_COLS = ['happy', 'sad', 'relaxed', 'party', 'aggressive', 'electronic', 'acoustic']
+
+
+def calculate_probabilistic_scores(df):
+    """
+    Converts each binary classification and its confidence into the probability that the track has that quality,
+    for every binary feature column at once.
+
+    :param df: DataFrame containing the binary and confidence feature columns
+    :return: Array of shape (num_rows, len(BINARY_FEATURE_COLS)), in PROB_FEATURE_COLS order
+    """
+
+    binary = df[BINARY_FEATURE_COLS].to_numpy(dtype=float)
+    confidence = df[CONFIDENCE_FEATURE_COLS].to_numpy(dtype=float)
+
+    return (binary * confidence) + ((1 - binary) * (1 - confidence))
+
+
+def calculate_feature_matrix(df):
+    """
+    Builds the feature vector of every track.
+
+    :param df: DataFrame of tracks with AcousticBrainz feature columns
+    :return: Array of shape (num_rows, len(FEATURE_COLS))
+    """
+
+    misc = df[MISC_FEATURE_COLS].to_numpy(dtype=float)
+
+    return np.hstack([misc, calculate_probabilistic_scores(df)])
+
+
+def calculate_avg_features(df):
+    """
+    Averages the feature vectors of a set of tracks, ignoring missing values.
+
+    :param df: DataFrame of tracks with AcousticBrainz feature columns
+    :return: Array of shape (len(FEATURE_COLS), )
+    """
+
+    features = pd.DataFrame(calculate_feature_matrix(df), columns=FEATURE_COLS)
+
+    return features.mean().to_numpy()
+
+
+def calculate_group_feature_sums(features, group_keys):
+    """
+    Sums the feature vectors of every group of tracks (e.g. every DJ) with a single grouped reduction. Missing values
+    are left out of both the sums and the counts, so sums / counts is the NaN-skipping average.
+
+    :param features: Array of track feature vectors from calculate_feature_matrix()
+    :param group_keys: Array of the group each track belongs to
+    :return: (group_keys, sums, counts) where:
+       - group_keys: Array of unique group keys, in order of first appearance
+       - sums: Array of shape (num_groups, len(FEATURE_COLS)), row i belonging to group_keys[i]
+       - counts: Array of the same shape of the number of non-missing values summed
+    """
+
+    grouped = pd.DataFrame(features, columns=FEATURE_COLS).groupby(group_keys, sort=False)
+    sums = grouped.sum()
+    counts = grouped.count()
+
+    return sums.index.to_numpy(), sums.to_numpy(), counts.to_numpy(dtype=float)
+
+
+def calculate_mood_feature_sums(df, features):
+    """
+    Sums the feature vectors of all tracks with each mood, i.e. the station-wide profile of every mood a user can pick.
+
+    :param df: DataFrame of tracks with AcousticBrainz feature columns
+    :param features: Array of the tracks' feature vectors from calculate_feature_matrix()
+    :return: (sums, counts) where:
+       - sums: Array of shape (len(MOOD_COLS), len(FEATURE_COLS)), row i belonging to MOOD_COLS[i]
+       - counts: Array of the same shape of the number of non-missing values summed
+    """
+
+    has_mood = (df[MOOD_COLS].to_numpy(dtype=float) == 1).astype(float)  # shape: (num_tracks, num_moods)
+    present = ~np.isnan(features)
+
+    return has_mood.T @ np.where(present, features, 0), has_mood.T @ present
+
+
+def average_feature_sums(sums, counts):
+    """
+    :param sums: Array of feature sums
+    :param counts: Array of the same shape of the number of values summed
+    :return: Array of averages, NaN where nothing was summed
+    """
+
+    return np.divide(sums, counts, out=np.full_like(sums, np.nan), where=counts > 0)
+
+
+def normalize_rows(matrix):
+    """
+    Scales every row to unit length (all-zero rows are left as zeros), so cosine similarities become dot products.
+
+    :param matrix: Array of shape (num_rows, num_features)
+    :return: Row-normalized array of the same shape
+    """
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
@@ -0,0 +1,65 @@
+import fcntl
+import os
+import pandas as pd
+from .features import MISC_FEATURE_COLS, BINARY_FEATURE_COLS, CONFIDENCE_FEATURE_COLS
+from .match_model import get_data_path, get_spin_log_path, get_model
+
+# Columns every spin needs for the DJ profiles to be updated
+REQUIRED_SPIN_COLS = ['DJ ID', 'DJ Name', 'artist_id'] + MISC_FEATURE_COLS + BINARY_FEATURE_COLS + CONFIDENCE_FEATURE_COLS
+
+
+def ingest_spins(spins):
+    """
+    Ingests newly played spins: playlist rows with AcousticBrainz features, in the same format as the tracks CSV. The
+    spins are appended to the spin log, which every worker applies to its served model's running sums on its next
+    request, so new shows are reflected without a full rebuild.
+
+    :param spins: A spin dict, a list of spin dicts, or a DataFrame of spins
+    :return: Number of spins ingested
+    """
+
+    if isinstance(spins, dict):
+        spins = [spins]
+    spins_df = pd.DataFrame(spins)
+    if spins_df.empty:
+        return 0
+
+    missing_cols = [col for col in REQUIRED_SPIN_COLS if col not in spins_df.columns]
+    if missing_cols:
+        raise ValueError(f'Spins are missing columns: {missing_cols}')
+
+    # Reject bad rows here, rather than when every worker tries to apply them
+    spins_df['DJ ID'] = pd.to_numeric(spins_df['DJ ID'], errors='raise').astype('int64')
+    numeric_cols = MISC_FEATURE_COLS + BINARY_FEATURE_COLS + CONFIDENCE_FEATURE_COLS
+    spins_df[numeric_cols] = spins_df[numeric_cols].apply(pd.to_numeric, errors='raise')
+    missing_values = [col for col in numeric_cols if spins_df[col].isna().any()]
+    if missing_values:
+        raise ValueError(f'Spins are missing feature values: {missing_values}')
+    bad_flags = [col for col in BINARY_FEATURE_COLS if not spins_df[col].isin([0, 1]).all()]
+    if bad_flags:
+        raise ValueError(f'Spins have binary features that are not 0 or 1: {bad_flags}')
+    bad_confidences = [col for col in CONFIDENCE_FEATURE_COLS if not spins_df[col].between(0, 1).all()]
+    if bad_confidences:
+        raise ValueError(f'Spins have confidences outside [0, 1]: {bad_confidences}')
+
+    # Store spins with the same columns as the tracks CSV
+    with open(get_data_path()) as tracks_csv:
+        columns = pd.read_csv(tracks_csv, nrows=0).columns
+    spins_df = spins_df.reindex(columns=columns)
+
+    spin_log_path = get_spin_log_path()
+    with open(spin_log_path, 'a') as spin_log:
+        # Lock so concurrent workers neither interleave rows nor both write the header. The size is checked only once
+        # the lock is held, since another worker may have written the header after this one opened the log.
+        fcntl.flock(spin_log, fcntl.LOCK_EX)
+        try:
+            is_empty = os.fstat(spin_log.fileno()).st_size == 0
+            spin_log.write(spins_df.to_csv(index=False, header=is_empty))
+            spin_log.flush()
+        finally:
+            fcntl.flock(spin_log, fcntl.LOCK_UN)
+
+    # Apply the spins to this worker's model right away
+    get_model()
+
+    return len(spins_df)
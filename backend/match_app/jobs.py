@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+class JobsUnavailable(RuntimeError):
+    """
+    Raised when match jobs can't be served reliably: the local backend keeps jobs in the worker that created them, so
+    with several workers most polls would land on a worker that doesn't have the job.
+    """
+
+
+def get_job_key(payload):
+    """
+    :param payload: Dict of the match job's inputs ('mood', 'artists', and 'spider_figure')
+    :return: Key identifying the inputs, the same for the same mood and set of artists
+    """
+
+    normalized = {
+        'mood': str(payload['mood']).lower(),
+        'artists': sorted(artist['mbid'] for artist in payload['artists']),
+        'spider_figure': bool(payload['spider_figure']),
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def run_match_job(payload):
+    """
+    :param payload: Dict of the match job's inputs ('mood', 'artists', and 'spider_figure')
+    :return: The match results (see match.get_results()), with JOB_LATENCY_BUDGET seconds (60 by default) for the
+        artists' enrichment
+    """
+
+    from .match import get_results
+
+    return get_results(payload['mood'], payload['artists'], timeout=float(os.getenv('JOB_LATENCY_BUDGET', 60)),
+                       spider_figure=payload['spider_figure'])
+
+
+class LocalJobQueue:
+    """
+    Match jobs queued and run in this worker, on a pool of background greenlets. Jobs are only visible to the worker
+    that created them, so this suits a single worker and tests.
+    """
+
+    def __init__(self, runner, num_workers, ttl):
+        """
+        :param runner: Function of a job's payload returning its results
+        :param num_workers: Max number of jobs run at once
+        :param ttl: Seconds a finished job's results are kept
+        """
+
+        from gevent.pool import Pool
+
+        self.runner = runner
+        self.ttl = ttl
+        self._pool = Pool(num_workers)
+        self._jobs = {}  # job ID -> (job, expiry time, or None while it runs)
+        self._job_ids = {}  # job key -> job ID
+        self._lock = threading.Lock()
+
+    def submit(self, payload):
+        """
+        :param payload: Dict of the job's inputs
+        :return: The job for the inputs, a new one unless one is queued, running, or done (and not expired)
+        """
+
+        key = get_job_key(payload)
+        with self._lock:
+            self._purge()
+            job_id = self._job_ids.get(key)
+            if job_id is not None and self._jobs[job_id][0]['status'] != 'failed':
+                return dict(self._jobs[job_id][0])
+
+            job = {'job_id': uuid.uuid4().hex, 'status': 'queued'}
+            self._jobs[job['job_id']] = (job, None)
+            self._job_ids[key] = job['job_id']
+
+        # Queued jobs wait for a free greenlet without blocking the request
+        from gevent import spawn
+
+        spawn(self._pool.spawn, self._run, job['job_id'], payload)
+        return dict(job)
+
+    def get(self, job_id):
+        """
+        :param job_id: Job ID
+        :return: The job, or None if there is no such job or it expired
+        """
+
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            return dict(job[0]) if job is not None else None
+
+    def _run(self, job_id, payload):
+        self._update(job_id, {'status': 'running'})
+        try:
+            results = self.runner(payload)
+        except Exception as e:
+            print(f'Match job {job_id} failed: {e}')
+            self._update(job_id, {'status': 'failed', 'error': str(e)}, finished=True)
+        else:
+            self._update(job_id, {'status': 'done', 'results': results}, finished=True)
+
+    def _update(self, job_id, fields, finished=False):
+        with self._lock:
+            job, expires_at = self._jobs[job_id]
+            job = {**job, **fields}
+            self._jobs[job_id] = (job, time.monotonic() + self.ttl if finished else expires_at)
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = {job_id for job_id, (_, expires_at) in self._jobs.items()
+                   if expires_at is not None and expires_at <= now}
+        for job_id in expired:
+            del self._jobs[job_id]
+        self._job_ids = {key: job_id for key, job_id in self._job_ids.items() if job_id not in expired}
+
+
+class RedisJobQueue:
+    """
+    Match jobs shared by every worker in Redis (REDIS_URL): each job is a JSON value under 'match_job:{id}', identical
+    inputs map to their job under 'match_job_key:{key}', and queued jobs wait in the 'match_jobs' list, from which
+    every worker runs up to num_workers at once on background greenlets.
+    """
+
+    QUEUE_KEY = 'match_jobs'
+
+    def __init__(self, runner, num_workers, ttl):
+        """
+        :param runner: Function of a job's payload returning its results
+        :param num_workers: Max number of jobs this worker runs at once
+        :param ttl: Seconds a finished job's results are kept
+        """
+
+        import gevent
+        import redis
+
+        self.runner = runner
+        self.ttl = ttl
+        # Unfinished jobs (e.g. of a worker that died) expire too, after the longest a job should take
+        self.pending_ttl = ttl + int(os.getenv('JOB_MAX_RUNTIME', 600))
+        self._client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        for _ in range(num_workers):
+            gevent.spawn(self._work)
+
+    def submit(self, payload):
+        """
+        :param payload: Dict of the job's inputs
+        :return: The job for the inputs, a new one unless one is queued, running, or done (and not expired)
+        """
+
+        key_name = f'match_job_key:{get_job_key(payload)}'
+        job = {'job_id': uuid.uuid4().hex, 'status': 'queued'}
+        for _ in range(2):
+            if self._client.set(key_name, job['job_id'], nx=True, ex=self.pending_ttl):
+                self._save(job, self.pending_ttl)
+                self._client.rpush(self.QUEUE_KEY, json.dumps({'job_id': job['job_id'], 'payload': payload}))
+                return job
+
+            existing_id = self._client.get(key_name)
+            existing = self.get(existing_id.decode()) if existing_id is not None else None
+            if existing is not None and existing['status'] != 'failed':
+                return existing
+            # The job failed or expired, so retry it
+            self._client.delete(key_name)
+
+        return job
+
+    def get(self, job_id):
+        """
+        :param job_id: Job ID
+        :return: The job, or None if there is no such job or it expired
+        """
+
+        value = self._client.get(f'match_job:{job_id}')
+        return json.loads(value) if value is not None else None
+
+    def _save(self, job, ttl):
+        self._client.setex(f'match_job:{job["job_id"]}', max(int(ttl), 1), json.dumps(job))
+
+    def _work(self):
+        while True:
+            try:
+                item = self._client.blpop(self.QUEUE_KEY, timeout=5)
+            except Exception as e:
+                print(f'Could not read the match job queue: {e}')
+                time.sleep(5)
+                continue
+            if item is None:
+                continue
+
+            queued = json.loads(item[1])
+            job_id = queued['job_id']
+            self._save({'job_id': job_id, 'status': 'running'}, self.pending_ttl)
+            try:
+                results = self.runner(queued['payload'])
+            except Exception as e:
+                print(f'Match job {job_id} failed: {e}')
+                self._save({'job_id': job_id, 'status': 'failed', 'error': str(e)}, self.ttl)
+            else:
+                self._save({'job_id': job_id, 'status': 'done', 'results': results}, self.ttl)
+
+
+def get_job_backend():
+    """
+    :return: The match job backend set by JOB_BACKEND: 'redis' (jobs shared by every worker, at REDIS_URL) or 'local'
+        (jobs run in the worker that created them). Defaults to 'redis' if REDIS_URL is set, else 'local'.
+    """
+
+    backend = os.getenv('JOB_BACKEND') or ('redis' if os.getenv('REDIS_URL') else 'local')
+    return 'redis' if backend == 'redis' else 'local'
+
+
+def get_job_queue():
+    """
+    Creates the match job queue on first use (in the worker, after forking), with the backend from get_job_backend().
+    JOB_WORKERS (4) bounds the jobs a worker runs at once, and JOB_RESULT_TTL (600) is how many seconds results are
+    kept.
+
+    :return: The LocalJobQueue or RedisJobQueue
+    :raises JobsUnavailable: If the backend is 'local' but the app runs more than one worker (GUNICORN_WORKERS)
+    """
+
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            backend = get_job_backend()
+            num_app_workers = int(os.getenv('GUNICORN_WORKERS', 1))
+            if backend == 'local' and num_app_workers > 1:
+                raise JobsUnavailable(f'Match jobs need JOB_BACKEND=redis (or REDIS_URL) with {num_app_workers} '
+                                      f'workers, since local jobs are only visible to the worker that created them')
+            queue_class = RedisJobQueue if backend == 'redis' else LocalJobQueue
+            _job_queue = queue_class(run_match_job, int(os.getenv('JOB_WORKERS', 4)),
+                                     float(os.getenv('JOB_RESULT_TTL', 600)))
+        return _job_queue
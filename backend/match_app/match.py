@@ -1,97 +1,313 @@
-import pandas as pd
 import numpy as np
-import os
 import math
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
-import plotly.graph_objects as go
-from .user import User
-from .dj import DJ
+import functools
+import json
+import os
+from .user import User, get_artists_features, iter_artists_features
+from .match_model import get_model
+from .show_responses import get_dj_show_info, get_dj_show_infos
+from .features import FEATURE_COLS, normalize_rows
 
 
-def get_matches(mood, user_artists):
+def get_matches(mood, user_artists, timeout=None):
     """
     Finds and ranks DJ matches based on musical feature similarity and artist overlap.
 
     :param mood: String indicating user's selected mood
     :param user_artists: List of dicts containing artist info (mbid, name)
-    :return: (matched_djs, match_features, user_features) where:
+    :param timeout: Optional seconds to wait for the artists' enrichment, after which the match uses only the tracks
+        found so far (or only the mood)
+    :return: (matched_djs, match_features, user_features, skipped_sources) where:
        - matched_djs: List of top 5 DJ matches with name, id, match similarity score, and match score percentage
        - match_features: Feature array of top DJ match (for visualization)
        - user_features: Scaled feature array of user profile (for visualization)
+       - skipped_sources: Sorted list of the external sources skipped (circuit open, request failed, or out of time)
     """
 
-    tracks_df = pd.read_csv(os.path.join(os.getcwd(), 'data', 'sliced_ab_data.csv'))
+    # Snapshot of the station data, held for the whole request even if a reload swaps in a newer one
+    model = get_model()
+
+    skipped = set()
+    artist_features = get_artists_features(user_artists, timeout=timeout, skipped=skipped) if user_artists else None
+    matched_djs, match_features, user_features = match_user(model, mood, user_artists, artist_features)
 
-    # TODO UPDATE DJs (Read from new show_responses)
-    # Initialize DJs
-    djs_list = []
-    unique_dj_ids = tracks_df['DJ ID'].unique()
-    for dj_id in unique_dj_ids:
-        djs_list.append(DJ(dj_id, tracks_df))
+    return matched_djs, match_features, user_features, sorted(skipped)
 
-    dj_matrix = np.stack([dj.avg_features for dj in djs_list])  # shape: (num_djs, num_features)
 
-    user = User(mood, user_artists, [], tracks_df)
+def match_user(model, mood, user_artists, artist_features):
+    """
+    :param model: MatchModel snapshot to match against
+    :param mood: String indicating user's selected mood
+    :param user_artists: List of dicts containing artist info (mbid, name)
+    :param artist_features: List of artist feature cache entries of the user's artists (may be partial), or None to
+        look them up
+    :return: (matched_djs, match_features, user_features), as returned by get_matches()
+    """
+
+    user = User(mood, user_artists, [], model.mood_centroids, artist_features=artist_features)
     user_vector = user.avg_features.reshape(1, -1)  # shape: (1, num_features)
+    artist_mbids = [artist['mbid'] for artist in user_artists or []]
+
+    top_n = 5
+    user_scaled_matrix, rankings = rank_profiles(model, user_vector, [artist_mbids], top_n)
+    top_n_indices, top_n_similarities, top_n_scores = rankings[0]
+    matched_djs = format_matches(model, top_n_indices, top_n_similarities, top_n_scores)
+
+    # The features array (identical to dj.avg_features) of the top DJ match, used for visualization purposes
+    match_features = model.dj_scaled_matrix[top_n_indices][0]
+    user_features = user_scaled_matrix[0]
+
+    return matched_djs, match_features, user_features
+
+
+def get_results(mood, user_artists, timeout=None, spider_figure=False):
+    """
+    Builds the results of a match: the DJ matches and percentages, the spider plot, the DJ match's show info, and the
+    sources skipped.
+
+    :param mood: String indicating user's selected mood
+    :param user_artists: List of dicts containing artist info (mbid, name)
+    :param timeout: Optional seconds to wait for the artists' enrichment (see get_matches())
+    :param spider_figure: Whether to send the full Plotly figure instead of the spider plot's feature vectors
+    :return: Dict of the results
+    """
+
+    top_djs, dj_features, user_features, skipped_sources = get_matches(mood, user_artists, timeout=timeout)
+    return format_results(top_djs, dj_features, user_features, skipped_sources, spider_figure)
+
+
+def stream_results(mood, user_artists, timeout=None, spider_figure=False):
+    """
+    Builds the results of a match progressively: a ranking from the mood (and artist overlap) alone, which needs no
+    external calls, then a refined ranking as each artist's enrichment finishes, then the full results.
+
+    :param mood: String indicating user's selected mood
+    :param user_artists: List of dicts containing artist info (mbid, name)
+    :param timeout: Optional seconds to wait for the artists' enrichment (see get_matches())
+    :param spider_figure: Whether to send the full Plotly figure instead of the spider plot's feature vectors
+    :return: Generator of (event, data) pairs: ('ranking', dict with the 'dj_match', 'top_djs', 'match_percentages',
+        the DJ match's show info, and the number of artists 'enriched' out of 'num_artists'), then ('results', dict of
+        the full results, as returned by get_results())
+    """
+
+    model = get_model()
+    user_artists = user_artists or []
+    num_artists = len({artist['mbid'] for artist in user_artists})
+
+    def ranking(matched_djs, enriched):
+        return {
+            'dj_match': matched_djs[0]['dj_name'],
+            'top_djs': [dj['dj_name'] for dj in matched_djs],
+            'match_percentages': [dj['match_percent'] for dj in matched_djs],
+            # So the DJ match's show details render before the full results arrive (served from the show info cache)
+            **get_dj_show_info(matched_djs[0]['dj_id']),
+            'enriched': enriched,
+            'num_artists': num_artists,
+        }
+
+    # The mood-only ranking
+    matched_djs, match_features, user_features = match_user(model, mood, user_artists, [])
+    yield 'ranking', ranking(matched_djs, 0)
+
+    skipped = set()
+    artist_features = []
+    for _, entry in iter_artists_features(user_artists, timeout=timeout, skipped=skipped):
+        artist_features.append(entry)
+        # Only artists with tracks change the ranking
+        if entry['num_tracks']:
+            matched_djs, match_features, user_features = match_user(model, mood, user_artists, artist_features)
+        yield 'ranking', ranking(matched_djs, len(artist_features))
+
+    yield 'results', format_results(matched_djs, match_features, user_features, sorted(skipped), spider_figure)
+
+
+def format_results(top_djs, dj_features, user_features, skipped_sources, spider_figure=False):
+    """
+    :param top_djs: List of the top DJ matches (see get_matches())
+    :param dj_features: Feature array of top DJ match
+    :param user_features: Scaled feature array of user profile
+    :param skipped_sources: Sorted list of the external sources skipped
+    :param spider_figure: Whether to send the full Plotly figure instead of the spider plot's feature vectors
+    :return: Dict of the results: the DJ matches and percentages, the spider plot, the DJ match's show info (and the
+        top DJs' in 'top_djs_show_info'), and the sources skipped
+    """
+
+    # Parse the match data
+    match_name = top_djs[0]['dj_name']
+    match_id = top_djs[0]['dj_id']
+    top_dj_names = [dj['dj_name'] for dj in top_djs]
+    top_dj_percentages = [dj['match_percent'] for dj in top_djs]
+
+    results = ({
+        'dj_match': match_name,
+        'top_djs': top_dj_names,
+        'match_percentages': top_dj_percentages,
+        'skipped_sources': skipped_sources,  # e.g. ['acousticbrainz'] if the match is based on partial data
+    })
+    # Send only the spider plot's feature vectors (plotted with the cached /api/spider-layout), or the full figure
+    if spider_figure:
+        results['spider_fig'] = spider_plot(user_features, dj_features, match_name)
+    else:
+        results['spider_data'] = spider_payload(user_features, dj_features, match_name)
+
+    # Append the DJ match's show responses data (e.g. About Me, timeslot, show name, etc.), and the other top DJs'
+    show_infos = get_dj_show_infos([dj['dj_id'] for dj in top_djs])
+    results.update(show_infos[int(match_id)])
+    results['top_djs_show_info'] = [show_infos[int(dj['dj_id'])] for dj in top_djs]
+
+    return results
+
+
+def get_matches_batch(profiles, top_n=5, enrich_artists=True, timeout=None, skipped=None):
+    """
+    Finds and ranks DJ matches for many user profiles at once, e.g. for offline campaigns and analytics jobs. Every
+    distinct artist is enriched once for the whole batch, and all profiles are scored against all DJs with one matrix
+    product.
+
+    :param profiles: List of dicts with a 'mood' string and an 'artists' list of dicts containing artist info (mbid, name)
+    :param top_n: Number of DJ matches to return per profile
+    :param enrich_artists: Whether to look up the artists' tracks' audio features. If False, each profile's features are
+        its mood centroid alone, and its artists only count towards artist overlap.
+    :param timeout: Optional seconds to wait for the enrichment; artists not enriched by then get no features
+    :param skipped: Optional set to add the names of the sources that were skipped to
+    :return: List of matched_djs lists (in the same format as get_matches()), one per profile in the same order
+    """
 
-    # Initialize and fit the StandardScaler on DJ data only
-    scaler = StandardScaler()
-    scaler.fit(dj_matrix)
+    model = get_model()
+    if not profiles:
+        return []
+
+    # Look up each distinct artist once, rather than once per profile that picked it
+    artist_features = {}
+    if enrich_artists:
+        distinct_artists = list({artist['mbid']: artist for profile in profiles
+                                 for artist in profile.get('artists') or []}.values())
+        artist_features = dict(zip([artist['mbid'] for artist in distinct_artists],
+                                   get_artists_features(distinct_artists, timeout=timeout, skipped=skipped)))
+
+    user_vectors = []
+    artist_mbid_lists = []
+    for profile in profiles:
+        artists = profile.get('artists') or []
+        artist_mbids = [artist['mbid'] for artist in artists]
+
+        features = [artist_features[mbid] for mbid in artist_mbids if mbid in artist_features]
+        user = User(profile['mood'], artists, [], model.mood_centroids, artist_features=features, verbose=False)
+        user_vectors.append(user.avg_features)
+        artist_mbid_lists.append(artist_mbids)
+
+    # Score in chunks to bound the size of the (num_users, num_djs) score matrices
+    chunk_size = 1024
+    matches = []
+    for start in range(0, len(profiles), chunk_size):
+        user_matrix = np.stack(user_vectors[start:start + chunk_size])
+        _, rankings = rank_profiles(model, user_matrix, artist_mbid_lists[start:start + chunk_size], top_n)
+        matches.extend(format_matches(model, *ranking) for ranking in rankings)
+
+    return matches
+
+
+def rank_profiles(model, user_matrix, artist_mbid_lists, top_n, dj_index=None):
+    """
+    Ranks DJs for user profiles by combining musical feature similarity and artist overlap. DJs are scored against the
+    candidates from the model's DJ index; users the index gives no candidates for (always, for the exact index) are
+    scored against every DJ with one matrix product.
+
+    :param model: MatchModel snapshot to score against
+    :param user_matrix: Array of shape (num_users, num_features) of unscaled user feature vectors
+    :param artist_mbid_lists: List (one per user) of lists of the user's artists' MusicBrainz IDs
+    :param top_n: Number of DJs to rank per user
+    :param dj_index: DJ index to get candidates from (defaults to model.dj_index)
+    :return: (user_scaled_matrix, rankings) where:
+       - user_scaled_matrix: Array of shape (num_users, num_features) of scaled user feature vectors
+       - rankings: List (one per user) of (dj_indices, feature_similarities, overall_scores) of the top n DJs, best first
+    """
 
-    # Transform both DJ and User vectors using the same scaler
-    dj_scaled_matrix = scaler.transform(dj_matrix)
-    user_scaled_vector = scaler.transform(user_vector)
+    dj_index = dj_index or model.dj_index
 
-    feature_similarities = cosine_similarity(user_scaled_vector, dj_scaled_matrix).flatten()  # shape: (num_djs, )
+    # Transform the User vectors using the scaler fitted on DJ data only
+    user_scaled_matrix = model.scale(user_matrix)
+    user_unit_matrix = normalize_rows(user_scaled_matrix)
 
     # Calculate artist overlap scores with frequency weighting
-    artist_overlap_scores = np.zeros(len(djs_list))
-    for i, dj in enumerate(djs_list):
-        # Count frequency of each artist played by DJ
-        dj_artist_frequencies = dj.get_tracks()['artist_id'].value_counts()
-
-        user_artists_ids = {artist['mbid'] for artist in user_artists}
-
-        # Calculate weighted overlap
-        weighted_overlap = 0
-        for artist_id in user_artists_ids:
-            if artist_id in dj_artist_frequencies.index:
-                # Add normalized frequency for each matching artist
-                # Log scale to prevent extremely frequent plays from dominating
-                weighted_overlap += np.log1p(dj_artist_frequencies[artist_id])
-
-        # Normalize by number of user artists and max possible frequency
-        max_possible_freq = np.log1p(dj.get_tracks()['artist_id'].value_counts().max())
-        artist_overlap_scores[i] = (weighted_overlap / (len(user_artists_ids) * max_possible_freq)) if user_artists_ids else 0
-
-    # Combine feature similarity and artist overlap with weights
+    artist_overlap_scores = model.artist_index.overlap_scores_batch(artist_mbid_lists)  # shape: (num_users, num_djs)
+
+    candidate_lists = dj_index.candidates(user_unit_matrix, top_n)
+    rankings = [None] * len(user_matrix)
+
+    # Users to score against every DJ: cosine similarity with all DJs as one product of row-normalized matrices
+    full_rows = [row for row, candidates in enumerate(candidate_lists) if candidates is None]
+    if full_rows:
+        feature_similarities = user_unit_matrix[full_rows] @ model.dj_unit_matrix.T  # shape: (num_rows, num_djs)
+        overall_scores = combine_scores(feature_similarities, artist_overlap_scores[full_rows])
+        top_n_indices = top_n_score_indices(overall_scores, top_n)
+        for row, indices, similarities, scores in zip(full_rows, top_n_indices, feature_similarities, overall_scores):
+            rankings[row] = (indices, similarities[indices], scores[indices])
+
+    # Users with index candidates: only score those, plus any DJ that played one of the user's artists
+    for row, candidates in enumerate(candidate_lists):
+        if candidates is None:
+            continue
+        candidates = np.union1d(candidates, np.flatnonzero(artist_overlap_scores[row]))
+        similarities = model.dj_unit_matrix[candidates] @ user_unit_matrix[row]
+        scores = combine_scores(similarities, artist_overlap_scores[row, candidates])
+        best = top_n_score_indices(scores.reshape(1, -1), top_n)[0]
+        rankings[row] = (candidates[best], similarities[best], scores[best])
+
+    return user_scaled_matrix, rankings
+
+
+def combine_scores(feature_similarities, artist_overlap_scores):
+    """
+    Combines feature similarity and artist overlap with weights.
+
+    :param feature_similarities: Array of cosine similarities
+    :param artist_overlap_scores: Array of artist overlap scores, the same shape as feature_similarities
+    :return: Array of overall match scores
+    """
+
     alpha = 0.85  # Feature similarity weight
     beta = 0.15   # Artist overlap weight
 
-    overall_scores = (alpha * feature_similarities + beta * artist_overlap_scores)
+    return alpha * feature_similarities + beta * artist_overlap_scores
 
 
-    top_n = 5
-    top_n_indices = overall_scores.argsort()[-top_n:][::-1]  # Sort in desc order + pick best n
+def top_n_score_indices(scores, top_n):
+    """
+    Picks the indices of the best n DJs for every user.
+
+    :param scores: Array of shape (num_users, num_djs) of match scores
+    :param top_n: Number of DJs to pick
+    :return: Array of shape (num_users, top_n) of DJ indices, in descending order of score
+    """
+
+    top_n = min(top_n, scores.shape[1])
+    candidates = np.argpartition(scores, -top_n, axis=1)[:, -top_n:]  # Best n in arbitrary order
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=1), axis=1)[:, ::-1]  # Sort in desc order
+
+    return np.take_along_axis(candidates, order, axis=1)
+
 
-    matched_djs = [
+def format_matches(model, dj_indices, feature_similarities, overall_scores):
+    """
+    :param model: MatchModel snapshot the scores were computed against
+    :param dj_indices: Indices of the matched DJs, best first
+    :param feature_similarities: Cosine similarities of the matched DJs, aligned with dj_indices
+    :param overall_scores: Combined match scores of the matched DJs, aligned with dj_indices
+    :return: List of DJ matches with name, id, match similarity score, and match score percentage
+    """
+
+    return [
         {
-            'dj_name': djs_list[idx].get_name(),
-            'dj_id': djs_list[idx].get_id(),
-            'similarity': feature_similarities[idx],
+            'dj_name': model.dj_metadata[idx]['dj_name'],
+            'dj_id': int(model.dj_metadata[idx]['dj_id']),
+            'similarity': float(similarity),
             # Linear map cosine sim from [-1, 1] -> [0, 100], then round
-            'match_percent': round(((overall_scores[idx] + 1) / 2) * 100, 2),
+            'match_percent': round(((float(score) + 1) / 2) * 100, 2),
         }
-        for i, idx in enumerate(top_n_indices)
+        for idx, similarity, score in zip(dj_indices, feature_similarities, overall_scores)
     ]
 
-    # The features array (identical to dj.avg_features) of the top DJ match, used for visualization purposes
-    match_features = dj_scaled_matrix[top_n_indices][0]
-    user_features = user_scaled_vector.flatten()
-
-    return matched_djs, match_features, user_features
-
 
 def angular_similarity(cos_sim):
     """
@@ -104,6 +320,28 @@ def angular_similarity(cos_sim):
     return 1 - math.acos(cos_sim) / math.pi
 
 
+# Remove the 'Danceability Probability/Confidence' feature from the visualization. While it is useful in the
+# calculations (as a Danceable yes/no likelihood metric), its difference from the 'Danceability' feature (which is a
+# low-level, rather than a high-level, AcousticBrainz feature and therefore more accurate) is too nuanced to explain
+# in a big-picture feature data visualization. However, they are similar enough that its exclusion should not cloud
+# any conclusions the user might draw.
+# So, 'Danceability Probability/Confidence' (index 4 of the feature vectors) is removed from the visualization only.
+SPIDER_HIDDEN_INDEX = FEATURE_COLS.index('danceable_prob')
+
+# Bump whenever get_spider_layout() changes, so clients refetch the layout they have cached
+SPIDER_LAYOUT_VERSION = 1
+
+
+def get_spider_plot_mode():
+    """
+    :return: 'payload' to send only the spider plot's feature vectors (merged with get_spider_layout() by the frontend),
+        or 'figure' to send the full server-side Plotly figure, set by SPIDER_PLOT_MODE (default 'payload')
+    """
+
+    mode = os.getenv('SPIDER_PLOT_MODE', 'payload')
+    return mode if mode in ('payload', 'figure') else 'payload'
+
+
 def spider_plot(user_vector, dj_vector, dj_name):
     """
    Creates a spider/radar plot overlaying user and DJ musical features.
@@ -115,43 +353,77 @@ def spider_plot(user_vector, dj_vector, dj_name):
     :return: JSON string of Plotly figure object
     """
 
-    # Feature column names from user_vector and dj_vector
-    angular_vars = ['danceability', 'bpm', 'instrumental_prob', 'gender_prob', 'tonal_prob', 'timbre_prob', 'electronic_prob', 'party_prob', 'aggressive_prob', 'acoustic_prob', 'happy_prob', 'sad_prob', 'relaxed_prob']
+    import plotly.graph_objects as go  # Deferred, since only the figure fallback needs Plotly
 
-    # Rename columns to look prettier
-    angular_vars = prettify_theta(angular_vars)
+    spider_layout = get_spider_layout()
+    theta = spider_layout['theta']
 
-    # Remove the 'Danceability Probability/Confidence' feature from the visualization. While it is useful in the
-    # calculations (as a Danceable yes/no likelihood metric), its difference from the 'Danceability' feature (which is a
-    # low-level, rather than a high-level, AcousticBrainz feature and therefore more accurate) is too nuanced to explain
-    # in a big-picture feature data visualization. However, they are similar enough that its exclusion should not cloud
-    # any conclusions the user might draw.
-    # So, 'Danceability Probability/Confidence' located at index i=4 is removed from the visualization only.
-    user_vector_mod = np.delete(user_vector, 4)
-    dj_vector_mod = np.delete(dj_vector, 4)
-
-    fig = go.Figure()
+    fig = go.Figure(layout=spider_layout['layout'])
     fig.add_trace(go.Scatterpolar(
-        r=user_vector_mod,
-        theta=angular_vars,
+        r=np.delete(user_vector, SPIDER_HIDDEN_INDEX),
+        theta=theta,
         fill='toself',
         name='You'
     ))
     fig.add_trace(go.Scatterpolar(
-        r=dj_vector_mod,
-        theta=angular_vars,
+        r=np.delete(dj_vector, SPIDER_HIDDEN_INDEX),
+        theta=theta,
         fill='toself',
         name=dj_name
     ))
+    fig_json = fig.to_json()
+
+    return fig_json
+
+
+def spider_payload(user_vector, dj_vector, dj_name):
+    """
+    Creates the lightweight spider plot payload: just the user and DJ feature vectors, which the frontend plots with the
+    layout from get_spider_layout().
+
+    :param user_vector: Array of user's musical feature values
+    :param dj_vector: Array of DJ's musical feature values
+    :param dj_name: String of DJ's name for plot legend
+    :return: Dict with the 'layout_version', the 'user' and 'dj' feature values (in the order of the layout's theta),
+        and the 'dj_name'
+    """
+
+    return {
+        'layout_version': SPIDER_LAYOUT_VERSION,
+        'user': np.delete(user_vector, SPIDER_HIDDEN_INDEX).astype(float).tolist(),
+        'dj': np.delete(dj_vector, SPIDER_HIDDEN_INDEX).astype(float).tolist(),
+        'dj_name': dj_name,
+    }
+
+
+@functools.cache
+def get_spider_layout():
+    """
+    Builds the static parts of the spider plot once: the axis labels, the trace settings, and the Plotly layout
+    (theme included).
+
+    :return: Dict with the 'version', the 'theta' axis labels, the 'trace' settings shared by both traces, and the
+        'layout'
+    """
+
+    import plotly.graph_objects as go
+
+    theta = prettify_theta([col for i, col in enumerate(FEATURE_COLS) if i != SPIDER_HIDDEN_INDEX])
+
+    fig = go.Figure()
     # Disable drag and zoom
     fig.update_layout(
         dragmode=False,
         paper_bgcolor="rgba(0,0,0,0)",
         font_color="white",
     )
-    fig_json = fig.to_json()
 
-    return fig_json
+    return {
+        'version': SPIDER_LAYOUT_VERSION,
+        'theta': theta,
+        'trace': {'type': 'scatterpolar', 'fill': 'toself'},
+        'layout': json.loads(fig.to_json())['layout'],
+    }
 
 
 def prettify_theta(column_names):
@@ -0,0 +1,345 @@
+import os
+import threading
+import time
+import warnings
+import numpy as np
+from .artifact import MANIFEST_FILE, get_artifact_path, is_artifact_stale, load_artifact, load_artifact_profiles, \
+    recompute_artifact_profiles
+from .artist_index import ArtistIndex
+from .dj import DJ
+from .dj_index import build_dj_index
+from .features import normalize_rows
+from .profiles import ProfileAccumulator, read_spins
+from .tracks import load_tracks
+
+
+class MatchModel:
+    """
+    Immutable snapshot of the station data that get_matches needs: the DJ list, the (scaled) DJ feature matrix, the
+    fitted scaler parameters, the DJ x artist index, the per-mood centroids, the DJ index, and per-DJ metadata (names,
+    recent songs, and optionally show responses). A snapshot is never modified after it is built; reloading the data or
+    ingesting spins builds a new snapshot and swaps it in, so requests holding a reference to the old one are
+    unaffected.
+    """
+
+    def __init__(self, profiles, stamp=None, spin_log_offset=0, precomputed=None, show_responses=None):
+        """
+        :param profiles: ProfileAccumulator the snapshot is derived from (owned by the snapshot from then on)
+        :param stamp: Identifies the version of the data file this snapshot was built from
+        :param spin_log_offset: Byte offset up to which the spin log has been applied
+        :param precomputed: Optional dict with the 'dj_matrix', 'scaler_mean', and 'scaler_scale' arrays for exactly
+            these profiles (e.g. from a match model artifact), so they are not recomputed
+        :param show_responses: Optional dict mapping DJ IDs to their show_responses documents
+        """
+
+        self.profiles = profiles
+        self.stamp = stamp
+        self.spin_log_offset = spin_log_offset
+        self.show_responses = show_responses
+
+        # DJ averages come from running sums, so new spins don't require a pass over every track
+        if precomputed is not None:
+            self.dj_matrix = precomputed['dj_matrix']
+        else:
+            self.dj_matrix = profiles.dj_avg_features()  # shape: (num_djs, num_features)
+        self.djs = [DJ(dj_id, name, avg_features)
+                    for dj_id, name, avg_features in zip(profiles.dj_ids, profiles.dj_names, self.dj_matrix)]
+        self.dj_metadata = [{'dj_id': dj.get_id(), 'dj_name': dj.get_name()} for dj in self.djs]
+
+        # Average features of all station tracks with each mood, which only change with the data
+        self.mood_centroids = profiles.mood_centroids()
+
+        # Log-weighted DJ x artist play counts for artist overlap scoring
+        self.artist_index = ArtistIndex(profiles.play_counts, profiles.artist_ids)
+
+        # Fit the standard scaler on DJ data only
+        if precomputed is not None:
+            self.scaler_mean = precomputed['scaler_mean']
+            self.scaler_scale = precomputed['scaler_scale']
+        else:
+            self.scaler_mean, self.scaler_scale = fit_standard_scaler(self.dj_matrix)
+        # A DJ with no values for a feature is placed at its mean, so it can't make every similarity NaN
+        self.dj_scaled_matrix = np.nan_to_num(self.scale(self.dj_matrix), nan=0.0, posinf=0.0, neginf=0.0)
+
+        # Row-normalized scaled DJ matrix, so cosine similarity with users is a single matrix product
+        self.dj_unit_matrix = normalize_rows(self.dj_scaled_matrix)
+
+        # Candidate search over the DJs (exact or approximate, see dj_index.build_dj_index)
+        self.dj_index = build_dj_index(self.dj_unit_matrix)
+
+    def scale(self, vectors):
+        """
+        Scales feature vectors with the scaler fitted on this snapshot's DJ data.
+
+        :param vectors: Array of shape (n, num_features)
+        :return: Scaled array of shape (n, num_features)
+        """
+
+        return (vectors - self.scaler_mean) / self.scaler_scale
+
+    def get_recent_songs(self, dj_id):
+        """
+        :param dj_id: DJ's unique identifier
+        :return: List of the DJ's 5 most recently played songs, formatted as "Song Name - Artist Name"
+        """
+
+        return self.profiles.get_recent_songs(dj_id)
+
+
+_model = None
+_model_lock = threading.Lock()
+_failed_stamp = None  # Data file version that failed to load, so it is not retried on every request
+
+
+def fit_standard_scaler(matrix):
+    """
+    Fits a standard scaler (as scikit-learn's StandardScaler does, without importing it): per-feature means and
+    population standard deviations, with a scale of 1 for constant features. Missing (non-finite) values are ignored,
+    as scikit-learn does.
+
+    :param matrix: Array of shape (n, num_features)
+    :return: (mean, scale), arrays of shape (num_features,)
+    """
+
+    matrix = np.where(np.isfinite(matrix), matrix, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Features with no values at all
+        mean = np.nanmean(matrix, axis=0)
+        scale = np.nanstd(matrix, axis=0)
+    mean = np.nan_to_num(mean, nan=0.0)
+    scale[~(scale >= 10 * np.finfo(scale.dtype).eps)] = 1.0
+    return mean, scale
+
+
+def get_data_path():
+    """
+    :return: Path to the KXSC tracks CSV the match model is built from
+    """
+
+    return os.getenv('MATCH_DATA_PATH', os.path.join(os.getcwd(), 'data', 'sliced_ab_data.csv'))
+
+
+def get_data_source():
+    """
+    :return: Path to the compiled match model artifact's manifest if there is an artifact built from the current tracks
+        CSV, else to the tracks CSV
+    """
+
+    manifest_path = os.path.join(get_artifact_path(), MANIFEST_FILE)
+    if os.path.exists(manifest_path) and not is_artifact_stale(manifest_path, get_data_path()):
+        return manifest_path
+    return get_data_path()
+
+
+def get_spin_log_path():
+    """
+    :return: Path to the log of spins ingested on top of the tracks CSV
+    """
+
+    return os.getenv('MATCH_SPIN_LOG_PATH', os.path.join(os.getcwd(), 'data', 'ingested_spins.csv'))
+
+
+def get_data_stamp(path):
+    """
+    Identifies the current version of the data file. The model is rebuilt whenever this changes.
+
+    :param path: Path to the data file (the tracks CSV or the artifact's manifest)
+    :return: Tuple of (modification time in ns, size in bytes, MATCH_DATA_VERSION)
+    """
+
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, os.getenv('MATCH_DATA_VERSION')
+
+
+def get_spin_log_size():
+    """
+    :return: Size of the spin log in bytes, 0 if there is none
+    """
+
+    try:
+        return os.path.getsize(get_spin_log_path())
+    except OSError:
+        return 0
+
+
+def add_spin_log(profiles, spin_log_end=None):
+    """
+    Adds the spins in the spin log to freshly loaded profiles.
+
+    :param profiles: ProfileAccumulator built from the tracks CSV or artifact
+    :param spin_log_end: Byte offset to stop reading the spin log at (None reads all of it)
+    :return: How far the spin log was read
+    """
+
+    if not get_spin_log_size():
+        return 0
+
+    spins_df, spin_log_offset = read_spins(get_spin_log_path(), end=spin_log_end)
+    profiles.add_spins(spins_df)
+    return spin_log_offset
+
+
+def load_profiles(source=None, spin_log_end=None):
+    """
+    Fully recomputes the DJ profiles from every track in the tracks CSV or artifact, and the spin log.
+
+    :param source: Path to the tracks CSV or artifact manifest (defaults to get_data_source())
+    :param spin_log_end: Byte offset to stop reading the spin log at (None reads all of it)
+    :return: (profiles, spin_log_offset) where spin_log_offset is how far the spin log was read
+    """
+
+    source = source or get_data_source()
+    if os.path.basename(source) == MANIFEST_FILE:
+        profiles = recompute_artifact_profiles(load_artifact(os.path.dirname(source)))
+    else:
+        profiles = ProfileAccumulator.from_tracks(load_tracks(source))
+
+    return profiles, add_spin_log(profiles, spin_log_end)
+
+
+def load_model(source=None):
+    """
+    Builds a new MatchModel snapshot from the artifact (memory-mapped, nothing recomputed) or the tracks CSV, plus the
+    spin log.
+
+    :param source: Path to the tracks CSV or artifact manifest (defaults to get_data_source())
+    :return: MatchModel
+    :raises ArtifactVersionError: If the artifact was built for a different version of this code
+    :raises ArtifactIntegrityError: If the artifact's files don't match its manifest
+    """
+
+    source = source or get_data_source()
+    stamp = get_data_stamp(source)
+
+    if os.path.basename(source) != MANIFEST_FILE:
+        profiles, spin_log_offset = load_profiles(source)
+        return MatchModel(profiles, stamp, spin_log_offset)
+
+    artifact = load_artifact(os.path.dirname(source))
+    profiles = load_artifact_profiles(artifact)
+    precomputed = {name: artifact['arrays'][name] for name in ['dj_matrix', 'scaler_mean', 'scaler_scale']}
+    if get_spin_log_size():
+        # Spins on top of the artifact change the profiles, so they can't use the precomputed arrays
+        profiles = profiles.copy()
+        precomputed = None
+    spin_log_offset = add_spin_log(profiles)
+
+    return MatchModel(profiles, stamp, spin_log_offset, precomputed, artifact['show_responses'])
+
+
+def apply_new_spins(model):
+    """
+    Builds a new snapshot from a model plus the spins appended to the spin log since it was built. Only the running
+    sums are updated; nothing is recomputed from the tracks CSV.
+
+    :param model: Current MatchModel
+    :return: New MatchModel, or the same one if there were no complete new spins
+    """
+
+    spins_df, spin_log_offset = read_spins(get_spin_log_path(), model.spin_log_offset)
+    if spins_df.empty:
+        return model
+
+    profiles = model.profiles.copy()
+    profiles.add_spins(spins_df)
+    return MatchModel(profiles, model.stamp, spin_log_offset, show_responses=model.show_responses)
+
+
+def get_model():
+    """
+    Returns the process-wide MatchModel, building it on first use, rebuilding it when the data file changes, and
+    applying new spins when the spin log grows. Only one caller updates the model at a time; everyone else keeps using
+    the current snapshot until the new one is swapped in.
+
+    :return: MatchModel
+    """
+
+    global _model, _failed_stamp
+
+    model = _model
+    path = get_data_source()
+    try:
+        stamp = get_data_stamp(path)
+    except OSError as e:
+        if model is None:
+            raise
+        print(f'Could not stat {path}, keeping the current match model: {e}')
+        return model
+
+    # No model yet, so every caller has to wait for the first build
+    if model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model(path)
+            return _model
+
+    spin_log_size = get_spin_log_size()
+    if stamp in (model.stamp, _failed_stamp) and spin_log_size == model.spin_log_offset:
+        return model
+
+    # This request updates the model while concurrent requests keep using the old snapshot
+    if not _model_lock.acquire(blocking=False):
+        return model
+    try:
+        try:
+            # A spin log smaller than what was applied has been rotated, which also needs a full rebuild
+            if stamp not in (_model.stamp, _failed_stamp) or spin_log_size < _model.spin_log_offset:
+                _model = load_model(path)
+                print(f'Reloaded match model from {path}')
+            elif spin_log_size > _model.spin_log_offset:
+                _model = apply_new_spins(_model)
+        except Exception as e:
+            # E.g. the file is malformed; wait for it to change again before retrying
+            _failed_stamp = stamp
+            print(f'Failed to update match model, keeping the current one: {e}')
+        return _model
+    finally:
+        _model_lock.release()
+
+
+def check_drift(tolerance=1e-9):
+    """
+    Fully recomputes the DJ profiles from the same data the served model has seen and compares them with its
+    incrementally updated ones. If they have drifted apart, the full recompute is swapped in.
+
+    :param tolerance: Max absolute difference allowed between the two
+    :return: Dict with the max absolute differences (see ProfileAccumulator.drift)
+    """
+
+    global _model
+
+    # Recompute without holding the lock, so requests keep updating and using the model meanwhile
+    model = _model
+    profiles, spin_log_offset = load_profiles(spin_log_end=model.spin_log_offset)
+    drift = model.profiles.drift(profiles)
+
+    if max(drift.values()) > tolerance:
+        with _model_lock:
+            # Unless the model was updated in the meantime, in which case the next check compares the new one
+            if _model is model:
+                print(f'Match model drifted from a full recompute ({drift}), swapping in the full recompute')
+                _model = MatchModel(profiles, model.stamp, spin_log_offset, show_responses=model.show_responses)
+
+    return drift
+
+
+def start_drift_checker():
+    """
+    Starts a background thread that runs check_drift() every MATCH_DRIFT_CHECK_SECONDS (default 3600, 0 disables it).
+    Call it in the process that serves requests (see match_app.start_background_tasks()), not in a gunicorn master that
+    preloads the app.
+    """
+
+    interval = float(os.getenv('MATCH_DRIFT_CHECK_SECONDS', 3600))
+    if interval <= 0:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                check_drift()
+            except Exception as e:
+                print(f'Match model drift check failed: {e}')
+
+    threading.Thread(target=run, name='match-model-drift-check', daemon=True).start()
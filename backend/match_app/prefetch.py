@@ -0,0 +1,302 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from api_helpers.service_limits import background_calls
+from dotenv import load_dotenv
+from .artist_cache import cache_artist, get_cached_artist, get_shared_cache
+from .database_connection import get_db
+
+load_dotenv()
+
+# Prefetches the features of the most popular artists (the first ones of the artist_names_and_mbids collection, which
+# is in approximate popularity order), so the artists users are most likely to pick are warm: their Spotify mapping,
+# their top tracks' MusicBrainz recording IDs (in the artist feature cache), and their tracks' AcousticBrainz data (in
+# searched_ab_tracks). The external calls go through the same shared rate limits as live traffic, at a lower priority. The workers split a
+# pass through a shared cursor only when the artist feature cache has a shared tier (ARTIST_CACHE_BACKEND); otherwise
+# each worker's in-process cache only holds what that worker prefetched, so each walks the whole list on its own.
+
+PREFETCH_STATE_ID = 'popular_artists'
+
+_active_requests = 0
+_last_request_at = 0.0
+_activity_lock = threading.Lock()
+
+# This process's own cursor, used when there is no shared cache tier (see claim_local_ranks())
+_local_cursor = {'next_rank': 0, 'pass_started_at': None}
+_local_cursor_lock = threading.Lock()
+
+_picks_indexed = False
+_picks_index_lock = threading.Lock()
+
+
+def prefetch_enabled():
+    """
+    :return: Whether PREFETCH_ENABLED enables the popular artist prefetch (off by default)
+    """
+
+    return os.getenv('PREFETCH_ENABLED', '0') == '1'
+
+
+def request_started():
+    global _active_requests
+    with _activity_lock:
+        _active_requests += 1
+
+
+def request_finished():
+    global _active_requests, _last_request_at
+    with _activity_lock:
+        _active_requests -= 1
+        _last_request_at = time.monotonic()
+
+
+def is_idle(idle_seconds):
+    """
+    :param idle_seconds: Seconds without requests for the worker to count as idle
+    :return: Whether the worker has no requests in flight and has had none for idle_seconds
+    """
+
+    with _activity_lock:
+        return _active_requests == 0 and time.monotonic() - _last_request_at >= idle_seconds
+
+
+def claim_ranks(top_n, batch_size, pass_interval=0):
+    """
+    Claims the next batch_size popularity ranks to prefetch from the cursor shared by all workers (and runs), so a pass
+    resumes where the last one stopped. Once a pass is done, the next one starts pass_interval seconds after it started.
+
+    :param top_n: Number of popular artists a pass covers
+    :param batch_size: Number of ranks to claim
+    :param pass_interval: Min seconds between the starts of passes
+    :return: range of the claimed ranks, empty if the pass is done and the next one isn't due
+    """
+
+    from pymongo import ReturnDocument
+    from pymongo.errors import DuplicateKeyError
+
+    now = datetime.now(timezone.utc)
+    collection = get_db()['artists']['prefetch_state']
+    state = collection.find_one({'_id': PREFETCH_STATE_ID})
+    if state is None:
+        try:
+            collection.insert_one({'_id': PREFETCH_STATE_ID, 'next_rank': 0, 'pass_started_at': now})
+        except DuplicateKeyError:
+            pass  # Another worker started the first pass
+    elif state['next_rank'] >= top_n:
+        pass_started_at = state['pass_started_at'].replace(tzinfo=timezone.utc)
+        if (now - pass_started_at).total_seconds() >= pass_interval:
+            # Start the next pass, unless another worker just did
+            collection.update_one({'_id': PREFETCH_STATE_ID, 'next_rank': state['next_rank']},
+                                  {'$set': {'next_rank': 0, 'pass_started_at': now}})
+
+    state = collection.find_one_and_update(
+        {'_id': PREFETCH_STATE_ID, 'next_rank': {'$lt': top_n}}, {'$inc': {'next_rank': batch_size}},
+        return_document=ReturnDocument.BEFORE)
+    if state is None:
+        return range(0)
+    return range(state['next_rank'], min(state['next_rank'] + batch_size, top_n))
+
+
+def claim_local_ranks(top_n, batch_size, pass_interval=0):
+    """
+    Claims the next batch_size popularity ranks to prefetch from this process's own cursor, with the same passes as
+    claim_ranks().
+
+    :param top_n: Number of popular artists a pass covers
+    :param batch_size: Number of ranks to claim
+    :param pass_interval: Min seconds between the starts of passes
+    :return: range of the claimed ranks, empty if the pass is done and the next one isn't due
+    """
+
+    now = time.monotonic()
+    with _local_cursor_lock:
+        if _local_cursor['pass_started_at'] is None:
+            _local_cursor['pass_started_at'] = now
+        elif _local_cursor['next_rank'] >= top_n and now - _local_cursor['pass_started_at'] >= pass_interval:
+            _local_cursor['next_rank'] = 0
+            _local_cursor['pass_started_at'] = now
+
+        start = _local_cursor['next_rank']
+        if start >= top_n:
+            return range(0)
+        _local_cursor['next_rank'] = start + batch_size
+        return range(start, min(start + batch_size, top_n))
+
+
+def reset_cursor():
+    """
+    Restarts the prefetch at the most popular artist.
+    """
+
+    get_db()['artists']['prefetch_state'].update_one(
+        {'_id': PREFETCH_STATE_ID}, {'$set': {'next_rank': 0, 'pass_started_at': datetime.now(timezone.utc)}},
+        upsert=True)
+
+
+def get_popular_artists(start, count):
+    """
+    :param start: Popularity rank of the first artist
+    :param count: Number of artists
+    :return: List of dicts (name, mbid) of the artists, most popular first
+    """
+
+    # _id acts as a proxy for popularity because documents are in descending popularity (approximately) order
+    return list(get_db()['artists']['artist_names_and_mbids'].find({}, {'_id': 0, 'name': 1, 'mbid': 1})
+                .sort([('_id', 1)]).skip(start).limit(count))
+
+
+def prefetch_artist(artist):
+    """
+    Enriches an artist and caches it, unless it is already cached. The enrichment's external calls are background calls,
+    which yield to the calls serving requests (see api_helpers.service_limits.background_calls()).
+
+    :param artist: Dict (name, mbid)
+    :return: Whether the artist was enriched (False if it was already warm or a source was skipped)
+    """
+
+    from .user import EnrichmentStatus, enrich_artist
+
+    if get_cached_artist(artist['mbid']) is not None:
+        return False
+
+    status = EnrichmentStatus()
+    with background_calls():
+        entry = enrich_artist(artist['name'], artist['mbid'], status)
+    if status.skipped:
+        print(f"Prefetch of artist '{artist['name']}' skipped {', '.join(sorted(status.skipped))}")
+        return False
+    cache_artist(artist['mbid'], entry)
+    return True
+
+
+def prefetch_pass(top_n, batch_size=10, pass_interval=0, should_pause=None, shared_cursor=None):
+    """
+    Prefetches the top_n most popular artists, resuming from the cursor.
+
+    :param top_n: Number of popular artists to cover
+    :param batch_size: Number of artists claimed at a time
+    :param pass_interval: Min seconds between the starts of passes (see claim_ranks())
+    :param should_pause: Optional function returning whether to wait before the next artist (e.g. while the worker
+        serves requests); it is polled every second
+    :param shared_cursor: Whether to claim ranks from the cursor shared by all workers (claim_ranks()) instead of this
+        process's own (claim_local_ranks()), defaults to whether there is a shared cache tier
+    :return: Number of artists enriched
+    """
+
+    if shared_cursor is None:
+        shared_cursor = get_shared_cache() is not None
+    claim = claim_ranks if shared_cursor else claim_local_ranks
+
+    num_enriched = 0
+    while True:
+        ranks = claim(top_n, batch_size, pass_interval)
+        if not ranks:
+            return num_enriched
+
+        for artist in get_popular_artists(ranks.start, len(ranks)):
+            while should_pause is not None and should_pause():
+                time.sleep(1)
+            try:
+                num_enriched += prefetch_artist(artist)
+            except Exception as e:
+                print(f"Prefetch of artist '{artist.get('name')}' failed: {e}")
+
+
+def ensure_picks_index():
+    """
+    Creates the TTL index that removes artist picks after PREFETCH_PICKS_RETENTION_DAYS (default 30), once per process.
+    """
+
+    global _picks_indexed
+    with _picks_index_lock:
+        if _picks_indexed:
+            return
+        retention_days = int(os.getenv('PREFETCH_PICKS_RETENTION_DAYS', 30))
+        get_db()['users']['artist_picks'].create_index('picked_at', expireAfterSeconds=retention_days * 86400)
+        _picks_indexed = True
+
+
+def record_artist_picks(artists):
+    """
+    Records the artists a user picked (MBIDs and names only), for the prefetch coverage report. Only called while the
+    prefetch is enabled (see prefetch_enabled()), whose startup (start_prefetcher()) creates the index that removes picks after
+    PREFETCH_PICKS_RETENTION_DAYS (see ensure_picks_index()).
+
+    :param artists: List of dicts containing artist info (mbid, name)
+    """
+
+    picked_at = datetime.now(timezone.utc)
+    collection = get_db()['users']['artist_picks']
+    collection.insert_many([{'mbid': artist['mbid'], 'name': artist.get('name'), 'picked_at': picked_at}
+                            for artist in artists])
+
+
+def get_prefetch_coverage(top_n, days=7):
+    """
+    :param top_n: Number of popular artists the prefetch covers
+    :param days: Number of days of recent user picks to check
+    :return: Dict of the share of the 'top_n' popular artists that are warm ('top_n_warm'), and of the artist picks of
+        the last days that were of warm artists ('recent_picks_warm', None without picks) out of 'recent_picks'.
+        Without a shared cache tier, it only reflects this process's in-process cache
+    """
+
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    picks = [pick['mbid'] for pick in get_db()['users']['artist_picks'].find({'picked_at': {'$gte': since}},
+                                                                             {'_id': 0, 'mbid': 1})]
+
+    top_artists = get_popular_artists(0, top_n)
+    warm = {mbid: get_cached_artist(mbid) is not None
+            for mbid in dict.fromkeys([artist['mbid'] for artist in top_artists] + picks)}
+
+    return {
+        'top_n': len(top_artists),
+        'top_n_warm': sum(warm[artist['mbid']] for artist in top_artists) / len(top_artists) if top_artists else None,
+        'recent_picks': len(picks),
+        'recent_picks_warm': sum(warm[mbid] for mbid in picks) / len(picks) if picks else None,
+    }
+
+
+def start_prefetcher():
+    """
+    Starts a background thread that prefetches the PREFETCH_TOP_N (default 1000) most popular artists while the worker
+    is idle (no requests for PREFETCH_IDLE_SECONDS, default 30), starting a pass every PREFETCH_PASS_INTERVAL seconds
+    (default 86400). Enabled with PREFETCH_ENABLED=1. Like the drift checker, every worker starts its own (see
+    match_app.start_background_tasks()). They share the cursor if the artist feature cache has a shared tier; without
+    one, each worker prefetches every artist into its own in-process cache.
+    """
+
+    if not prefetch_enabled():
+        return
+
+    if get_shared_cache() is None:
+        print('WARNING: Prefetching popular artists without a shared artist cache tier (ARTIST_CACHE_BACKEND=none), '
+              'so each worker warms only its own in-process cache and walks the whole list itself. Set '
+              'ARTIST_CACHE_BACKEND to mongo or redis for the workers to share the prefetched artists.')
+
+    top_n = int(os.getenv('PREFETCH_TOP_N', 1000))
+    idle_seconds = float(os.getenv('PREFETCH_IDLE_SECONDS', 30))
+    pass_interval = float(os.getenv('PREFETCH_PASS_INTERVAL', 86400))
+
+    def run():
+        # Expires the picks recorded while the prefetch is enabled (see record_artist_picks()), including any recorded
+        # before the index exists
+        try:
+            ensure_picks_index()
+        except Exception as e:
+            print(f'Could not create the artist picks index: {e}')
+
+        while True:
+            while not is_idle(idle_seconds):
+                time.sleep(idle_seconds)
+            try:
+                num_enriched = prefetch_pass(top_n, pass_interval=pass_interval,
+                                             should_pause=lambda: not is_idle(idle_seconds))
+                if num_enriched:
+                    print(f'Prefetched {num_enriched} popular artists; coverage: {get_prefetch_coverage(top_n)}')
+            except Exception as e:
+                print(f'Popular artist prefetch failed: {e}')
+            # Check back for the next pass
+            time.sleep(min(pass_interval, 3600))
+
+    threading.Thread(target=run, name='popular-artist-prefetch', daemon=True).start()
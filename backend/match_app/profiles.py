@@ -0,0 +1,273 @@
+from io import BytesIO
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .features import FEATURE_COLS, MOOD_COLS, average_feature_sums, calculate_feature_matrix, \
+    calculate_group_feature_sums, calculate_mood_feature_sums
+
+
+# Number of recently played songs kept per DJ
+NUM_RECENT_SONGS = 5
+
+
+class ProfileAccumulator:
+    """
+    Running per-DJ feature sums and counts, per-mood feature sums and counts, and DJ x artist play counts: everything the
+    match model is derived from. New spins are added in place, so DJ profiles can be updated without recomputing them
+    from every track.
+    """
+
+    def __init__(self):
+        self.dj_ids = []
+        self.dj_names = []
+        self.dj_rows = {}  # DJ ID -> row
+        self.artist_ids = []
+        self.artist_columns = {}  # Artist MBID -> column
+
+        num_features = len(FEATURE_COLS)
+        self.feature_sums = np.zeros((0, num_features))  # shape: (num_djs, num_features)
+        self.feature_counts = np.zeros((0, num_features))
+        self.mood_sums = np.zeros((len(MOOD_COLS), num_features))  # shape: (num_moods, num_features)
+        self.mood_counts = np.zeros((len(MOOD_COLS), num_features))
+        self.play_counts = sparse.csr_matrix((0, 0))  # shape: (num_djs, num_artists)
+        self.recent_songs = {}  # DJ ID -> list of up to NUM_RECENT_SONGS [play time (ns), "Song - Artist"], newest first
+        self.num_spins = 0
+
+    @classmethod
+    def from_tracks(cls, tracks_df):
+        """
+        :param tracks_df: DataFrame containing KXSC track history
+        :return: ProfileAccumulator of every track in tracks_df
+        """
+
+        accumulator = cls()
+        accumulator.add_spins(tracks_df)
+        return accumulator
+
+    def copy(self):
+        """
+        :return: Independent copy, so a served model's accumulator is never modified
+        """
+
+        other = ProfileAccumulator()
+        other.dj_ids = list(self.dj_ids)
+        other.dj_names = list(self.dj_names)
+        other.dj_rows = dict(self.dj_rows)
+        other.artist_ids = list(self.artist_ids)
+        other.artist_columns = dict(self.artist_columns)
+        other.feature_sums = self.feature_sums.copy()
+        other.feature_counts = self.feature_counts.copy()
+        other.mood_sums = self.mood_sums.copy()
+        other.mood_counts = self.mood_counts.copy()
+        other.play_counts = self.play_counts.copy()
+        other.recent_songs = {dj_id: list(songs) for dj_id, songs in self.recent_songs.items()}
+        other.num_spins = self.num_spins
+        return other
+
+    @classmethod
+    def from_arrays(cls, arrays, recent_songs, num_spins):
+        """
+        Restores an accumulator saved with to_arrays() (e.g. memory-mapped from a match model artifact) without
+        recomputing anything. The arrays are used as-is, so copy() before adding spins to read-only arrays.
+
+        :param arrays: Dict of arrays from to_arrays()
+        :param recent_songs: Dict from to_arrays()
+        :param num_spins: Number of spins the arrays were accumulated from
+        :return: ProfileAccumulator
+        """
+
+        accumulator = cls()
+        accumulator.dj_ids = arrays['dj_ids'].tolist()
+        accumulator.dj_names = arrays['dj_names'].tolist()
+        accumulator.dj_rows = {dj_id: row for row, dj_id in enumerate(accumulator.dj_ids)}
+        accumulator.artist_ids = arrays['artist_ids'].tolist()
+        accumulator.artist_columns = {artist_id: col for col, artist_id in enumerate(accumulator.artist_ids)}
+        accumulator.feature_sums = arrays['feature_sums']
+        accumulator.feature_counts = arrays['feature_counts']
+        accumulator.mood_sums = arrays['mood_sums']
+        accumulator.mood_counts = arrays['mood_counts']
+        accumulator.play_counts = sparse.csr_matrix(
+            (arrays['play_counts_data'], arrays['play_counts_indices'], arrays['play_counts_indptr']),
+            shape=(len(accumulator.dj_ids), len(accumulator.artist_ids)))
+        accumulator.recent_songs = {int(dj_id): songs for dj_id, songs in recent_songs.items()}
+        accumulator.num_spins = num_spins
+        return accumulator
+
+    def to_arrays(self):
+        """
+        :return: (arrays, recent_songs) where arrays is a dict of typed NumPy arrays and recent_songs a JSON-serializable
+            dict, which from_arrays() restores the accumulator from
+        """
+
+        play_counts = self.play_counts.tocsr()
+        arrays = {
+            'dj_ids': np.asarray(self.dj_ids, dtype=np.int64),
+            'dj_names': np.asarray([str(name) for name in self.dj_names], dtype=str),
+            'artist_ids': np.asarray([str(artist_id) for artist_id in self.artist_ids], dtype=str),
+            'feature_sums': self.feature_sums,
+            'feature_counts': self.feature_counts,
+            'mood_sums': self.mood_sums,
+            'mood_counts': self.mood_counts,
+            'play_counts_data': play_counts.data,
+            'play_counts_indices': play_counts.indices,
+            'play_counts_indptr': play_counts.indptr,
+        }
+        recent_songs = {str(dj_id): songs for dj_id, songs in self.recent_songs.items()}
+        return arrays, recent_songs
+
+    def add_spins(self, spins_df):
+        """
+        Adds spins (played tracks, in the same format as the tracks CSV) to the running sums and counts.
+
+        :param spins_df: DataFrame with 'DJ ID', 'DJ Name', 'artist_id', and AcousticBrainz feature columns
+        """
+
+        if spins_df.empty:
+            return
+
+        # Register new DJs, in order of first appearance
+        for dj_id, dj_name in spins_df.drop_duplicates('DJ ID')[['DJ ID', 'DJ Name']].itertuples(index=False):
+            if dj_id not in self.dj_rows:
+                self.dj_rows[dj_id] = len(self.dj_ids)
+                self.dj_ids.append(dj_id)
+                self.dj_names.append(dj_name)
+
+        num_djs = len(self.dj_ids)
+        if num_djs > len(self.feature_sums):
+            padding = np.zeros((num_djs - len(self.feature_sums), len(FEATURE_COLS)))
+            self.feature_sums = np.vstack([self.feature_sums, padding])
+            self.feature_counts = np.vstack([self.feature_counts, padding])
+
+        # Feature sums, one grouped reduction per batch of spins
+        features = calculate_feature_matrix(spins_df)
+        dj_ids, sums, counts = calculate_group_feature_sums(features, spins_df['DJ ID'].to_numpy())
+        rows = [self.dj_rows[dj_id] for dj_id in dj_ids]
+        self.feature_sums[rows] += sums
+        self.feature_counts[rows] += counts
+
+        mood_sums, mood_counts = calculate_mood_feature_sums(spins_df, features)
+        self.mood_sums += mood_sums
+        self.mood_counts += mood_counts
+
+        # Artist play counts
+        played = spins_df[spins_df['artist_id'].notna()]
+        for artist_id in played['artist_id'].unique():
+            if artist_id not in self.artist_columns:
+                self.artist_columns[artist_id] = len(self.artist_ids)
+                self.artist_ids.append(artist_id)
+
+        shape = (num_djs, len(self.artist_ids))
+        dj_rows = [self.dj_rows[dj_id] for dj_id in played['DJ ID']]
+        artist_cols = [self.artist_columns[artist_id] for artist_id in played['artist_id']]
+        # Duplicate (DJ, artist) entries are summed, giving the play counts
+        new_counts = sparse.csr_matrix((np.ones(len(played)), (dj_rows, artist_cols)), shape=shape)
+        self.play_counts.resize(shape)
+        self.play_counts = (self.play_counts + new_counts).tocsr()
+
+        self.add_recent_songs(spins_df)
+
+        self.num_spins += len(spins_df)
+
+    def add_recent_songs(self, spins_df):
+        """
+        Keeps each DJ's NUM_RECENT_SONGS most recently played songs, in "Song Name - Artist Name" format. Spins without
+        a valid date, time, song, and artist are skipped.
+
+        :param spins_df: DataFrame with 'DJ ID', 'Date', 'Time', 'Song', and 'Artist' columns
+        """
+
+        if not {'Date', 'Time', 'Song', 'Artist'}.issubset(spins_df.columns):
+            return
+
+        # astype(object) so categorical Date and Time columns (see tracks.load_compact_tracks) parse the same way
+        played_at = (pd.to_datetime(spins_df['Date'].astype(object), format='mixed', errors='coerce') +
+                     pd.to_timedelta(pd.to_datetime(spins_df['Time'].astype(object), format='%I:%M:%S %p',
+                                                    errors='coerce')
+                                     .dt.strftime('%H:%M:%S'), errors='coerce'))
+        songs = pd.DataFrame({
+            'dj_id': spins_df['DJ ID'].to_numpy(),
+            'played_at': played_at.to_numpy(),
+            'song': spins_df['Song'].to_numpy(),
+            'artist': spins_df['Artist'].to_numpy(),
+        }).dropna()
+        songs = songs.sort_values('played_at', ascending=False, kind='stable').groupby('dj_id', sort=False).head(
+            NUM_RECENT_SONGS)
+
+        for dj_id, group in songs.groupby('dj_id', sort=False):
+            new_songs = [[int(played_at.value), f'{str(song).strip()} - {str(artist).strip()}']
+                         for played_at, song, artist in group[['played_at', 'song', 'artist']].itertuples(index=False)]
+            merged = sorted(self.recent_songs.get(int(dj_id), []) + new_songs, key=lambda song: song[0], reverse=True)
+            self.recent_songs[int(dj_id)] = merged[:NUM_RECENT_SONGS]
+
+    def get_recent_songs(self, dj_id):
+        """
+        :param dj_id: DJ's unique identifier
+        :return: List of the DJ's most recently played songs, formatted as "Song Name - Artist Name"
+        """
+
+        return [song for _, song in self.recent_songs.get(int(dj_id), [])]
+
+    def dj_avg_features(self):
+        """
+        :return: Array of shape (num_djs, num_features) of every DJ's average features vector
+        """
+
+        return average_feature_sums(self.feature_sums, self.feature_counts)
+
+    def mood_centroids(self):
+        """
+        :return: Dict mapping each mood in MOOD_COLS to the average features vector of all tracks with that mood
+        """
+
+        centroids = average_feature_sums(self.mood_sums, self.mood_counts)
+        return {mood: centroid for mood, centroid in zip(MOOD_COLS, centroids)}
+
+    def drift(self, other):
+        """
+        Measures how far this accumulator's profiles are from another's, e.g. incrementally updated vs fully recomputed.
+
+        :param other: ProfileAccumulator to compare with
+        :return: Dict with the max absolute difference of DJ averages, mood centroids, and play counts (inf if the DJs or
+            artists differ)
+        """
+
+        if self.dj_ids != other.dj_ids or set(self.artist_ids) != set(other.artist_ids):
+            return {'dj_features': np.inf, 'mood_centroids': np.inf, 'play_counts': np.inf}
+
+        # Artist columns may be in a different order
+        order = [other.artist_columns[artist_id] for artist_id in self.artist_ids]
+        play_count_diff = abs(self.play_counts - other.play_counts[:, order])
+
+        mood_centroids = average_feature_sums(self.mood_sums, self.mood_counts)
+        other_mood_centroids = average_feature_sums(other.mood_sums, other.mood_counts)
+
+        return {
+            'dj_features': float(np.nanmax(np.abs(self.dj_avg_features() - other.dj_avg_features()), initial=0)),
+            'mood_centroids': float(np.nanmax(np.abs(mood_centroids - other_mood_centroids), initial=0)),
+            'play_counts': float(play_count_diff.max()) if play_count_diff.nnz else 0.0,
+        }
+
+
+def read_spins(path, offset=0, end=None):
+    """
+    Reads spins appended to a CSV spin log since a byte offset. Only complete lines are read, so a write in progress is
+    picked up on the next read.
+
+    :param path: Path to the spin log (CSV with a header line)
+    :param offset: Byte offset to read from (0 reads the whole file)
+    :param end: Byte offset to stop reading at (None reads to the end of the file)
+    :return: (spins_df, new_offset)
+    """
+
+    with open(path, 'rb') as spin_log:
+        header = spin_log.readline()
+        start = max(offset, len(header))
+        spin_log.seek(start)
+        data = spin_log.read() if end is None else spin_log.read(max(end - start, 0))
+
+    complete = data[:data.rfind(b'\n') + 1]
+    new_offset = start + len(complete)
+    if not complete:
+        return pd.DataFrame(), new_offset
+
+    return pd.read_csv(BytesIO(header + complete)), new_offset
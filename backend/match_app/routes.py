@@ -1,14 +1,30 @@
-from flask import request, session, jsonify
+from flask import Response, request, session, jsonify, stream_with_context
 from . import app
-from .match import get_matches, spider_plot
-from .show_responses import get_dj_show_info
-from .database_connection import get_db
+from .match import get_matches_batch, get_results, get_spider_layout, get_spider_plot_mode, stream_results
+from .features import MOOD_COLS
+from .ingest import ingest_spins
+from .jobs import JobsUnavailable, get_job_queue
+from .prefetch import prefetch_enabled, record_artist_picks, request_finished, request_started
+from .database_connection import get_db, get_pool_stats
 from dotenv import load_dotenv
+import json
+import os
 import re
 
 load_dotenv()
 
 
+# Track the requests in flight, so background work (see prefetch.py) only runs while the worker is idle
+@app.before_request
+def track_request_start():
+    request_started()
+
+
+@app.teardown_request
+def track_request_end(exception=None):
+    request_finished()
+
+
 @app.route('/api/mood', methods=['POST'])
 def receive_mood():
     """
@@ -46,42 +62,207 @@ def receive_artists():
         return jsonify({'error': 'No artists'}), 400
 
     session['artists_data'] = artists_data  # Store the user's artists in session
+
+    # Record the picks for the prefetch coverage report (only while the prefetch is enabled), without holding up the
+    # response
+    if prefetch_enabled():
+        def record():
+            try:
+                record_artist_picks(artists_data)
+            except Exception as e:
+                print(f'Could not record artist picks: {e}')
+
+        from gevent import spawn
+
+        spawn(record)
     return jsonify({'message': 'Artists received successfully'}), 200
 
 
 @app.route('/api/results', methods=['GET', 'POST'])
 def results():
     """
-    Fetches DJ recommendations based on user's mood and artists.
+    Fetches DJ recommendations based on user's mood and artists. Artist enrichment gets RESULTS_LATENCY_BUDGET seconds
+    (20 by default, well within the frontend's timeout); past that, the match uses whatever tracks were found.
 
-    :return: JSON with DJ matches, percentages, spider plot, and show info, status code
+    :return: JSON with DJ matches, percentages, spider plot, show info, and the sources skipped, status code
     """
 
     user_mood = session.get('mood', 'happy')
     user_artists = session.get('artists_data', None)
-    top_djs, dj_features, user_features = get_matches(user_mood, user_artists)  # Fetch match data from match.py
-
-    # Parse the match data
-    match_name = top_djs[0]['dj_name']
-    match_id = top_djs[0]['dj_id']
-    top_dj_names = [dj['dj_name'] for dj in top_djs]
-    top_dj_percentages = [dj['match_percent'] for dj in top_djs]
-    fig = spider_plot(user_features, dj_features, match_name)
-
-    results = ({
-        'dj_match': match_name,
-        'top_djs': top_dj_names,
-        'match_percentages': top_dj_percentages,
-        'spider_fig': fig
-    })
+    latency_budget = float(os.getenv('RESULTS_LATENCY_BUDGET', 20))
+    spider_figure = request.args.get('spider') == 'figure' or get_spider_plot_mode() == 'figure'
 
-    # Append the DJ match's show responses data (e.g. About Me, timeslot, show name, etc.)
-    match_show_info = get_dj_show_info(match_id)
-    results.update(match_show_info)
+    # Fetch match data from match.py
+    results = get_results(user_mood, user_artists, timeout=latency_budget, spider_figure=spider_figure)
 
     return jsonify({'results': results}), 200
 
 
+@app.route('/api/results/stream', methods=['GET'])
+def results_stream():
+    """
+    Streams the DJ recommendations as server-sent events: a 'ranking' event from the mood alone right away, a 'ranking'
+    event as each of the user's artists is enriched, then a 'results' event with the full results (as from
+    /api/results), within the same RESULTS_LATENCY_BUDGET. The stream ends after the 'results' event, or after a
+    'failed' event if the match fails.
+
+    :return: text/event-stream response
+    """
+
+    user_mood = session.get('mood', 'happy')
+    user_artists = session.get('artists_data', None)
+    latency_budget = float(os.getenv('RESULTS_LATENCY_BUDGET', 20))
+    spider_figure = request.args.get('spider') == 'figure' or get_spider_plot_mode() == 'figure'
+
+    def generate():
+        try:
+            for event, data in stream_results(user_mood, user_artists, timeout=latency_budget,
+                                              spider_figure=spider_figure):
+                yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        except Exception as e:
+            print(f'Results stream failed: {e}')
+            yield f'event: failed\ndata: {json.dumps({"error": "The match failed"})}\n\n'
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the events
+    return response
+
+
+@app.route('/api/results/jobs', methods=['POST'])
+def create_results_job():
+    """
+    Starts a match job for the user's mood and artists (from the session, or the optional 'mood' and 'artists_data'
+    fields of a JSON payload) and returns right away. Identical inputs share one job while its results last.
+
+    :return: JSON with the job ID and status, status code (503 if match jobs aren't available, e.g. the in-process job
+        backend with several workers; use /api/results instead)
+    """
+
+    data = request.get_json(silent=True) or {}
+    user_mood = data.get('mood') or session.get('mood', 'happy')
+    user_artists = data.get('artists_data') or session.get('artists_data', None)
+
+    if str(user_mood).lower() not in MOOD_COLS:
+        return jsonify({'error': f'The mood must be one of: {", ".join(MOOD_COLS)}'}), 400
+    if not all(isinstance(artist, dict) and 'mbid' in artist and 'name' in artist for artist in user_artists or []):
+        return jsonify({'error': 'Every artist needs a name and an mbid'}), 400
+
+    try:
+        job_queue = get_job_queue()
+    except JobsUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+
+    job = job_queue.submit({
+        'mood': user_mood,
+        'artists': user_artists or [],
+        'spider_figure': request.args.get('spider') == 'figure' or get_spider_plot_mode() == 'figure',
+    })
+
+    return jsonify({'job_id': job['job_id'], 'status': job['status']}), 202
+
+
+@app.route('/api/results/jobs/<job_id>', methods=['GET'])
+def get_results_job(job_id):
+    """
+    Polls a match job.
+
+    :param job_id: ID returned when the job was created
+    :return: JSON with the job ID, its status ('queued', 'running', 'done', or 'failed'), and its results once done or
+        error once failed, status code
+    """
+
+    try:
+        job = get_job_queue().get(job_id)
+    except JobsUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    if job is None:
+        return jsonify({'error': 'No such job, or its results expired'}), 404
+
+    return jsonify(job), 200
+
+
+@app.route('/api/spider-layout', methods=['GET'])
+def spider_layout():
+    """
+    Fetches the static spider plot layout (axis labels, trace settings, and Plotly layout) that the frontend merges with
+    the 'spider_data' feature vectors from /api/results. It only changes with its version, so clients may cache it.
+
+    :return: JSON with the layout version, theta, trace, and layout, status code
+    """
+
+    response = jsonify(get_spider_layout())
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response, 200
+
+
+@app.route('/api/match/batch', methods=['POST'])
+def match_batch():
+    """
+    Fetches DJ recommendations for many user profiles at once.
+    Expects JSON payload with a 'profiles' list of {'mood': str, 'artists': [{'name': str, 'mbid': str}, ...]}, and
+    optionally 'top_n' (default 5) and 'enrich_artists' (default false). Enriching uncached artists is rate limited by
+    MusicBrainz, so it gets BATCH_LATENCY_BUDGET seconds (default 60, within the worker timeout); artists not enriched by
+    then only count towards artist overlap.
+
+    :return: JSON with a list of top DJ matches per profile (in the same order as the profiles) and the sources skipped,
+        status code
+    """
+
+    data = request.get_json(silent=True) or {}
+    profiles = data.get('profiles')
+    top_n = data.get('top_n', 5)
+    enrich_artists = data.get('enrich_artists', False)
+
+    if not isinstance(profiles, list) or not profiles:
+        return jsonify({'error': 'No profiles'}), 400
+    max_profiles = int(os.getenv('BATCH_MAX_PROFILES', 1000))
+    if len(profiles) > max_profiles:
+        return jsonify({'error': f'At most {max_profiles} profiles per request'}), 400
+    if not isinstance(top_n, int) or top_n < 1:
+        return jsonify({'error': 'top_n must be a positive integer'}), 400
+    for profile in profiles:
+        if not isinstance(profile, dict) or str(profile.get('mood', '')).lower() not in MOOD_COLS:
+            return jsonify({'error': f'Every profile needs a mood, one of: {", ".join(MOOD_COLS)}'}), 400
+        if not all(isinstance(artist, dict) and 'mbid' in artist and 'name' in artist
+                   for artist in profile.get('artists') or []):
+            return jsonify({'error': 'Every artist needs a name and an mbid'}), 400
+
+    skipped = set()
+    matches = get_matches_batch(profiles, top_n=top_n, enrich_artists=bool(enrich_artists),
+                                timeout=float(os.getenv('BATCH_LATENCY_BUDGET', 60)), skipped=skipped)
+
+    return jsonify({'results': [{'top_djs': top_djs} for top_djs in matches], 'skipped_sources': sorted(skipped)}), 200
+
+
+@app.route('/api/spins', methods=['POST'])
+def receive_spins():
+    """
+    Ingests newly played spins into the DJ profiles.
+    Expects an 'X-Ingest-Key' header matching INGEST_API_KEY, and a JSON payload with a 'spins' field holding one spin or
+    a list of spins (playlist rows with AcousticBrainz features, in the same format as the tracks CSV).
+
+    :return: JSON with the number of spins ingested or error, status code
+    """
+
+    ingest_key = os.getenv('INGEST_API_KEY')
+    if not ingest_key or request.headers.get('X-Ingest-Key') != ingest_key:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or {}
+    spins = data.get('spins')
+    if not spins:
+        return jsonify({'error': 'No spins'}), 400
+
+    try:
+        num_ingested = ingest_spins(spins)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'message': f'Ingested {num_ingested} spins'}), 200
+
+
 @app.route('/api/search/artists', methods=['GET'])
 def search_artists():
     """
@@ -95,9 +276,7 @@ def search_artists():
     if not query:
         return jsonify({'error': 'Query parameter is required.'}), 400
 
-    # Get fresh connection for each request
-    client = get_db()
-    artists_collection = client['artists']['artist_names_and_mbids']
+    artists_collection = get_db()['artists']['artist_names_and_mbids']
 
     regex_pattern = f"^{re.escape(query)}"
     try:
@@ -115,7 +294,20 @@ def search_artists():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-    finally:
-        client.close()
-
     return jsonify({'artists_data': artists_data}), 200
+
+
+@app.route('/api/db-pool', methods=['GET'])
+def db_pool():
+    """
+    Fetches this worker's MongoDB connection pool usage, e.g. to tune MONGO_MAX_POOL_SIZE.
+    Like /api/spins, expects an 'X-Ingest-Key' header matching INGEST_API_KEY.
+
+    :return: JSON of the pool stats (see database_connection.get_pool_stats()) or error, status code
+    """
+
+    ingest_key = os.getenv('INGEST_API_KEY')
+    if not ingest_key or request.headers.get('X-Ingest-Key') != ingest_key:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    return jsonify(get_pool_stats()), 200
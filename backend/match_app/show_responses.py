@@ -1,51 +1,171 @@
-import pandas as pd
 import os
+import threading
+import time
+import pandas as pd
 from .database_connection import get_db
+from .match_model import get_model
+
+
+# Show responses fields used for the show info, fetched with one query for the whole (small) collection
+SHOW_INFO_PROJECTION = {'_id': 0, 'dj_id': 1, 'show_name': 1, 'timeslot': 1, 'about_show': 1, 'subtext': 1,
+                        'genres': 1}
+
+_show_responses = None  # DJ ID -> show_responses document
+_loaded_at = 0.0
+_failed_at = float('-inf')  # When the last reload failed, to retry it sooner than a full refresh interval
+_loaded_pid = None
+_watching_pid = None
+_show_responses_lock = threading.Lock()
+_refresh_lock = threading.Lock()  # Held by the one caller reloading the collection
 
 
 def get_dj_show_info(dj_id):
     """
-    Collects DJ's show details from database.
+    Collects DJ's show details.
 
     :param dj_id: DJ's unique identifier
-    :return: Dict containing show name, timeslot, about me, subtext, and recent songs
+    :return: Dict containing show name, timeslot, about me, subtext, genres, and recent songs
     """
 
-    dj_id = int(dj_id)  # Cast dj_id from numpy.int64 to an int
+    return get_dj_show_infos([dj_id])[int(dj_id)]
 
-    # Read in the data from the show responses collection
-    # Get fresh connection
-    client = get_db()
-    db = client['djs']
-    collection = db['show_responses']
 
-    # All tracks played on KXSC
-    tracks_df = pd.read_csv(os.path.join(os.getcwd(), 'data', 'sliced_ab_data.csv'))
+def get_dj_show_infos(dj_ids):
+    """
+    Collects several DJs' show details at once, e.g. for the top matches.
+
+    :param dj_ids: List of DJs' unique identifiers
+    :return: Dict mapping each DJ ID (as an int) to its show details (see get_dj_show_info())
+    """
 
-    show_info = {
-        'show_name': get_show_name(dj_id, collection),
-        'timeslot': get_timeslot(dj_id, collection),
-        'about_me': get_about_me(dj_id, collection),
-        'subtext': get_subtext(dj_id, collection),
-        'genres': get_genres(dj_id, collection),
-        'recent_songs': get_recent_songs(dj_id, tracks_df)
-    }
+    # Station data, including recent songs and show responses if they were compiled into the match model artifact,
+    # which are only served while the show_responses collection is unreachable
+    model = get_model()
+    responses = get_show_responses(fallback=model.show_responses)
 
-    client.close()
-    return show_info
+    show_infos = {}
+    for dj_id in dj_ids:
+        dj_id = int(dj_id)  # Cast dj_id from numpy.int64 to an int
+        response = responses.get(dj_id)
+        show_infos[dj_id] = {
+            'show_name': get_show_name(response),
+            'timeslot': get_timeslot(response),
+            'about_me': get_about_me(response),
+            'subtext': get_subtext(response),
+            'genres': get_genres(response),
+            'recent_songs': get_recent_songs(dj_id, model)
+        }
 
+    return show_infos
 
-def get_show_name(dj_id, responses):
+
+def get_show_responses(fallback=None):
+    """
+    Returns the djs.show_responses collection, cached in the process. The cache is reloaded (with a single projected
+    query) when it is older than SHOW_RESPONSES_REFRESH seconds (default 300), or, after a failed reload, every
+    min(SHOW_RESPONSES_REFRESH, 10) seconds until a reload succeeds. With SHOW_RESPONSES_WATCH=1, a change stream
+    (which needs a replica set) reloads it as soon as the collection changes instead.
+
+    :param fallback: Optional dict mapping DJ IDs to show_responses documents (e.g. bundled in the match model
+        artifact) to serve if the collection was never reachable
+    :return: Dict mapping DJ IDs to their show_responses documents (the fallback, or empty, if the collection was never
+        reachable)
     """
-    Fetches DJ's show name from responses collection.
 
-    :param dj_id: DJ's unique identifier
-    :param responses: MongoDB collection containing show info
+    global _show_responses, _loaded_at, _failed_at, _loaded_pid
+
+    refresh_interval = float(os.getenv('SHOW_RESPONSES_REFRESH', 300))
+    retry_interval = min(refresh_interval, 10)
+
+    def is_fresh():
+        now = time.monotonic()
+        return now - _loaded_at < refresh_interval or now - _failed_at < retry_interval
+
+    with _show_responses_lock:
+        current = _show_responses if _loaded_pid == os.getpid() else None
+        if current is not None and is_fresh():
+            return current
+
+    # One caller reloads the collection, outside _show_responses_lock so a slow or unreachable MongoDB doesn't block
+    # the others: they keep serving the stale copy (only callers without any copy wait for the reload)
+    if not _refresh_lock.acquire(blocking=current is None):
+        return current
+    try:
+        with _show_responses_lock:
+            if _loaded_pid == os.getpid() and is_fresh():
+                return _show_responses  # Reloaded (or failed to) while this caller waited
+
+        try:
+            docs = get_db()['djs']['show_responses'].find({}, SHOW_INFO_PROJECTION)
+            responses = {doc['dj_id']: doc for doc in docs if 'dj_id' in doc}
+        except Exception as e:
+            # Keep serving the last copy, and retry after retry_interval
+            print(f'Show responses reload failed: {e}')
+            responses = None
+
+        with _show_responses_lock:
+            if responses is not None:
+                _show_responses = responses
+                _loaded_at = time.monotonic()
+                _failed_at = float('-inf')
+            else:
+                if _show_responses is None or _loaded_pid != os.getpid():
+                    _show_responses = fallback if fallback is not None else {}
+                    _loaded_at = float('-inf')  # Nothing was loaded in this process yet
+                _failed_at = time.monotonic()
+            _loaded_pid = os.getpid()
+            current = _show_responses
+    finally:
+        _refresh_lock.release()
+
+    if os.getenv('SHOW_RESPONSES_WATCH', '0') == '1':
+        start_show_responses_watcher()
+    return current
+
+
+def invalidate_show_responses():
+    """
+    Makes the next get_show_responses() reload the collection (serving the last copy if the reload fails).
+    """
+
+    global _loaded_at, _failed_at
+    with _show_responses_lock:
+        _loaded_at = _failed_at = float('-inf')
+
+
+def start_show_responses_watcher():
+    """
+    Starts a background thread (once per process) that invalidates the show responses cache whenever the collection
+    changes. If the deployment doesn't support change streams, the thread exits and the cache refreshes on its timer.
+    """
+
+    global _watching_pid
+    with _show_responses_lock:
+        if _watching_pid == os.getpid():
+            return
+        _watching_pid = os.getpid()
+
+    def run():
+        try:
+            with get_db()['djs']['show_responses'].watch() as stream:
+                for _ in stream:
+                    invalidate_show_responses()
+        except Exception as e:
+            print(f'Show responses change stream stopped, refreshing on a timer instead: {e}')
+
+    threading.Thread(target=run, name='show-responses-watcher', daemon=True).start()
+
+
+def get_show_name(response):
+    """
+    Fetches DJ's show name from their show responses.
+
+    :param response: DJ's show_responses document, or None if they have none
     :return: String of DJ's show name
     """
 
     try:
-        show_name = responses.find_one({'dj_id': dj_id})['show_name']
+        show_name = response['show_name']
         if pd.isna(show_name):
             raise ValueError('Show Name is missing')
     except Exception as e:
@@ -55,17 +175,16 @@ def get_show_name(dj_id, responses):
     return show_name
 
 
-def get_timeslot(dj_id, responses):
+def get_timeslot(response):
     """
-    Fetches DJ's timeslot from responses collection.
+    Fetches DJ's timeslot from their show responses.
 
-    :param dj_id: DJ's unique identifier
-    :param responses: MongoDB collection containing show info
+    :param response: DJ's show_responses document, or None if they have none
     :return: String of DJ's timeslot
     """
 
     try:
-        timeslot = responses.find_one({'dj_id': dj_id})['timeslot']
+        timeslot = response['timeslot']
         if pd.isna(timeslot):
             raise ValueError('Timeslot is missing')
     except Exception as e:
@@ -75,17 +194,16 @@ def get_timeslot(dj_id, responses):
     return timeslot
 
 
-def get_about_me(dj_id, responses):
+def get_about_me(response):
     """
-    Fetches DJ's about me from responses collection.
+    Fetches DJ's about me from their show responses.
 
-    :param dj_id: DJ's unique identifier
-    :param responses: MongoDB collection containing show info
+    :param response: DJ's show_responses document, or None if they have none
     :return: String of DJ's about me
     """
 
     try:
-        about_me = responses.find_one({'dj_id': dj_id})['about_show']
+        about_me = response['about_show']
         if pd.isna(about_me):
             raise ValueError('About me is missing')
     except Exception as e:
@@ -95,17 +213,16 @@ def get_about_me(dj_id, responses):
     return about_me
 
 
-def get_subtext(dj_id, responses):
+def get_subtext(response):
     """
-    Fetches DJ's subtext from responses collection.
+    Fetches DJ's subtext from their show responses.
 
-    :param dj_id: DJ's unique identifier
-    :param responses: MongoDB collection containing show info
+    :param response: DJ's show_responses document, or None if they have none
     :return: String of DJ's subtext
     """
 
     try:
-        subtext = responses.find_one({'dj_id': dj_id})['subtext'] # TODO update
+        subtext = response['subtext'] # TODO update
         if pd.isna(subtext):
             raise ValueError('Subtext is missing')
     except Exception as e:
@@ -115,17 +232,16 @@ def get_subtext(dj_id, responses):
     return subtext
 
 
-def get_genres(dj_id, responses):
+def get_genres(response):
     """
-    Fetches DJ's genres from responses collection.
+    Fetches DJ's genres from their show responses.
 
-    :param dj_id: DJ's unique identifier
-    :param responses: MongoDB collection containing show info
+    :param response: DJ's show_responses document, or None if they have none
     :return: List of DJ's genres
     """
 
     try:
-        genres_str = responses.find_one({'dj_id': dj_id})['genres']
+        genres_str = response['genres']
         genres = genres_str.split(', ')
     except Exception as e:
         genres = []
@@ -133,29 +249,13 @@ def get_genres(dj_id, responses):
     return genres
 
 
-def get_recent_songs(dj_id, tracks_df):
+def get_recent_songs(dj_id, model):
     """
     Gets DJ's 5 most recently played songs in "Song - Artist" format.
 
     :param dj_id: DJ's unique identifier
-    :param tracks_df: DataFrame containing KXSC track history
+    :param model: MatchModel snapshot, which keeps every DJ's most recently played songs
     :return: List of strings formatted as "Song Name - Artist Name"
     """
 
-    n = 5  # DJ's 5 most recently played songs
-
-    tracks_df['Date'] = pd.to_datetime(tracks_df['Date'])
-    tracks_df['Time'] = pd.to_datetime(tracks_df['Time'], format='%I:%M:%S %p').dt.time
-    tracks_df.sort_values(by=['Date', 'Time'], ascending=False, inplace=True)
-
-    recent_artists = tracks_df[tracks_df['DJ ID'] == dj_id]['Artist'].head(n).to_list()
-    recent_song_names = tracks_df[tracks_df['DJ ID'] == dj_id]['Song'].head(n).to_list()
-
-    # Formatted as "Song Name - Artist Name"
-    recent_songs = []
-    for song, artist in zip(recent_song_names, recent_artists):
-        song = song.strip()
-        artist = artist.strip()
-        recent_songs.append(song + ' - ' + artist)
-
-    return recent_songs
+    return model.get_recent_songs(dj_id)
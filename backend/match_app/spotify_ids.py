@@ -0,0 +1,109 @@
+import os
+import threading
+from api_helpers import musicbrainz_api, spotify_api
+from api_helpers.ttl_cache import TTLCache
+from dotenv import load_dotenv
+from .database_connection import get_db
+
+load_dotenv()
+
+# Artist MBID -> (Spotify artist ID, Spotify artist name), linked through the artist's Spotify link on MusicBrainz.
+# Verified links never change, so they are kept for the process' lifetime in front of the persistent
+# artists.spotify_artist_ids collection.
+_spotify_ids = {}
+_spotify_ids_lock = threading.Lock()
+
+# Artist MBID -> (Spotify artist ID, Spotify artist name) found by searching Spotify for the artist's name. The search
+# may pick another artist of the same name (or MusicBrainz may just have been unreachable), so these are only kept in
+# the process, for SPOTIFY_NAME_MATCH_TTL seconds, and never saved.
+_name_matches = TTLCache(int(os.getenv('SPOTIFY_NAME_MATCH_CACHE_SIZE', 10000)),
+                         float(os.getenv('SPOTIFY_NAME_MATCH_TTL', 3600)))
+
+
+def get_artist_id_by_mbid(artist_mbid, artist_name):
+    """
+    Resolves an artist's Spotify Artist ID from their MusicBrainz ID: from the persistent MBID -> Spotify ID mapping,
+    else from the artist's Spotify link on MusicBrainz (saved to the mapping), else by searching Spotify for the
+    artist's name (cached in the process only).
+
+    :param artist_mbid: Artist's MusicBrainz ID
+    :param artist_name: Artist's name
+    :return: (Spotify artist ID, Spotify artist name)
+    """
+
+    with _spotify_ids_lock:
+        mapping = _spotify_ids.get(artist_mbid)
+    if mapping is None:
+        mapping = _name_matches.get(artist_mbid)
+    if mapping is not None:
+        return mapping
+
+    mapping = load_spotify_ids([artist_mbid]).get(artist_mbid)
+    if mapping is None:
+        spotify_artist_id = spotify_api.get_artist_id_from_url(musicbrainz_api.get_spotify_url(artist_mbid))
+        if spotify_artist_id is None:
+            mapping = spotify_api.get_artist_id(artist_name)
+            _name_matches.set(artist_mbid, mapping)
+            return mapping
+
+        mapping = (spotify_artist_id, artist_name)
+        print(f"Found Spotify Artist on MusicBrainz: {artist_name} (ID: {spotify_artist_id})")
+        save_spotify_ids({artist_mbid: mapping})
+
+    with _spotify_ids_lock:
+        _spotify_ids[artist_mbid] = mapping
+    return mapping
+
+
+def load_spotify_ids(artist_mbids):
+    """
+    :param artist_mbids: List of artist MusicBrainz IDs
+    :return: Dict of artist MBID -> (Spotify artist ID, Spotify artist name) of the artists in the persistent mapping
+        (an unreachable database counts as no mappings)
+    """
+
+    try:
+        docs = get_db()['artists']['spotify_artist_ids'].find({'_id': {'$in': list(artist_mbids)}})
+        return {doc['_id']: (doc['spotify_id'], doc.get('spotify_name')) for doc in docs}
+    except Exception as e:
+        print(f'Spotify ID mapping lookup failed: {e}')
+        return {}
+
+
+def save_spotify_ids(mappings):
+    """
+    Saves MBID -> Spotify ID mappings to the persistent mapping, in one bulk write.
+
+    :param mappings: Dict of artist MBID -> (Spotify artist ID, Spotify artist name)
+    """
+
+    from pymongo import UpdateOne
+
+    if not mappings:
+        return
+    try:
+        get_db()['artists']['spotify_artist_ids'].bulk_write([
+            UpdateOne({'_id': mbid}, {'$set': {'spotify_id': spotify_id, 'spotify_name': spotify_name}}, upsert=True)
+            for mbid, (spotify_id, spotify_name) in mappings.items()
+        ], ordered=False)
+    except Exception as e:
+        print(f'Spotify ID mapping write failed: {e}')
+
+
+def preload_spotify_ids(artist_mbids=None):
+    """
+    Bulk loads the persistent MBID -> Spotify ID mapping into this process, e.g. before forking the workers.
+
+    :param artist_mbids: List of artist MusicBrainz IDs to load, or None to load the whole mapping
+    :return: Number of mappings loaded
+    """
+
+    if artist_mbids is None:
+        docs = get_db()['artists']['spotify_artist_ids'].find({})
+        mappings = {doc['_id']: (doc['spotify_id'], doc.get('spotify_name')) for doc in docs}
+    else:
+        mappings = load_spotify_ids(artist_mbids)
+
+    with _spotify_ids_lock:
+        _spotify_ids.update(mappings)
+    return len(mappings)
@@ -0,0 +1,39 @@
+import time
+from contextlib import contextmanager
+
+# (phase name, seconds) of every timed startup phase, in order
+_phases = []
+
+
+@contextmanager
+def startup_phase(name):
+    """
+    Times a phase of the app's startup (e.g. importing a part of the stack, or building the match model).
+
+    :param name: Phase name for the startup report
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def get_startup_phases():
+    """
+    :return: List of (phase name, seconds) of the timed startup phases, in order
+    """
+
+    return list(_phases)
+
+
+def format_startup_report(phases=None):
+    """
+    :param phases: List of (phase name, seconds), defaults to get_startup_phases()
+    :return: One-line string of every phase's time and the total, in milliseconds
+    """
+
+    phases = get_startup_phases() if phases is None else phases
+    total = sum(seconds for _, seconds in phases)
+    return ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in phases) + f' (total {total * 1000:.0f} ms)'
@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pandas as pd
+from .features import MISC_FEATURE_COLS, BINARY_FEATURE_COLS, CONFIDENCE_FEATURE_COLS
+
+# Text columns the DJ profiles use (see ProfileAccumulator.add_spins), stored as categoricals in compact mode (most
+# values repeat across spins)
+STRING_COLS = ['DJ Name', 'Date', 'Time', 'Artist', 'Song', 'artist_id']
+
+# Every column compact mode reads. The rest (e.g. playlist titles, releases, ISRCs, song_ids, and genre labels) are
+# never used once the profiles are built, so they are skipped while parsing instead of being loaded and dropped.
+COMPACT_COLS = ['DJ ID'] + STRING_COLS + MISC_FEATURE_COLS + BINARY_FEATURE_COLS + CONFIDENCE_FEATURE_COLS
+
+# Number of rows read in the default layout to estimate its footprint for the compact layout's report
+FOOTPRINT_SAMPLE_ROWS = 1000
+
+
+def use_compact_tracks():
+    """
+    :return: Whether MATCH_COMPACT_TRACKS enables the compact tracks layout (off by default)
+    """
+
+    return os.getenv('MATCH_COMPACT_TRACKS', '0') == '1'
+
+
+def load_tracks(path, compact=None):
+    """
+    Reads the tracks CSV.
+
+    :param path: Path to the tracks CSV
+    :param compact: Whether to use the compact layout (see load_compact_tracks), defaults to use_compact_tracks()
+    :return: DataFrame of tracks (only the COMPACT_COLS in compact mode)
+    """
+
+    if compact is None:
+        compact = use_compact_tracks()
+
+    if compact:
+        return load_compact_tracks(path)
+
+    return pd.read_csv(path)
+
+
+def load_compact_tracks(path):
+    """
+    Reads the tracks CSV into a compact layout, typed while parsing so the full table is never held:
+    - Only the COMPACT_COLS are read. The others, song_ids included, are skipped rather than parsed, since nothing uses
+      them once the profiles are built.
+    - Text columns are categoricals.
+    - Binary flags are float32 rather than int8, since tracks without high-level data have NaN flags (0, 1, and NaN are
+      all exact in float32).
+    - Confidences and the other features stay float64, so the profile sums are the same as from the default layout.
+    Prints the memory footprint next to an estimate of the default layout's (see estimate_default_footprint()).
+
+    :param path: Path to the tracks CSV
+    :return: DataFrame of tracks with the COMPACT_COLS
+    """
+
+    dtype = {col: 'category' for col in STRING_COLS}
+    dtype.update({col: np.float32 for col in BINARY_FEATURE_COLS})
+    tracks_df = pd.read_csv(path, usecols=COMPACT_COLS, dtype=dtype)
+
+    num_tracks = max(len(tracks_df), 1)
+    compact_bytes = memory_footprint(tracks_df)
+    default_bytes = estimate_default_footprint(path, len(tracks_df))
+    print(f'Compact tracks table: {compact_bytes / 2 ** 20:.2f} MiB ({len(tracks_df)} tracks, '
+          f'{compact_bytes / num_tracks:.0f} bytes per track, {len(COMPACT_COLS)} columns); default layout: '
+          f'~{default_bytes / 2 ** 20:.2f} MiB ({default_bytes / num_tracks:.0f} bytes per track), '
+          f'{1 - compact_bytes / max(default_bytes, 1):.0%} smaller')
+
+    return tracks_df
+
+
+def estimate_default_footprint(path, num_tracks):
+    """
+    Estimates the memory footprint of the tracks CSV in the default layout (every column, as pd.read_csv() types it)
+    from its first FOOTPRINT_SAMPLE_ROWS rows, without loading the full table.
+
+    :param path: Path to the tracks CSV
+    :param num_tracks: Number of tracks in the CSV
+    :return: Estimated bytes
+    """
+
+    sample_df = pd.read_csv(path, nrows=FOOTPRINT_SAMPLE_ROWS)
+    if sample_df.empty:
+        return 0
+    return int(memory_footprint(sample_df) / len(sample_df) * num_tracks)
+
+
+def memory_footprint(tracks_df):
+    """
+    :param tracks_df: DataFrame of tracks
+    :return: Bytes held by the DataFrame, including the Python strings in object columns
+    """
+
+    return int(tracks_df.memory_usage(deep=True).sum())
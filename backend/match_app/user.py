@@ -1,147 +1,257 @@
+import numpy as np
 import pandas as pd
 from api_helpers import spotify_api, musicbrainz_api
+from api_helpers.circuit_breakers import ServiceUnavailable
+from api_helpers.service_limits import map_completed, map_ordered
 from data import acousticbrainz_db
+from .artist_cache import cache_artist, get_cached_artist
+from .features import calculate_avg_features
+from .spotify_ids import get_artist_id_by_mbid
 
 pd.set_option('display.max_columns', None)
 
 
 class User:
-    def __init__(self, mood, artists, songs, tracks_df):
+    def __init__(self, mood, artists, songs, mood_centroids, artist_features=None, verbose=True):
         self.mood = mood.lower()
         self.artists = artists
         self.songs = songs
-        self.tracks_df = tracks_df
+        self.mood_centroids = mood_centroids  # Precomputed average features of all station tracks with each mood
+        # Already looked up feature cache entries of the user's artists (e.g. shared across a batch), if any
+        self.artist_features = artist_features
+        self.verbose = verbose  # Whether to print progress, off for batches of many users
         self.avg_features = self.calculate_avg_features()
 
     def calculate_avg_features(self):
-        user_df = self.create_user_df()
-
-        misc_feature_cols = ['danceability', 'bpm']
-        binary_feature_cols = ['instrumental',
-                               'gender',
-                               'danceable',
-                               'tonal',
-                               'timbre',
-                               'electronic',
-                               'party',
-                               'aggressive',
-                               'acoustic',
-                               'happy',
-                               'sad',
-                               'relaxed']
-
-        confidence_feature_cols = ['instrumental_confidence',
-                                   'gender_confidence',
-                                   'danceable_confidence',
-                                   'tonal_confidence',
-                                   'timbre_confidence',
-                                   'electronic_confidence',
-                                   'party_confidence',
-                                   'aggressive_confidence',
-                                   'acoustic_confidence',
-                                   'happy_confidence',
-                                   'sad_confidence',
-                                   'relaxed_confidence']
+        artist_features = self.get_artist_features()
 
         # Apply mood transformation
         if self.mood is not None:
-            tracks_prob = calculate_probabilistic_scores(self.tracks_df, binary_feature_cols, confidence_feature_cols)
-            prob_cols = [col for col in tracks_prob.columns if col.endswith('_prob')]
-            feature_cols = misc_feature_cols + prob_cols
-
-            # Filter for songs from the overall tracks DataFrame that have the desired mood
-            mood_df = tracks_prob[tracks_prob[self.mood] == 1]
-            # Calculate the average features vector of all tracks with the desired mood
-            avg_mood_features = mood_df[feature_cols].mean().to_numpy()
-
-            # If the user's DataFrame is empty, meaning the user added no artists or no AcousticBrainz data was found
-            if user_df.dropna().empty:
-                print('user_df.dropna() is empty')
-                return avg_mood_features
+            # The average features vector of all station tracks with the desired mood
+            avg_mood_features = self.mood_centroids[self.mood]
 
             # Calculate the average features vector of the user's tracks
-            user_prob = calculate_probabilistic_scores(user_df, binary_feature_cols, confidence_feature_cols)
-            avg_user_features = user_prob[feature_cols].mean().to_numpy()
+            avg_user_features = combine_artist_features(artist_features)
+
+            # If the user added no artists or no AcousticBrainz data was found
+            if avg_user_features is None:
+                self.log('No AcousticBrainz data for the user\'s artists')
+                return avg_mood_features
 
             # Apply the mood transformation
             alpha = 0.7  # Weight: 70% for global mood average, 30% for user mood average
             transformed_mood_features = alpha * avg_mood_features + (1 - alpha) * avg_user_features
-            print('Transformed mood features!')
+            self.log('Transformed mood features!')
             return transformed_mood_features
 
         return ...
 
-    def create_user_df(self):
-        u_df = pd.DataFrame()
+    def get_artist_features(self):
+        if self.artist_features is not None:
+            return self.artist_features
 
-        # Append any artists the user submitted
+        # Look up any artists the user submitted, in the artist feature cache before any external calls
         if self.artists:
-            print("self.artists:", self.artists)  # Debugging
-            # Append artists' top 5 songs + the AcousticBrainz info
-            artist_names = [artist['name'] for artist in self.artists]
-            artist_mbids = [artist['mbid'] for artist in self.artists]
+            self.log("self.artists:", self.artists)  # Debugging
+            return get_artists_features(self.artists)
 
-            artists_df = create_artists_df(artist_names, artist_mbids)
+        self.log("User did not submit any artists")  # Debugging
+        return []
 
-            u_df = artists_df.copy()
-        else:
-            print("User did not submit any artists")  # Debugging
+    def log(self, *values):
+        if self.verbose:
+            print(*values)
 
-        u_df.dropna(inplace=True)
-        return u_df
 
+class EnrichmentStatus:
+    """
+    Progress of one artist's enrichment: the external source it is waiting on, and the sources it skipped.
+    """
 
-def create_artists_df(artist_names, artist_mbids):
-    mb_tracks = []
+    def __init__(self):
+        self.source = None
+        self.skipped = set()
 
-    # Iterate through each artist the user inputted
-    for name, mbid in zip(artist_names, artist_mbids):
-        # Step 1: Get Spotify artist ID
-        try:
-            spotify_artist_id, spotify_artist_name = spotify_api.get_artist_id(name)
-        except Exception as e:
-            print(e)
+
+def get_artists_features(artists, timeout=None, skipped=None):
+    """
+    Looks up the aggregated features of every artist in the artist feature cache, and enriches the artists that aren't
+    cached (concurrently) and caches them. Artists whose enrichment skipped a source (circuit open or a failed request)
+    or didn't finish within the timeout aren't cached, so a later request can enrich them fully.
+
+    :param artists: List of dicts containing artist info (mbid, name)
+    :param timeout: Optional seconds to wait for the enrichment
+    :param skipped: Optional set to add the names of the sources that were skipped to, including the source an artist
+        was waiting on at the timeout
+    :return: List of artist feature cache entries (see match_app.artist_cache), one per artist in the same order
+    """
+
+    entries = dict(iter_artists_features(artists, timeout=timeout, skipped=skipped))
+    return [entries[artist['mbid']] for artist in artists]
+
+
+def iter_artists_features(artists, timeout=None, skipped=None):
+    """
+    Like get_artists_features(), but yields every distinct artist's cache entry as soon as it is known: the cached
+    artists first, then the enriched artists as their enrichment finishes.
+
+    :param artists: List of dicts containing artist info (mbid, name)
+    :param timeout: Optional seconds to wait for the enrichment
+    :param skipped: Optional set to add the names of the sources that were skipped to
+    :return: Generator of (artist MBID, artist feature cache entry)
+    """
+
+    missing = {}
+    seen = set()
+    for artist in artists:
+        mbid = artist['mbid']
+        if mbid in seen:
             continue
+        seen.add(mbid)
+        entry = get_cached_artist(mbid)
+        if entry is None:
+            missing[mbid] = artist
+        else:
+            yield mbid, entry
+
+    # Top 3 songs of every uncached artist + the AcousticBrainz info
+    missing_artists = list(missing.values())
+    statuses = [EnrichmentStatus() for _ in missing_artists]
+    enriched = map_completed(lambda i: enrich_artist(missing_artists[i]['name'], missing_artists[i]['mbid'], statuses[i]),
+                             range(len(missing_artists)), timeout=timeout)
+    for i, entry in enriched:
+        mbid = missing_artists[i]['mbid']
+        status = statuses[i]
+        if entry is None:
+            print(f"Dropped the enrichment of artist '{mbid}' at the timeout, waiting on {status.source}")
+            entry = {'features': None, 'num_tracks': 0, 'track_mbids': []}
+            status.skipped.add(status.source)
+        if status.skipped:
+            # Whatever tracks were found are still used, but not cached
+            if skipped is not None:
+                skipped.update(status.skipped)
+        else:
+            cache_artist(mbid, entry)
+        yield mbid, entry
 
-        # Step 2: Get the Spotify artist_id's Top Tracks
-        top_tracks = spotify_api.get_top_tracks(spotify_artist_id)
-        print(f"\nTop {len(top_tracks)} Tracks for '{spotify_artist_name}':")
-        for idx, track in enumerate(top_tracks, start=1):
-            print(f"{idx}. {track['name']} (Popularity: {track['spotify_popularity']})")
-
-        # Step 3: Search each track in MusicBrainz to get MBIDs
-        print("\nSearching for MusicBrainz Track IDs...")
-        for track in top_tracks:
-            track_name = track['name']
-            track_mbid = musicbrainz_api.get_track_id(mbid, track_name)
-            if track_mbid:
-                mb_tracks.append(
-                    {
-                        'artist': name,
-                        'artist_mbid': mbid,
-                        'track_name': track_name,
-                        'track_mbid': track_mbid
-                    }
-                )
+
+def enrich_artist(name, mbid, status=None):
+    """
+    :param name: Artist name
+    :param mbid: Artist's MusicBrainz ID
+    :param status: Optional EnrichmentStatus to track the enrichment's progress in
+    :return: Artist feature cache entry of the average features vector of the artist's top tracks with AcousticBrainz
+        data, the number of those tracks, and their MBIDs
+    """
+
+    tracks_df = create_artists_df([name], [mbid], status).dropna()
+    if tracks_df.empty:
+        return {'features': None, 'num_tracks': 0, 'track_mbids': []}
+
+    return {
+        'features': calculate_avg_features(tracks_df).tolist(),
+        'num_tracks': len(tracks_df),
+        'track_mbids': tracks_df['track_mbid'].tolist(),
+    }
+
+
+def combine_artist_features(artist_features):
+    """
+    Averages the artists' feature vectors weighted by their number of tracks, i.e. the average features vector of all of
+    their tracks.
+
+    :param artist_features: List of artist feature cache entries
+    :return: Array of shape (len(FEATURE_COLS), ), or None if no artist has any tracks with AcousticBrainz data
+    """
+
+    entries = [entry for entry in artist_features if entry['num_tracks']]
+    if not entries:
+        return None
+
+    features = np.array([entry['features'] for entry in entries], dtype=float)
+    weights = np.array([entry['num_tracks'] for entry in entries], dtype=float)
+    return weights @ features / weights.sum()
+
+
+def create_artists_df(artist_names, artist_mbids, status=None):
+    """
+    Enriches the user's artists with their top tracks' AcousticBrainz data. Artists, and each artist's tracks, are
+    looked up concurrently (within each service's limits, see api_helpers.service_limits), and the tracks are kept in
+    the order of the artists and of their top tracks.
+
+    :param artist_names: List of artist names
+    :param artist_mbids: List of the artists' MusicBrainz IDs
+    :param status: Optional EnrichmentStatus to track the enrichment's progress in
+    :return: DataFrame of the artists' tracks with AcousticBrainz features
+    """
+
+    status = status or EnrichmentStatus()
+
+    # Iterate through each artist the user inputted
+    artist_tracks = map_ordered(lambda artist: get_artist_tracks(*artist, status),
+                                list(zip(artist_names, artist_mbids)))
+    mb_tracks = [track for tracks in artist_tracks for track in tracks]
 
     mb_df = pd.DataFrame(mb_tracks)
 
     # AcousticBrainz data
     if not mb_df.empty:
-        ab_df = acousticbrainz_db.modify_ab_db(mb_df)
+        status.source = 'acousticbrainz'
+        ab_df = acousticbrainz_db.modify_ab_db(mb_df, status.skipped)
         return ab_df
 
     return mb_df  # Return empty DataFrame for completeness; this clause should not be encountered though
 
 
-def calculate_probabilistic_scores(df, binary_features, confidence_features):
-    df_prob = df.copy()
-
-    for binary, confidence, in zip(binary_features, confidence_features):
-        prob_col = f'{binary}_prob'
-        df_prob[prob_col] = (df_prob[binary] * df_prob[confidence]) + ((1 - df_prob[binary]) * (1 - df_prob[confidence]))
-
-    return df_prob
-
+def get_artist_tracks(name, mbid, status=None):
+    """
+    :param name: Artist name
+    :param mbid: Artist's MusicBrainz ID
+    :param status: Optional EnrichmentStatus to track the enrichment's progress in
+    :return: List of dicts (artist, artist_mbid, track_name, track_mbid) of the artist's Spotify top tracks found in
+        MusicBrainz, in top tracks order
+    """
 
+    status = status or EnrichmentStatus()
 
+    # Step 1: Get Spotify artist ID, from the MBID -> Spotify ID mapping when possible
+    # Step 2: Get the Spotify artist_id's Top Tracks
+    status.source = 'spotify'
+    try:
+        spotify_artist_id, spotify_artist_name = get_artist_id_by_mbid(mbid, name)
+        top_tracks = spotify_api.get_top_tracks(spotify_artist_id)
+    except ServiceUnavailable as e:
+        print(e)
+        status.skipped.add(e.service)
+        return []
+    except Exception as e:
+        print(e)
+        return []
+
+    print(f"\nTop {len(top_tracks)} Tracks for '{spotify_artist_name}':")
+    for idx, track in enumerate(top_tracks, start=1):
+        print(f"{idx}. {track['name']} (Popularity: {track['spotify_popularity']})")
+
+    # Step 3: Search each track in MusicBrainz to get MBIDs
+    print("\nSearching for MusicBrainz Track IDs...")
+    status.source = 'musicbrainz'
+
+    def get_track_id(track_name):
+        try:
+            return musicbrainz_api.get_track_id(mbid, track_name)
+        except ServiceUnavailable as e:
+            status.skipped.add(e.service)
+            return None
+
+    track_names = [track['name'] for track in top_tracks]
+    track_mbids = map_ordered(get_track_id, track_names)
+
+    return [
+        {
+            'artist': name,
+            'artist_mbid': mbid,
+            'track_name': track_name,
+            'track_mbid': track_mbid
+        }
+        for track_name, track_mbid in zip(track_names, track_mbids) if track_mbid
+    ]
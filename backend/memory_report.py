@@ -0,0 +1,58 @@
+import argparse
+import psutil
+
+
+def get_memory_usage(pid):
+    """
+    Measures a process's memory. USS (unique) is what the process alone holds; PSS (proportional) splits every shared
+    page evenly between the processes sharing it, so the PSS of all gunicorn processes adds up to their real footprint.
+
+    :param pid: Process ID
+    :return: Dict of rss, uss, pss, and shared memory in bytes (pss and shared are None where the OS doesn't report them)
+    """
+
+    info = psutil.Process(pid).memory_full_info()
+    return {
+        'rss': info.rss,
+        'uss': info.uss,
+        'pss': getattr(info, 'pss', None),
+        'shared': getattr(info, 'shared', None),
+    }
+
+
+def format_memory_usage(usage):
+    """
+    :param usage: Dict from get_memory_usage()
+    :return: String of the usage in MiB
+    """
+
+    return ', '.join(f'{name.upper()} {value / 2 ** 20:.1f} MiB' for name, value in usage.items() if value is not None)
+
+
+def report_gunicorn_memory(master_pid):
+    """
+    Prints the memory of a gunicorn master and each of its workers, and the totals. With preload_app, the workers'
+    PSS is well below their RSS because most of their pages are shared with the master and each other.
+
+    :param master_pid: Process ID of the gunicorn master
+    """
+
+    master = psutil.Process(master_pid)
+    processes = [('master', master)] + [(f'worker {child.pid}', child) for child in master.children()]
+
+    totals = {'rss': 0, 'uss': 0, 'pss': 0}
+    for name, process in processes:
+        usage = get_memory_usage(process.pid)
+        print(f'{name}: {format_memory_usage(usage)}')
+        for key in totals:
+            totals[key] += usage[key] or 0
+
+    print(f'total: {format_memory_usage(totals)}')
+    print(f'shared across processes (total RSS - total PSS): {(totals["rss"] - totals["pss"]) / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    # e.g. python memory_report.py $(pgrep -o gunicorn)
+    parser = argparse.ArgumentParser(description='Report the memory of a gunicorn master and its workers.')
+    parser.add_argument('master_pid', type=int)
+    report_gunicorn_memory(parser.parse_args().master_pid)
@@ -0,0 +1,42 @@
+import argparse
+import json
+import os
+import sys
+
+# Only the enrichment helpers are needed, not a loaded match model
+os.environ['MATCH_MODEL_WARMUP'] = '0'
+# This script runs the prefetch itself, so the app's background prefetcher and drift checker mustn't start on import
+os.environ['BACKGROUND_TASKS_AT_IMPORT'] = '0'
+
+from match_app.artist_cache import get_shared_cache
+from match_app.prefetch import get_prefetch_coverage, prefetch_pass, reset_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Prefetch the features of the most popular artists, resuming from the cursor shared with the app.')
+    parser.add_argument('--top', type=int, default=int(os.getenv('PREFETCH_TOP_N', 1000)),
+                        help='Number of popular artists to cover (default: PREFETCH_TOP_N)')
+    parser.add_argument('--restart', action='store_true', help='Start over from the most popular artist')
+    parser.add_argument('--report', action='store_true', help='Only report the coverage')
+    parser.add_argument('--days', type=int, default=7, help='Days of recent user picks the coverage report checks')
+    args = parser.parse_args()
+
+    # Without a shared tier, the prefetched artist features would stay in this process, and prefetch_pass() would use a
+    # cursor of its own rather than the one shared with the app
+    if get_shared_cache() is None:
+        sys.exit('The prefetch CLI needs a shared artist cache tier, for the app workers to see what it prefetches and '
+                 'to resume from their cursor. Set ARTIST_CACHE_BACKEND to mongo or redis.')
+
+    if not args.report:
+        if args.restart:
+            reset_cursor()
+        # A finished pass only restarts after PREFETCH_PASS_INTERVAL, as in the app
+        pass_interval = float(os.getenv('PREFETCH_PASS_INTERVAL', 86400))
+        print(f'Prefetched {prefetch_pass(args.top, pass_interval=pass_interval, shared_cursor=True)} popular artists')
+
+    print(json.dumps(get_prefetch_coverage(args.top, days=args.days), indent=2))
+
+
+if __name__ == '__main__':
+    main()
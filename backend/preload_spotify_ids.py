@@ -0,0 +1,51 @@
+import argparse
+import csv
+import os
+
+# Only the Spotify helpers are needed, not a loaded match model
+os.environ['MATCH_MODEL_WARMUP'] = '0'
+os.environ['BACKGROUND_TASKS_AT_IMPORT'] = '0'  # Nor the app's drift checker and prefetcher
+
+from match_app.database_connection import get_db
+from api_helpers.service_limits import map_ordered
+from match_app.spotify_ids import get_artist_id_by_mbid, load_spotify_ids, save_spotify_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk fill the persistent MBID -> Spotify artist ID mapping.')
+    parser.add_argument('--csv', help='CSV of known mappings with mbid, spotify_id, and optionally spotify_name columns')
+    parser.add_argument('--resolve-top', type=int, default=0,
+                        help='Resolve the N most popular artists of the artist_names_and_mbids collection')
+    args = parser.parse_args()
+
+    if args.csv:
+        with open(args.csv, newline='') as f:
+            mappings = {row['mbid']: (row['spotify_id'], row.get('spotify_name')) for row in csv.DictReader(f)}
+        save_spotify_ids(mappings)
+        print(f'Imported {len(mappings)} Spotify artist IDs from {args.csv}')
+
+    if args.resolve_top:
+        # _id acts as a proxy for popularity because documents are in descending popularity (approximately) order
+        artists = list(get_db()['artists']['artist_names_and_mbids'].find({}, {'name': 1, 'mbid': 1})
+                       .sort([('_id', 1)]).limit(args.resolve_top))
+
+        def resolve(artist):
+            try:
+                return get_artist_id_by_mbid(artist['mbid'], artist['name'])
+            except Exception as e:
+                print(e)
+                return None
+
+        resolved = map_ordered(resolve, artists)
+
+        # Only the MusicBrainz-verified links are saved; name-search matches are just cached in this process. Count
+        # what the mapping collection actually holds, since a failed write is only logged.
+        saved = load_spotify_ids([artist['mbid'] for artist in artists])
+        name_matches = sum(mapping is not None and artist['mbid'] not in saved
+                           for artist, mapping in zip(artists, resolved))
+        print(f'Saved {len(saved)} of {len(artists)} Spotify artist IDs to the mapping; {name_matches} more were only '
+              f'matched by name search and not saved')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+import time
+
+# Time the import like a gunicorn worker's, whose background tasks start after it (see gunicorn_config.py), so the
+# drift checker and prefetcher don't run in this script
+os.environ['BACKGROUND_TASKS_AT_IMPORT'] = '0'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the app's startup phases in a fresh interpreter.")
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Exit with an error if importing the app takes longer than this many seconds')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from match_app.startup import get_startup_phases
+    total = time.perf_counter() - start
+
+    for name, seconds in get_startup_phases():
+        print(f'{name:<16}{seconds * 1000:>8.0f} ms')
+    print(f"{'total':<16}{total * 1000:>8.0f} ms")
+
+    if args.budget is not None and total > args.budget:
+        print(f'Startup took {total:.2f} s, over the {args.budget:.2f} s budget', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import os
+import shutil
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Import the app's modules without building the match model or starting its background tasks
+os.environ['MATCH_MODEL_WARMUP'] = '0'
+os.environ['BACKGROUND_TASKS_AT_IMPORT'] = '0'
+import match_app  # noqa: E402 (gevent monkey-patches before anything else is imported, as in the app)
+
+TRACKS_CSV = os.path.join(BACKEND_DIR, 'data', 'sliced_ab_data.csv')
+
+
+@pytest.fixture
+def tracks_csv(tmp_path, monkeypatch):
+    """
+    :return: Path to a copy of the tracks CSV, which the app uses as its data (with no artifact and an empty spin log)
+    """
+
+    path = tmp_path / 'tracks.csv'
+    shutil.copy(TRACKS_CSV, path)
+    monkeypatch.setenv('MATCH_DATA_PATH', str(path))
+    monkeypatch.setenv('MATCH_ARTIFACT_PATH', str(tmp_path / 'match_model'))
+    monkeypatch.setenv('MATCH_SPIN_LOG_PATH', str(tmp_path / 'ingested_spins.csv'))
+    return str(path)
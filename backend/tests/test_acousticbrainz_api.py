@@ -0,0 +1,67 @@
+import math
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+from api_helpers import acousticbrainz_api, circuit_breakers, service_limits
+from api_helpers.acousticbrainz_api import BULK_SIZE, FEATURE_DATA_COLS, get_feature_records
+from fake_acousticbrainz import FakeAcousticBrainzHandler, build_documents
+from conftest import TRACKS_CSV
+
+NULL_BPM_MBID = '0a1b2c3d-0000-4000-8000-000000000001'
+NAN_BPM_MBID = '0a1b2c3d-0000-4000-8000-000000000002'
+UNKNOWN_MBIDS = [f'0a1b2c3d-0000-4000-8000-00000000001{i}' for i in range(3)]
+
+
+@pytest.fixture(scope='module')
+def documents():
+    low_level, high_level = build_documents(TRACKS_CSV)
+    first_low_level = next(iter(low_level.values()))
+    low_level[NULL_BPM_MBID] = {**first_low_level, 'rhythm': {'danceability': 1.0, 'bpm': None}}
+    low_level[NAN_BPM_MBID] = {**first_low_level, 'rhythm': {'danceability': 1.0, 'bpm': math.nan}}
+    return {'low-level': low_level, 'high-level': high_level}
+
+
+@pytest.fixture
+def fake_server(documents, monkeypatch):
+    """
+    :return: The fake AcousticBrainz server's handler class, serving the documents on a free local port
+    """
+
+    handler = type('Handler', (FakeAcousticBrainzHandler,), {'documents': documents, 'bulk_requests': []})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(acousticbrainz_api, 'ab_base_url', f'http://127.0.0.1:{server.server_address[1]}')
+    monkeypatch.setattr(service_limits, '_bucket_store', service_limits.LocalBucketStore())
+    monkeypatch.setattr(circuit_breakers, '_breakers', {})
+    yield handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_lookup_rows_and_requests(fake_server, documents):
+    known_mbids = list(documents['low-level'])[:BULK_SIZE + 5]
+    track_mbids = known_mbids + [NULL_BPM_MBID, NAN_BPM_MBID] + UNKNOWN_MBIDS
+
+    records = get_feature_records(track_mbids)
+
+    assert list(records) == track_mbids
+    assert all(list(record) == FEATURE_DATA_COLS for record in records.values())
+    for mbid in known_mbids:
+        low_level, high_level = documents['low-level'][mbid], documents['high-level'][mbid]['highlevel']
+        assert records[mbid]['track_mbid'] == mbid
+        assert records[mbid]['bpm'] == int(round(low_level['rhythm']['bpm']))
+        assert records[mbid]['happy_confidence'] == high_level['mood_happy']['probability']
+    # Records without usable low-level data are all None, high-level data included
+    for mbid in [NULL_BPM_MBID, NAN_BPM_MBID] + UNKNOWN_MBIDS:
+        assert all(value is None for value in records[mbid].values())
+
+    # Low-level data for every track, in chunks of up to BULK_SIZE, then high-level data only for the tracks found
+    requests_by_level = {'low-level': [], 'high-level': []}
+    for level, recording_ids in fake_server.bulk_requests:
+        assert len(recording_ids) <= BULK_SIZE
+        requests_by_level[level].append(recording_ids)
+    assert len(requests_by_level['low-level']) == 2
+    assert sorted(sum(requests_by_level['low-level'], [])) == sorted(track_mbids)
+    assert len(requests_by_level['high-level']) == 2
+    assert sorted(sum(requests_by_level['high-level'], [])) == sorted(known_mbids)
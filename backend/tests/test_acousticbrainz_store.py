@@ -0,0 +1,108 @@
+import io
+import json
+import tarfile
+import pytest
+from api_helpers.acousticbrainz_api import FEATURE_DATA_COLS, HIGH_LEVEL_BINARY_FEATURES, HIGH_LEVEL_GENRE_FEATURES
+from data import acousticbrainz_db, acousticbrainz_store
+from data.acousticbrainz_store import import_dumps, lookup_feature_records
+
+FULL_MBID = '0a1b2c3d-0000-4000-8000-000000000001'  # Low-level and high-level data
+LOW_ONLY_MBID = '0a1b2c3d-0000-4000-8000-000000000002'  # Low-level data only
+NULL_BPM_MBID = '0a1b2c3d-0000-4000-8000-000000000003'  # Low-level data without a bpm, so unusable
+NAN_BPM_MBID = '0a1b2c3d-0000-4000-8000-000000000004'  # Low-level data with a NaN bpm, so unusable
+MISSING_MBID = '0a1b2c3d-0000-4000-8000-000000000005'
+
+
+def low_level_doc(bpm, key='A'):
+    return {'tonal': {'key_key': key, 'key_scale': 'minor', 'key_strength': 0.5},
+            'rhythm': {'danceability': 1.2, 'bpm': bpm}}
+
+
+def high_level_doc():
+    classifiers = {classifier: {'value': positive, 'probability': 0.75}
+                   for _, classifier, positive in HIGH_LEVEL_BINARY_FEATURES}
+    classifiers.update({classifier: {'value': 'rock', 'probability': 0.5}
+                        for _, _, classifier in HIGH_LEVEL_GENRE_FEATURES})
+    return {'highlevel': classifiers}
+
+
+def write_dump(path, documents):
+    """
+    :param path: Path of the tar archive to write
+    :param documents: Dict of member name suffix ('<mbid>-<offset>') -> document
+    """
+
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, document in documents.items():
+            data = json.dumps(document).encode()
+            member = tarfile.TarInfo(f'acousticbrainz-dump/{name[:2]}/{name}.json')
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    low_level_dump = tmp_path / 'lowlevel.tar.gz'
+    high_level_dump = tmp_path / 'highlevel.tar.gz'
+    write_dump(str(low_level_dump), {
+        f'{FULL_MBID}-0': low_level_doc(119.6),
+        f'{FULL_MBID}-1': low_level_doc(80, key='C'),  # Only the first submission is kept
+        f'{LOW_ONLY_MBID}-0': low_level_doc(90),
+        f'{NULL_BPM_MBID}-0': low_level_doc(None),
+        f'{NAN_BPM_MBID}-0': low_level_doc(float('nan')),
+    })
+    write_dump(str(high_level_dump), {f'{FULL_MBID}-0': high_level_doc()})
+
+    path = str(tmp_path / 'acousticbrainz.sqlite')
+    counts = import_dumps([str(low_level_dump), str(high_level_dump)], path)
+    assert counts == {'low_level': 2, 'high_level': 1}
+
+    monkeypatch.setenv('AB_STORE_PATH', path)
+    monkeypatch.setattr(acousticbrainz_store, '_store', None)
+    return path
+
+
+def test_lookup_returns_imported_records(store_path):
+    records = {record['track_mbid']: record
+               for record in lookup_feature_records([FULL_MBID, LOW_ONLY_MBID, NULL_BPM_MBID, NAN_BPM_MBID, MISSING_MBID,
+                                                      'not-an-id'])}
+
+    assert set(records) == {FULL_MBID, LOW_ONLY_MBID}
+    assert all(list(record) == FEATURE_DATA_COLS for record in records.values())
+
+    full = records[FULL_MBID]
+    assert (full['key'], full['key_scale'], full['bpm']) == ('A', 'minor', 120)
+    assert full['happy'] == 1 and full['happy_confidence'] == 0.75
+    assert full['rosamerica'] == 'rock'
+
+    low_only = records[LOW_ONLY_MBID]
+    assert low_only['bpm'] == 90
+    assert low_only['happy'] is None and low_only['rosamerica'] is None
+
+
+def test_local_api_backend_fetches_tracks_missing_from_the_store(store_path, monkeypatch):
+    fetched = []
+    monkeypatch.setenv('AB_BACKEND', 'local+api')
+    monkeypatch.setattr(acousticbrainz_db, 'fetch_ab_records',
+                        lambda track_mbids, skipped=None: fetched.extend(track_mbids) or [])
+
+    records = acousticbrainz_db.get_ab_records([FULL_MBID, MISSING_MBID])
+
+    assert [record['track_mbid'] for record in records] == [FULL_MBID]
+    assert fetched == [MISSING_MBID]
+
+
+def test_local_api_backend_falls_back_to_the_api_without_a_store(tmp_path, monkeypatch):
+    fetched = []
+    monkeypatch.setenv('AB_STORE_PATH', str(tmp_path / 'missing.sqlite'))
+    monkeypatch.setattr(acousticbrainz_store, '_store', None)
+    monkeypatch.setattr(acousticbrainz_db, 'fetch_ab_records',
+                        lambda track_mbids, skipped=None: fetched.extend(track_mbids) or [])
+
+    monkeypatch.setenv('AB_BACKEND', 'local+api')
+    assert acousticbrainz_db.get_ab_records([FULL_MBID]) == []
+    assert fetched == [FULL_MBID]
+
+    monkeypatch.setenv('AB_BACKEND', 'local')
+    with pytest.raises(FileNotFoundError):
+        acousticbrainz_db.get_ab_records([FULL_MBID])
@@ -0,0 +1,84 @@
+import json
+import os
+import numpy as np
+import pytest
+from match_app import artifact
+from match_app.artifact import (ArtifactIntegrityError, ArtifactVersionError, MANIFEST_FILE, build_artifact,
+                                is_artifact_stale, load_artifact, load_artifact_profiles, recompute_artifact_profiles,
+                                verify_artifact)
+from match_app.match_model import get_data_source
+from match_app.profiles import ProfileAccumulator
+from match_app.tracks import load_tracks
+
+
+@pytest.fixture
+def artifact_path(tracks_csv):
+    path = os.environ['MATCH_ARTIFACT_PATH']
+    build_artifact(tracks_csv, path)
+    return path
+
+
+def test_round_trip_matches_csv_profiles(tracks_csv, artifact_path):
+    expected = ProfileAccumulator.from_tracks(load_tracks(tracks_csv, compact=False))
+    loaded = load_artifact(artifact_path)
+
+    for profiles in [load_artifact_profiles(loaded), recompute_artifact_profiles(loaded)]:
+        assert list(profiles.dj_ids) == list(expected.dj_ids)
+        np.testing.assert_allclose(profiles.dj_avg_features(), expected.dj_avg_features(), equal_nan=True)
+    assert isinstance(loaded['arrays']['dj_matrix'], np.memmap)
+    assert loaded['show_responses'] is None
+
+
+def test_artifact_is_served_until_csv_changes(tracks_csv, artifact_path):
+    manifest_path = os.path.join(artifact_path, MANIFEST_FILE)
+    assert not is_artifact_stale(manifest_path, tracks_csv)
+    assert get_data_source() == manifest_path
+
+    with open(tracks_csv, 'a') as f:
+        f.write('\n')
+    assert is_artifact_stale(manifest_path, tracks_csv)
+    assert get_data_source() == tracks_csv
+
+
+def test_cli_defaults_to_match_data_path(tracks_csv, monkeypatch):
+    with open(tracks_csv, 'a') as f:
+        f.write('\n')  # Differ from the repo's data/sliced_ab_data.csv
+    monkeypatch.setattr('sys.argv', ['build_match_model.py'])
+    artifact.main()
+
+    manifest_path = os.path.join(os.environ['MATCH_ARTIFACT_PATH'], MANIFEST_FILE)
+    assert not is_artifact_stale(manifest_path, tracks_csv)
+
+
+def test_truncated_file_is_rejected_on_load(artifact_path):
+    file_path = os.path.join(artifact_path, 'dj_matrix.npy')
+    with open(file_path, 'r+b') as f:
+        f.truncate(os.path.getsize(file_path) - 8)
+
+    with pytest.raises(ArtifactIntegrityError):
+        load_artifact(artifact_path)
+
+
+def test_modified_file_fails_verification(artifact_path):
+    file_path = os.path.join(artifact_path, 'dj_matrix.npy')
+    with open(file_path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last_byte = f.read(1)[0]
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last_byte ^ 1]))
+
+    load_artifact(artifact_path)  # Same size, so only the content hash catches it
+    with pytest.raises(ArtifactIntegrityError):
+        verify_artifact(artifact_path)
+
+
+def test_other_version_is_rejected(artifact_path):
+    manifest_path = os.path.join(artifact_path, MANIFEST_FILE)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['version'] = artifact.ARTIFACT_VERSION + 1
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    with pytest.raises(ArtifactVersionError):
+        load_artifact(artifact_path)
@@ -0,0 +1,51 @@
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from api_helpers.ttl_cache import TTLCache
+from match_app import artist_cache
+from match_app.artist_cache import MongoArtistCache, get_cached_artist
+
+ENTRY = {'features': [0.5], 'num_tracks': 3, 'track_mbids': ['t1', 't2', 't3']}
+
+
+class SharedCache:
+    def __init__(self, hits):
+        self.hits = hits
+
+    def get(self, artist_mbid):
+        return self.hits.get(artist_mbid)
+
+
+@pytest.fixture
+def local_cache(monkeypatch):
+    cache = TTLCache(100, 7 * 86400)
+    monkeypatch.setattr(artist_cache, '_local_cache', cache)
+    return cache
+
+
+def test_shared_hit_is_kept_locally_only_until_it_expires_in_the_shared_tier(local_cache, monkeypatch):
+    monkeypatch.setattr(artist_cache, 'get_shared_cache', lambda: SharedCache({'a': (ENTRY, 30.0), 'b': (ENTRY, 0.0)}))
+
+    assert get_cached_artist('a') == ENTRY
+    expires_at, _ = local_cache._entries['a']
+    assert expires_at - time.monotonic() == pytest.approx(30, abs=1)
+
+    # An entry at the end of its life in the shared tier is served, but not copied
+    assert get_cached_artist('b') == ENTRY
+    assert 'b' not in local_cache._entries
+
+
+def test_mongo_tier_returns_the_remaining_ttl():
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=120)
+
+    class Collection:
+        def find_one(self, query):
+            # Naive UTC, as returned by clients without tz_aware
+            return {'_id': query['_id'], **ENTRY, 'expires_at': expires_at.replace(tzinfo=None)}
+
+    cache = MongoArtistCache()
+    cache.get_collection = Collection
+    entry, remaining_ttl = cache.get('a')
+
+    assert entry == ENTRY
+    assert remaining_ttl == pytest.approx(120, abs=1)
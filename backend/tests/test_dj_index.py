@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from match_app.dj_index import ExactDJIndex, LSHDJIndex, build_dj_index
+from match_app.features import normalize_rows
+
+
+@pytest.fixture
+def dj_unit_matrix():
+    # DJs in clusters of similar taste, as scaled DJ feature vectors are
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal((40, 14))
+    djs = centers[rng.integers(0, len(centers), 2000)] + rng.standard_normal((2000, 14)) * 0.4
+    return normalize_rows(djs)
+
+
+def top_k(dj_unit_matrix, query, k, candidates=None):
+    """
+    :return: Set of the indices of the k DJs most similar to the query, among the candidates (every DJ if None)
+    """
+
+    indices = np.arange(len(dj_unit_matrix)) if candidates is None else candidates
+    similarities = dj_unit_matrix[indices] @ query
+    return set(indices[np.argsort(-similarities, kind='stable')[:k]].tolist())
+
+
+def test_lsh_recall_against_brute_force(dj_unit_matrix):
+    k = 5
+    rng = np.random.default_rng(2)
+    queries = normalize_rows(dj_unit_matrix[rng.integers(0, len(dj_unit_matrix), 200)] +
+                             rng.standard_normal((200, dj_unit_matrix.shape[1])) * 0.1)
+
+    index = LSHDJIndex(dj_unit_matrix)
+    candidates = index.candidates(queries, k)
+
+    hits = sum(len(top_k(dj_unit_matrix, query, k) & top_k(dj_unit_matrix, query, k, found))
+               for query, found in zip(queries, candidates))
+    assert hits / (k * len(queries)) >= 0.9
+
+    # The index only pays off if it scores far fewer DJs than brute force
+    num_scored = [len(dj_unit_matrix) if found is None else len(found) for found in candidates]
+    assert np.mean(num_scored) < len(dj_unit_matrix) / 2
+
+
+def test_lsh_falls_back_to_every_dj_when_candidates_are_too_few(dj_unit_matrix):
+    index = LSHDJIndex(dj_unit_matrix, num_tables=1, num_bits=16, probes=0)
+    assert index.candidates(dj_unit_matrix[:1], len(dj_unit_matrix)) == [None]
+
+
+def test_backend_is_picked_by_env(dj_unit_matrix, monkeypatch):
+    assert isinstance(build_dj_index(dj_unit_matrix), ExactDJIndex)
+
+    monkeypatch.setenv('DJ_INDEX', 'lsh')
+    assert isinstance(build_dj_index(dj_unit_matrix), LSHDJIndex)
+
+    monkeypatch.setenv('DJ_INDEX', 'annoy')
+    with pytest.raises(ValueError):
+        build_dj_index(dj_unit_matrix)
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from match_app import ingest, match_model
+from match_app.ingest import REQUIRED_SPIN_COLS, ingest_spins
+from match_app.match_model import MatchModel, check_drift, get_model
+from match_app.profiles import ProfileAccumulator
+from conftest import TRACKS_CSV
+
+
+@pytest.fixture
+def spin_log(tracks_csv, monkeypatch):
+    monkeypatch.setattr(ingest, 'get_model', lambda: None)  # Only the spin log is under test
+    return os.environ['MATCH_SPIN_LOG_PATH']
+
+
+@pytest.fixture
+def spin():
+    return pd.read_csv(TRACKS_CSV, nrows=1)[REQUIRED_SPIN_COLS].iloc[0].to_dict()
+
+
+def count_headers(path):
+    with open(path) as f:
+        return sum(line.startswith('Playlist Title,') for line in f)
+
+
+def test_spins_are_appended_under_one_header(spin_log, spin):
+    assert ingest_spins(spin) == 1
+    assert ingest_spins([spin, spin]) == 2
+
+    assert count_headers(spin_log) == 1
+    assert len(pd.read_csv(spin_log)) == 3
+
+
+def test_header_is_not_repeated_when_another_worker_wrote_it_first(spin_log, spin, monkeypatch):
+    flock = ingest.fcntl.flock
+    columns = pd.read_csv(TRACKS_CSV, nrows=0).columns
+
+    def flock_after_other_worker(file, operation):
+        # Another worker writes its first spins (and the header) between this one opening the empty log and locking it
+        if operation == ingest.fcntl.LOCK_EX and not os.path.getsize(spin_log):
+            with open(spin_log, 'a') as other:
+                other.write(pd.DataFrame([spin]).reindex(columns=columns).to_csv(index=False))
+        flock(file, operation)
+
+    monkeypatch.setattr(ingest.fcntl, 'flock', flock_after_other_worker)
+    ingest_spins(spin)
+
+    assert count_headers(spin_log) == 1
+    assert len(pd.read_csv(spin_log)) == 2
+
+
+@pytest.mark.parametrize('col, value, message', [
+    ('bpm', None, 'missing feature values'),
+    ('happy', 2, 'not 0 or 1'),
+    ('happy', 0.5, 'not 0 or 1'),
+    ('happy_confidence', 1.5, 'outside'),
+    ('sad_confidence', -0.1, 'outside'),
+])
+def test_invalid_spins_are_rejected(spin_log, spin, col, value, message):
+    spin[col] = value
+    with pytest.raises(ValueError, match=message):
+        ingest_spins([spin])
+    assert not os.path.exists(spin_log)
+
+
+def test_spins_without_required_columns_are_rejected(spin_log, spin):
+    del spin['artist_id']
+    with pytest.raises(ValueError, match='missing columns'):
+        ingest_spins(spin)
+    assert not os.path.exists(spin_log)
+
+
+@pytest.fixture
+def served_model(tracks_csv, monkeypatch):
+    """
+    :return: The process-wide model, freshly built from the tracks CSV
+    """
+
+    monkeypatch.setattr(match_model, '_model', None)
+    monkeypatch.setattr(match_model, '_failed_stamp', None)
+    return get_model()
+
+
+@pytest.fixture
+def new_spins():
+    """
+    :return: List of spin dicts (every tracks CSV column): replays of existing DJs' tracks, and tracks of a new DJ, one
+        by an artist the station never played
+    """
+
+    tracks_df = pd.read_csv(TRACKS_CSV)
+    replays = tracks_df.iloc[[0, 100, 2000]].copy()
+    new_dj = tracks_df.iloc[[5, 6]].copy()
+    new_dj['DJ ID'] = 999999
+    new_dj['DJ Name'] = 'New DJ'
+    new_dj['Date'] = 'Oct 1, 2024'
+    new_dj.iloc[1, new_dj.columns.get_loc('artist_id')] = '00000000-0000-4000-8000-000000000000'
+    return pd.concat([replays, new_dj]).to_dict('records')
+
+
+def assert_models_match(model, expected):
+    assert list(model.profiles.dj_ids) == list(expected.profiles.dj_ids)
+    np.testing.assert_allclose(model.dj_matrix, expected.dj_matrix, equal_nan=True)
+    np.testing.assert_allclose(model.scaler_mean, expected.scaler_mean)
+    np.testing.assert_allclose(model.scaler_scale, expected.scaler_scale)
+    for mood, centroid in expected.mood_centroids.items():
+        np.testing.assert_allclose(model.mood_centroids[mood], centroid, equal_nan=True)
+
+    # Artist columns may be in a different order
+    assert set(model.artist_index.artist_ids) == set(expected.artist_index.artist_ids)
+    order = [model.artist_index.artist_columns[artist_id] for artist_id in expected.artist_index.artist_ids]
+    np.testing.assert_array_equal(model.artist_index.play_counts[:, order].toarray(),
+                                  expected.artist_index.play_counts.toarray())
+
+
+def test_ingested_spins_update_the_served_model_like_a_full_recompute(tracks_csv, served_model, new_spins):
+    assert ingest_spins(new_spins) == len(new_spins)
+
+    model = get_model()
+    assert model is not served_model
+    assert model.spin_log_offset == os.path.getsize(os.environ['MATCH_SPIN_LOG_PATH'])
+    assert 999999 in model.profiles.dj_rows
+    assert '00000000-0000-4000-8000-000000000000' in model.artist_index.artist_columns
+
+    # Every track of the CSV plus the spins, profiled from scratch
+    all_tracks_df = pd.concat([pd.read_csv(tracks_csv), pd.DataFrame(new_spins)], ignore_index=True)
+    assert_models_match(model, MatchModel(ProfileAccumulator.from_tracks(all_tracks_df)))
+    assert_models_match(model, match_model.load_model())
+    new_dj_songs = [f"{spin['Song']} - {spin['Artist']}" for spin in new_spins[3:]]
+    assert sorted(model.get_recent_songs(999999)) == sorted(new_dj_songs)
+
+
+def test_get_model_applies_spins_appended_since_it_was_built(served_model, new_spins):
+    ingest_spins(new_spins[:3])
+    first = get_model()
+    ingest_spins(new_spins[3:])
+    second = get_model()
+
+    assert 999999 not in first.profiles.dj_rows
+    assert 999999 in second.profiles.dj_rows
+    assert first.profiles.num_spins + 2 == second.profiles.num_spins
+    assert get_model() is second  # Nothing new to apply
+
+
+def test_no_drift_after_ingestion(served_model, new_spins):
+    ingest_spins(new_spins)
+    model = get_model()
+
+    assert check_drift() == {'dj_features': 0.0, 'mood_centroids': 0.0, 'play_counts': 0.0}
+    assert get_model() is model  # Nothing was swapped in
@@ -0,0 +1,49 @@
+import gevent
+import pytest
+from match_app.jobs import LocalJobQueue
+
+PAYLOAD = {'mood': 'happy', 'artists': [{'mbid': 'a'}, {'mbid': 'b'}], 'spider_figure': False}
+
+
+def wait_for(queue, job_id):
+    for _ in range(100):
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        gevent.sleep(0.01)
+    pytest.fail(f'Job {job_id} did not finish')
+
+
+def test_identical_inputs_share_one_job():
+    runs = []
+    queue = LocalJobQueue(lambda payload: runs.append(payload) or {'matches': []}, num_workers=2, ttl=60)
+
+    job = queue.submit(PAYLOAD)
+    same = queue.submit({'mood': 'Happy', 'artists': [{'mbid': 'b'}, {'mbid': 'a'}], 'spider_figure': False})
+    other = queue.submit({**PAYLOAD, 'mood': 'sad'})
+
+    assert same['job_id'] == job['job_id']
+    assert other['job_id'] != job['job_id']
+    assert wait_for(queue, job['job_id']) == {'job_id': job['job_id'], 'status': 'done', 'results': {'matches': []}}
+    wait_for(queue, other['job_id'])
+    assert len(runs) == 2
+
+    # Done jobs are served to identical inputs until they expire
+    assert queue.submit(PAYLOAD)['job_id'] == job['job_id']
+    assert len(runs) == 2
+
+
+def test_failed_and_expired_jobs_are_rerun():
+    def fail(payload):
+        raise ValueError('No tracks')
+
+    queue = LocalJobQueue(fail, num_workers=1, ttl=60)
+    failed = queue.submit(PAYLOAD)
+    assert wait_for(queue, failed['job_id'])['error'] == 'No tracks'
+    assert queue.submit(PAYLOAD)['job_id'] != failed['job_id']
+
+    queue = LocalJobQueue(lambda payload: {}, num_workers=1, ttl=0)
+    done = queue.submit(PAYLOAD)
+    gevent.sleep(0.05)  # Lets the job finish, and expire right away
+    assert queue.get(done['job_id']) is None
+    assert queue.submit(PAYLOAD)['job_id'] != done['job_id']
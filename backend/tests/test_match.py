@@ -0,0 +1,28 @@
+import pytest
+from match_app import match_model
+from match_app.match import get_matches_batch, match_user
+from match_app.match_model import get_model
+
+PROFILES = [{'mood': 'Happy', 'artists': []}, {'mood': 'sad', 'artists': [{'mbid': 'a', 'name': 'A'}]}]
+
+
+@pytest.fixture
+def model(tracks_csv, monkeypatch):
+    monkeypatch.setattr(match_model, '_model', None)
+    monkeypatch.setattr(match_model, '_failed_stamp', None)
+    return get_model()
+
+
+def test_batch_matches_each_profile_like_a_single_match(model):
+    matches = get_matches_batch(PROFILES, enrich_artists=False)
+
+    for profile, profile_matches in zip(PROFILES, matches):
+        matched_djs, _, _ = match_user(model, profile['mood'], profile['artists'], [])
+        assert [dj['dj_id'] for dj in profile_matches] == [dj['dj_id'] for dj in matched_djs]
+        assert [dj['similarity'] for dj in profile_matches] == pytest.approx([dj['similarity'] for dj in matched_djs])
+
+
+def test_batch_prints_nothing_per_profile(model, capsys):
+    capsys.readouterr()
+    get_matches_batch(PROFILES * 50, enrich_artists=False)
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,50 @@
+import gevent
+import pytest
+from api_helpers import service_limits
+from api_helpers.service_limits import LocalBucketStore, ServiceLimiter, background_calls, new_bucket_state, take_token
+
+
+@pytest.fixture(autouse=True)
+def local_buckets(monkeypatch):
+    monkeypatch.setattr(service_limits, '_bucket_store', LocalBucketStore())
+
+
+def test_reserve_is_left_in_the_bucket():
+    state = new_bucket_state(3)
+    now = state['updated']
+
+    assert take_token(state, 1.0, 3, now, reserve=2) == 0
+    assert take_token(state, 1.0, 3, now, reserve=2) == pytest.approx(1.0)  # 2 tokens left, all reserved
+    assert take_token(state, 1.0, 3, now) == 0
+
+
+def test_calls_serving_requests_go_before_waiting_background_calls():
+    limiter = ServiceLimiter('test', concurrency=1, rate=1000.0, burst=1000)
+    order = []
+
+    def call(name):
+        with limiter.slot():
+            order.append(name)
+            gevent.sleep(0.02)
+
+    def background_call(name):
+        with background_calls():
+            call(name)
+
+    first = gevent.spawn(background_call, 'background 1')
+    gevent.sleep(0.005)  # The first background call holds the only slot
+    waiting = gevent.spawn(background_call, 'background 2')
+    gevent.sleep(0.005)
+    live = gevent.spawn(call, 'live')
+    gevent.joinall([first, waiting, live], raise_error=True)
+
+    assert order == ['background 1', 'live', 'background 2']
+
+
+def test_background_marker_reaches_spawned_greenlets():
+    def run():
+        with background_calls():
+            return gevent.spawn(service_limits.is_background_call).get()
+
+    assert gevent.spawn(run).get()
+    assert not gevent.spawn(service_limits.is_background_call).get()
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+import pytest
+from match_app import show_responses
+from match_app.show_responses import get_show_responses
+
+RESPONSE = {'dj_id': 1, 'show_name': 'Night Shift'}
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    """
+    :return: Fake show_responses collection, whose `fail` flag makes finds raise, and a clock driving the cache
+    """
+
+    class Collection:
+        fail = True
+        finds = 0
+
+        def find(self, query, projection):
+            self.finds += 1
+            if self.fail:
+                raise ConnectionError('MongoDB unreachable')
+            return [RESPONSE]
+
+    fake = Collection()
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(show_responses, 'get_db', lambda: {'djs': {'show_responses': fake}})
+    monkeypatch.setattr(show_responses, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(show_responses, '_show_responses', None)
+    monkeypatch.setattr(show_responses, '_loaded_pid', None)
+    monkeypatch.setenv('SHOW_RESPONSES_REFRESH', '300')
+    monkeypatch.delenv('SHOW_RESPONSES_WATCH', raising=False)
+    return fake, clock
+
+
+def test_failed_reload_is_retried_after_a_short_backoff(collection):
+    fake, clock = collection
+    fallback = {2: {'dj_id': 2}}
+
+    assert get_show_responses(fallback) == fallback
+    assert fake.finds == 1
+
+    # The failure isn't cached as a fresh copy for a full refresh interval, only for the backoff
+    clock.now += 5
+    assert get_show_responses(fallback) == fallback
+    assert fake.finds == 1
+
+    clock.now += 6
+    assert get_show_responses(fallback) == fallback
+    assert fake.finds == 2
+
+    fake.fail = False
+    clock.now += 11
+    assert get_show_responses(fallback) == {1: RESPONSE}
+    assert fake.finds == 3
+
+    # A successful reload is then kept for the full refresh interval
+    clock.now += 299
+    assert get_show_responses(fallback) == {1: RESPONSE}
+    assert fake.finds == 3
+
+
+def test_failed_refresh_keeps_the_last_copy(collection):
+    fake, clock = collection
+    fake.fail = False
+    assert get_show_responses() == {1: RESPONSE}
+
+    fake.fail = True
+    clock.now += 300
+    assert get_show_responses() == {1: RESPONSE}
+    assert fake.finds == 2
+
+    clock.now += 10
+    assert get_show_responses() == {1: RESPONSE}
+    assert fake.finds == 3
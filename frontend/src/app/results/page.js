@@ -11,13 +11,15 @@ export default function Results() {
   const [matchData, setMatchData] = useState({});
   const [error, setError] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isRefining, setIsRefining] = useState(false);
 
-  const fetchWithTimeout = async (url, timeout = 30000) => {
+  const fetchWithTimeout = async (url, timeout = 30000, options = {}) => {
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), timeout);
 
     try {
       const response = await fetch(url, {
+        ...options,
         signal: controller.signal
       });
       clearTimeout(timeoutId);
@@ -28,6 +30,84 @@ export default function Results() {
     }
   };
 
+  // Starts a match job, then polls it until its results are ready (rather than holding one request open for the
+  // whole match)
+  const fetchMatchResults = async (pollInterval = 1000, maxWait = 120000) => {
+    const response = await fetchWithTimeout('/api/results/jobs', 10000, {method: 'POST'});
+    if (response.status === 503) {
+      // The backend can't run match jobs (e.g. in-process jobs with several workers), so match synchronously instead
+      const syncResponse = await fetchWithTimeout('/api/results', 45000);
+      if (!syncResponse.ok) {
+        throw new Error('Network response was not ok. Please try again!');
+      }
+      return await syncResponse.json();
+    }
+    if (!response.ok) {
+      throw new Error('Network response was not ok. Please try again!');
+    }
+    const {job_id} = await response.json();
+
+    const deadline = new Date().getTime() + maxWait;
+    while (new Date().getTime() < deadline) {
+      const pollResponse = await fetchWithTimeout(`/api/results/jobs/${job_id}`, 10000);
+      if (pollResponse.status === 404) {
+        throw new Error('The match results expired. Please try again!');
+      }
+      if (!pollResponse.ok) {
+        throw new Error('Network response was not ok. Please try again!');
+      }
+      const job = await pollResponse.json();
+      if (job.status === 'done') {
+        return {results: job.results};
+      }
+      if (job.status === 'failed') {
+        throw new Error('The match failed. Please try again!');
+      }
+      await new Promise(resolve => setTimeout(resolve, pollInterval));
+    }
+    throw new Error('The match is taking too long. Please try again!');
+  };
+
+  // Streams the match: shows the mood-only ranking right away and refines it as the artists are enriched, until the
+  // full results arrive. Falls back to a match job if streaming isn't available.
+  const streamMatchResults = () => new Promise((resolve, reject) => {
+    if (typeof EventSource === 'undefined') {
+      reject(new Error('Streaming is not supported'));
+      return;
+    }
+
+    const source = new EventSource('/api/results/stream');
+    source.addEventListener('ranking', (event) => {
+      const ranking = JSON.parse(event.data);
+      setMatchData(ranking);
+      setIsRefining(true);
+      setIsLoading(false);
+    });
+    source.addEventListener('results', (event) => {
+      source.close();
+      resolve({results: JSON.parse(event.data)});
+    });
+    source.addEventListener('failed', () => {
+      source.close();
+      reject(new Error('The match failed. Please try again!'));
+    });
+    source.onerror = () => {
+      source.close();
+      reject(new Error('The results stream was interrupted'));
+    };
+  });
+
+  const fetchLatestResults = async () => {
+    try {
+      return await streamMatchResults();
+    } catch (streamError) {
+      console.warn('Falling back to a match job:', streamError);
+      return await fetchMatchResults();
+    } finally {
+      setIsRefining(false);
+    }
+  };
+
   useEffect(() => {
     const fetchResults = async () => {
       try {
@@ -48,11 +128,7 @@ export default function Results() {
           }
         }
 
-        const response = await fetchWithTimeout('/api/results', 45000);
-        if (!response.ok) {
-          throw new Error('Network response was not ok. Please try again!');
-        }
-        const data = await response.json();
+        const data = await fetchLatestResults();
 
         try {
           localStorage.setItem('djMatchResults', JSON.stringify({
@@ -93,11 +169,7 @@ export default function Results() {
       setError(null);
       localStorage.removeItem('djMatchResults');
 
-      const response = await fetchWithTimeout('/api/results', 45000);
-      if (!response.ok) {
-        throw new Error('Network response was not ok. Please try again!');
-      }
-      const data = await response.json();
+      const data = await fetchLatestResults();
 
       localStorage.setItem('djMatchResults', JSON.stringify({
         results: data.results,
@@ -156,6 +228,11 @@ export default function Results() {
             <h1 className="text-3xl sm:text-4xl md:text-4xl lg:text-4xl xl:text-4xl -tracking-tight italic font-bold mb-8 bg-gradient-to-r from-purple-400 via-red-400 to-orange-400 bg-clip-text text-transparent">
               Your DJ Match is...
             </h1>
+            {isRefining && (
+                <p className="-mt-6 mb-6 text-sm text-gray-400 animate-pulse">
+                  Refining your match with your artists ({matchData.enriched}/{matchData.num_artists})...
+                </p>
+            )}
 
             {/* Hero Component */}
             <Hero
@@ -204,7 +281,7 @@ export default function Results() {
                 </h2>
               </div>
               <ul className="space-y-4">
-                {matchData.recent_songs.map((track, index) => (
+                {(matchData.recent_songs || []).map((track, index) => (
                     <li
                         key={index}
                         className="flex items-center space-x-4 group cursor-pointer"
@@ -283,7 +360,7 @@ export default function Results() {
           </div>
 
           {/* Match Analysis */}
-          <MatchAnalysis figure={matchData.spider_fig}/>
+          <MatchAnalysis figure={matchData.spider_fig} spiderData={matchData.spider_data}/>
         </div>
       </>
   );
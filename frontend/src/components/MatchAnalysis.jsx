@@ -50,11 +50,66 @@ function CollapsibleDetails() {
   );
 }
 
-export default function MatchAnalysis({ figure }) {
+// The static spider plot layout only changes with its version, so it is fetched once and cached
+const SPIDER_LAYOUT_KEY = 'spiderLayout';
+
+async function fetchSpiderLayout(version) {
+  try {
+    const cached = JSON.parse(localStorage.getItem(SPIDER_LAYOUT_KEY));
+    if (cached?.version === version) {
+      return cached;
+    }
+  } catch (storageError) {
+    console.warn('Failed to read cached spider layout:', storageError);
+  }
+
+  const response = await fetch('/api/spider-layout');
+  if (!response.ok) {
+    throw new Error('Failed to fetch spider layout');
+  }
+  const spiderLayout = await response.json();
+
+  try {
+    localStorage.setItem(SPIDER_LAYOUT_KEY, JSON.stringify(spiderLayout));
+  } catch (storageError) {
+    console.warn('Failed to cache spider layout:', storageError);
+  }
+  return spiderLayout;
+}
+
+// Merges the spider plot's feature vectors with the static layout into a Plotly figure
+function buildSpiderFigure(spiderData, spiderLayout) {
+  const trace = {...spiderLayout.trace, theta: spiderLayout.theta};
+  return {
+    data: [
+      {...trace, r: spiderData.user, name: 'You'},
+      {...trace, r: spiderData.dj, name: spiderData.dj_name},
+    ],
+    layout: spiderLayout.layout,
+  };
+}
+
+export default function MatchAnalysis({ figure, spiderData }) {
   const containerRef = useRef(null);
   const [dimensions, setDimensions] = useState({ width: 0, height: 0 });
+  const [spiderLayout, setSpiderLayout] = useState(null);
+
+  // Results carry either the lightweight spider data or a full server-side figure
+  let figureObj = null;
+  if (spiderData && spiderLayout) {
+    figureObj = buildSpiderFigure(spiderData, spiderLayout);
+  } else if (figure) {
+    figureObj = JSON.parse(figure);
+  }
 
-  const figureObj = JSON.parse(figure);
+  useEffect(() => {
+    if (!spiderData) {
+      return;
+    }
+    fetchSpiderLayout(spiderData.layout_version)
+      .then(setSpiderLayout)
+      .catch((error) => console.error('Error fetching spider layout:', error));
+  }, [spiderData?.layout_version]);
 
   useEffect(() => {
     const updateSize = () => {
@@ -85,7 +140,7 @@ export default function MatchAnalysis({ figure }) {
   }, []);
 
   const getResponsiveLayout = () => {
-    const baseLayout = figureObj.layout || {};
+    const baseLayout = figureObj?.layout || {};
 
     return {
       ...baseLayout,